@@ -0,0 +1,178 @@
+import math
+import time
+import json
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any
+
+from metrics import ADMISSION_QUEUE_DEPTH, ADMISSION_IN_FLIGHT, ADMISSION_WAIT_SECONDS, ADMISSION_REJECTED
+
+# Longest Retry-After we send; a bucket that never refills (rate 0) would otherwise say "forever"
+MAX_RETRY_AFTER = 3600.0
+
+
+class Rejected(Exception):
+    """A request turned away by admission control, with the status and Retry-After to answer."""
+
+    def __init__(self, status: int, detail: str, retry_after: float, reason: str):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class RateLimiter:
+    """
+    Token bucket per client: `burst` requests at once, refilled at `rate` per second.
+    Buckets live in an LRU bounded by `max_clients`, so a scan of spoofed IPs can't grow it forever.
+    """
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        # client -> (tokens, updated_at)
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    def acquire(self, client: str) -> float:
+        """Take a token for `client`. Returns 0 if allowed, else seconds until the next token."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = min((1 - tokens) / self.rate, MAX_RETRY_AFTER) if self.rate > 0 else MAX_RETRY_AFTER
+            self._buckets[client] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class Admission:
+    """
+    Admission control for one expensive endpoint:
+
+    - per-client rate limit (429 when a client's bucket is empty)
+    - at most `max_concurrent` requests in flight; up to `max_queue` more wait in FIFO order
+      for at most `max_wait` seconds (503 when the queue is full or the wait runs out)
+    """
+
+    def __init__(self, name: str, rate_per_min: float, burst: float, max_concurrent: int,
+                 max_queue: int, max_wait: float):
+        self.name = name
+        self.limiter = RateLimiter(rate_per_min / 60, burst)
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._waiting = 0
+        self._in_flight = 0
+        self._counts = {"admitted": 0, "queued": 0, "rate_limited": 0, "queue_full": 0, "queue_timeout": 0}
+
+    def _reject(self, status: int, detail: str, retry_after: float, reason: str) -> Rejected:
+        self._counts[reason] += 1
+        ADMISSION_REJECTED.labels(self.name, reason).inc()
+        return Rejected(status, detail, retry_after, reason)
+
+    async def enter(self, client: str):
+        """Wait for a slot; raises Rejected instead of queueing without bound."""
+        wait = self.limiter.acquire(client)
+        if wait > 0:
+            raise self._reject(429, "Too many requests, slow down", wait, "rate_limited")
+
+        if self._slots.locked():
+            if self._waiting >= self.max_queue:
+                raise self._reject(503, "Server busy, try again shortly", self.max_wait, "queue_full")
+            self._counts["queued"] += 1
+        self._waiting += 1
+        ADMISSION_QUEUE_DEPTH.labels(self.name).inc()
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            raise self._reject(503, "Server busy, try again shortly", self.max_wait, "queue_timeout")
+        finally:
+            self._waiting -= 1
+            ADMISSION_QUEUE_DEPTH.labels(self.name).dec()
+            ADMISSION_WAIT_SECONDS.labels(self.name).observe(time.monotonic() - start)
+
+        self._in_flight += 1
+        self._counts["admitted"] += 1
+        ADMISSION_IN_FLIGHT.labels(self.name).inc()
+
+    def leave(self):
+        self._in_flight -= 1
+        ADMISSION_IN_FLIGHT.labels(self.name).dec()
+        self._slots.release()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            **self._counts,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "clients": len(self.limiter),
+        }
+
+
+def client_key(scope, trust_forwarded: bool = False, api_keys: frozenset[str] = frozenset()) -> str:
+    """
+    The client's X-API-Key if it is one of `api_keys`, else its IP (the first X-Forwarded-For
+    hop behind a proxy). Unknown keys are ignored: a client could mint a fresh bucket per request.
+    """
+    headers = dict(scope.get("headers") or [])
+    api_key = headers.get(b"x-api-key", b"").decode("latin-1")
+    if api_key and api_key in api_keys:
+        return "key:" + api_key
+    if trust_forwarded and b"x-forwarded-for" in headers:
+        return "ip:" + headers[b"x-forwarded-for"].decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying an Admission per path to POST requests.
+
+    Runs before the body is read, so rejected uploads cost nothing, and holds the slot
+    until the response is fully sent, streamed (SSE) bodies included.
+    """
+
+    def __init__(self, app, routes: dict[str, Admission], trust_forwarded: bool = False,
+                 api_keys: frozenset[str] = frozenset()):
+        self.app = app
+        self.routes = routes
+        self.trust_forwarded = trust_forwarded
+        self.api_keys = api_keys
+
+    async def __call__(self, scope, receive, send):
+        admission = self.routes.get(scope.get("path")) if scope["type"] == "http" and scope["method"] == "POST" else None
+        if admission is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await admission.enter(client_key(scope, self.trust_forwarded, self.api_keys))
+        except Rejected as e:
+            await send({
+                "type": "http.response.start",
+                "status": e.status,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"retry-after", str(max(1, math.ceil(min(e.retry_after, MAX_RETRY_AFTER)))).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": json.dumps({"detail": e.detail}).encode()})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission.leave()
@@ -0,0 +1,103 @@
+"""
+Payload size and serialization time of /recommendations-multi responses.
+
+Builds a tops / bottoms / accessories response from json_samples/searched_sample.json with
+the same parser and reasons the endpoint uses, then reports for each response mode
+(full, compact, compact + fields) the encoded size raw / gzip / brotli and the time to
+encode it with the stdlib encoder (Starlette's JSONResponse) and with payload.dumps.
+
+Usage (from backend/):
+
+    python -m bench.payload
+    python -m bench.payload --per-category 10 --fields id,title,price,imageUrl,productUrl
+"""
+import os
+import json
+import gzip
+import timeit
+import argparse
+from pathlib import Path
+
+# shopfiy_mcp_example checks its env at import; the parser used here needs none of it
+for var in ("SHOPIFY_CLIENT_ID", "SHOPIFY_CLIENT_SECRET", "SHOPIFY_SAVED_CATALOG"):
+    os.environ.setdefault(var, "bench")
+
+from shopfiy_mcp_example import parse_shopify_offers_to_recommendations
+from payload import dumps, parse_fields, compact_recommendations
+from compression import brotli
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+PROFILE = json.loads((BACKEND_DIR / "json_samples" / "evaluated_sample.json").read_text())["profile"]
+PRODUCTS = json.loads((BACKEND_DIR / "json_samples" / "searched_sample.json").read_text())["results"]
+
+CATEGORIES = ("tops", "bottoms", "accessories")
+
+
+def full_response(per_category: int) -> dict:
+    results = {}
+    colors_str = ", ".join(PROFILE["colors"])
+    for category in CATEGORIES:
+        offers = []
+        for i in range(per_category):
+            offer = json.loads(json.dumps(PRODUCTS[i % len(PRODUCTS)]))
+            offer["id"] = f"{offer['id']}-{category}-{i}"
+            offers.append(offer)
+        reasons = [
+            f"Perfect {category} for {PROFILE['name']}",
+            f"Complements your palette: {colors_str}",
+            f"Great for {PROFILE['fit']}",
+        ]
+        results[category] = parse_shopify_offers_to_recommendations({"offers": offers}, reasons=reasons)
+    return {"results": results, "failed": [], "degraded": []}
+
+
+def stdlib_dumps(value) -> bytes:
+    # What Starlette's JSONResponse does
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+
+def encode_time_us(encode, value, number: int) -> float:
+    return min(timeit.repeat(lambda: encode(value), number=number, repeat=5)) / number * 1e6
+
+
+def measure(mode: str, body: dict, number: int) -> dict:
+    raw = stdlib_dumps(body)
+    return {
+        "mode": mode,
+        "raw_bytes": len(raw),
+        "gzip_bytes": len(gzip.compress(raw, compresslevel=6)),
+        "br_bytes": len(brotli.compress(raw, quality=5)) if brotli is not None else None,
+        "stdlib_us": round(encode_time_us(stdlib_dumps, body, number), 1),
+        "dumps_us": round(encode_time_us(dumps, body, number), 1),
+    }
+
+
+def main(args: argparse.Namespace):
+    full = full_response(args.per_category)
+    compact_results, reasons = compact_recommendations(full["results"])
+    fields_results, fields_reasons = compact_recommendations(full["results"], parse_fields(args.fields))
+    rows = [
+        measure("full", full, args.number),
+        measure("compact", {**full, "results": compact_results, "reasons": reasons}, args.number),
+        measure("compact+fields", {**full, "results": fields_results, "reasons": fields_reasons}, args.number),
+    ]
+
+    header = f"{'mode':<16}{'raw B':>9}{'gzip B':>9}{'br B':>9}{'json us':>10}{'dumps us':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(
+            f"{r['mode']:<16}{r['raw_bytes']:>9}{r['gzip_bytes']:>9}{str(r['br_bytes'] or '-'):>9}"
+            f"{r['stdlib_us']:>10}{r['dumps_us']:>10}"
+        )
+    if args.json:
+        Path(args.json).write_text(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--per-category", type=int, default=5, help="recommendations per category")
+    parser.add_argument("--fields", default="id,title,price,imageUrl,productUrl,vendor", help="projection for the compact+fields mode")
+    parser.add_argument("--number", type=int, default=200, help="encodes per timing run")
+    parser.add_argument("--json", help="also write results to this file")
+    main(parser.parse_args())
@@ -0,0 +1,268 @@
+"""
+Offline load test for the FitCheck backend.
+
+Starts the upstream stubs (bench/stubs.py) and the backend (uvicorn main:app) as
+subprocesses, points the backend at the stubs, then drives each scenario at each
+concurrency level and reports throughput, latency percentiles and backend memory.
+
+Usage (from backend/):
+
+    python -m bench.run
+    python -m bench.run --scenarios eval-style,recommendations-multi --concurrency 1,8,32 --requests 200
+    python -m bench.run --openrouter-latency-ms 1500 --shopify-error-rate 0.05 --json results.json
+    python -m bench.run --warm-caches      # keep the backend's caches on (default: disabled)
+    python -m bench.run --admission        # keep per-client rate limits and queues on (default: disabled)
+"""
+import os
+import sys
+import json
+import time
+import random
+import signal
+import socket
+import asyncio
+import argparse
+import subprocess
+import tempfile
+from io import BytesIO
+from pathlib import Path
+
+import httpx
+import numpy as np
+from PIL import Image
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+PROFILE = json.loads((BACKEND_DIR / "json_samples" / "evaluated_sample.json").read_text())["profile"]
+
+SCENARIOS = ("eval-style", "search-terms", "recommendations", "recommendations-multi")
+
+# Backend caches set to zero entries, so every request does the full work
+NO_CACHE_ENV = {
+    "STYLE_CACHE_MAX_ENTRIES": "0",
+    "SEARCH_TERMS_CACHE_MAX_ENTRIES": "0",
+    "SHOPIFY_SEARCH_CACHE_MAX_ENTRIES": "0",
+    # Parked prefetch answers would serve /recommendations-multi like a cache
+    "PREFETCH_RECOMMENDATIONS": "0",
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def outfit_photo(seed: int, size: tuple[int, int] = (1200, 1600)) -> bytes:
+    """A synthetic outfit photo: light backdrop, a figure in two random colors, some noise."""
+    rng = np.random.default_rng(seed)
+    w, h = size
+    img = np.full((h, w, 3), rng.integers(200, 250), dtype=np.uint8)
+    img[h // 6:h // 2, w // 3:2 * w // 3] = rng.integers(0, 256, 3)
+    img[h // 2:9 * h // 10, 3 * w // 8:5 * w // 8] = rng.integers(0, 256, 3)
+    img = np.clip(img.astype(np.int16) + rng.integers(-12, 12, img.shape), 0, 255).astype(np.uint8)
+    buf = BytesIO()
+    Image.fromarray(img).save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def style_request() -> dict:
+    return {
+        "style_name": PROFILE["name"],
+        "colors": PROFILE["colors"],
+        "fit": PROFILE["fit"],
+        "textures": PROFILE["textures"],
+        "accessories": PROFILE["accessories"],
+        "hexcolors": PROFILE["hexcolors"],
+    }
+
+
+class Workload:
+    def __init__(self, images_per_request: int, photo_pool: int):
+        print(f"Generating {photo_pool} test photos...", flush=True)
+        self.photos = [outfit_photo(seed) for seed in range(photo_pool)]
+        self.images_per_request = images_per_request
+
+    async def send(self, client: httpx.AsyncClient, scenario: str) -> httpx.Response:
+        if scenario == "eval-style":
+            picks = random.sample(range(len(self.photos)), self.images_per_request)
+            files = [("images", (f"fit{i}.jpg", self.photos[i], "image/jpeg")) for i in picks]
+            return await client.post("/eval-style", files=files)
+        if scenario == "search-terms":
+            return await client.post("/search-terms", json={"profile": PROFILE})
+        if scenario == "recommendations":
+            return await client.post("/recommendations", json=style_request())
+        if scenario == "recommendations-multi":
+            return await client.post("/recommendations-multi", json=style_request())
+        raise ValueError(f"Unknown scenario {scenario}")
+
+
+def process_memory(pid: int) -> dict[str, float]:
+    """Current and peak resident memory of a process, in MB (Linux /proc)."""
+    fields = {}
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                fields[key] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return {"rss_mb": round(fields.get("VmRSS", 0.0), 1), "peak_rss_mb": round(fields.get("VmHWM", 0.0), 1)}
+
+
+def percentile(values: list[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+async def run_level(base_url: str, workload: Workload, scenario: str, concurrency: int,
+                    requests: int, timeout: float, pid: int) -> dict:
+    latencies = []
+    errors: dict[str, int] = {}
+    remaining = requests
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                start = time.perf_counter()
+                try:
+                    resp = await workload.send(client, scenario)
+                    if resp.status_code >= 400:
+                        errors[str(resp.status_code)] = errors.get(str(resp.status_code), 0) + 1
+                        continue
+                except httpx.HTTPError as e:
+                    errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                    continue
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": requests,
+        "ok": len(latencies),
+        "errors": errors,
+        "req_per_s": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        **process_memory(pid),
+    }
+
+
+def start(cmd: list[str], env: dict[str, str], log_path: Path) -> subprocess.Popen:
+    log = open(log_path, "w")
+    return subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_ready(url: str, proc: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{url} exited with {proc.returncode}, see the bench logs")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def stop(proc: subprocess.Popen):
+    if proc.poll() is None:
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def print_table(results: list[dict]):
+    header = f"{'scenario':<24}{'conc':>5}{'ok':>6}{'err':>5}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'rss MB':>9}{'peak MB':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['scenario']:<24}{r['concurrency']:>5}{r['ok']:>6}{sum(r['errors'].values()):>5}"
+            f"{r['req_per_s']:>9}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}"
+            f"{r['rss_mb']:>9}{r['peak_rss_mb']:>9}"
+        )
+
+
+async def main(args: argparse.Namespace):
+    stub_port, app_port = free_port(), free_port()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    app_url = f"http://127.0.0.1:{app_port}"
+    log_dir = Path(args.log_dir)
+    log_dir.mkdir(parents=True, exist_ok=True)
+
+    stub_env = {
+        **os.environ,
+        "STUB_OPENROUTER_LATENCY_MS": str(args.openrouter_latency_ms),
+        "STUB_SHOPIFY_LATENCY_MS": str(args.shopify_latency_ms),
+        "STUB_OPENROUTER_ERROR_RATE": str(args.openrouter_error_rate),
+        "STUB_SHOPIFY_ERROR_RATE": str(args.shopify_error_rate),
+    }
+    app_env = {
+        **os.environ,
+        "OPENROUTER_URL": f"{stub_url}/openrouter/chat/completions",
+        "OPENROUTER_API_KEY": "bench",
+        "SHOPIFY_AUTH_URL": f"{stub_url}/shopify/auth",
+        "SHOPIFY_MCP_URL": f"{stub_url}/shopify/mcp",
+        "SHOPIFY_CLIENT_ID": "bench",
+        "SHOPIFY_CLIENT_SECRET": "bench",
+        "SHOPIFY_SAVED_CATALOG": "bench",
+        "GEMINI_API_KEY": os.environ.get("GEMINI_API_KEY", "bench"),
+        **({} if args.warm_caches else NO_CACHE_ENV),
+        # All bench traffic comes from one IP, the per-client rate limit would cap it
+        "ADMISSION_CONTROL": "1" if args.admission else "0",
+    }
+
+    uvicorn = [sys.executable, "-m", "uvicorn", "--host", "127.0.0.1", "--log-level", "warning"]
+    stubs = start(uvicorn + ["bench.stubs:app", "--port", str(stub_port)], stub_env, log_dir / "stubs.log")
+    backend = start(uvicorn + ["main:app", "--port", str(app_port)], app_env, log_dir / "backend.log")
+    try:
+        wait_ready(f"{stub_url}/docs", stubs)
+        wait_ready(f"{app_url}/docs", backend)
+        workload = Workload(args.images, args.photo_pool)
+
+        results = []
+        for scenario in args.scenarios.split(","):
+            for concurrency in (int(c) for c in args.concurrency.split(",")):
+                if args.warmup:
+                    await run_level(app_url, workload, scenario, min(concurrency, args.warmup), args.warmup, args.timeout, backend.pid)
+                result = await run_level(app_url, workload, scenario, concurrency, args.requests, args.timeout, backend.pid)
+                print(json.dumps(result), flush=True)
+                results.append(result)
+
+        print()
+        print_table(results)
+        if args.json:
+            Path(args.json).write_text(json.dumps(results, indent=2))
+    finally:
+        stop(backend)
+        stop(stubs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=50, help="requests per scenario and level")
+    parser.add_argument("--warmup", type=int, default=2, help="unmeasured requests before each level")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--images", type=int, default=3, help="photos per /eval-style request")
+    parser.add_argument("--photo-pool", type=int, default=24, help="distinct photos to sample from")
+    parser.add_argument("--openrouter-latency-ms", type=float, default=800)
+    parser.add_argument("--shopify-latency-ms", type=float, default=300)
+    parser.add_argument("--openrouter-error-rate", type=float, default=0.0)
+    parser.add_argument("--shopify-error-rate", type=float, default=0.0)
+    parser.add_argument("--warm-caches", action="store_true", help="leave the backend's caches enabled")
+    parser.add_argument("--admission", action="store_true", help="leave the backend's admission control enabled")
+    parser.add_argument("--json", help="also write results to this file")
+    parser.add_argument("--log-dir", default=str(Path(tempfile.gettempdir()) / "fitcheck-bench"), help="stub and backend logs")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,156 @@
+"""
+Local stand-ins for the upstream APIs, for benchmarks that don't touch the network.
+
+One app serves all of them:
+- POST /openrouter/chat/completions  OpenRouter chat completions (plain and "stream": true)
+- POST /shopify/auth                 Shopify client-credentials token
+- POST /shopify/mcp                  Shopify MCP tools/call search_global_products
+- GET  /cdn/{name}.jpg               small product images, so palette matching stays local
+
+Answers replay json_samples/evaluated_sample.json and json_samples/searched_sample.json.
+Latency and failures are injected per upstream from environment variables:
+
+    STUB_OPENROUTER_LATENCY_MS=800   mean added latency (uniform +/- STUB_JITTER)
+    STUB_SHOPIFY_LATENCY_MS=300
+    STUB_CDN_LATENCY_MS=20
+    STUB_JITTER=0.5                  fraction of the mean
+    STUB_OPENROUTER_ERROR_RATE=0.0   share of calls answered with STUB_ERROR_STATUS
+    STUB_SHOPIFY_ERROR_RATE=0.0
+    STUB_ERROR_STATUS=503
+
+Run with: uvicorn bench.stubs:app --port 8100 (from backend/)
+"""
+import os
+import json
+import random
+import asyncio
+import zlib
+from io import BytesIO
+from pathlib import Path
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from PIL import Image
+
+SAMPLES_DIR = Path(__file__).resolve().parent.parent / "json_samples"
+PROFILE = json.loads((SAMPLES_DIR / "evaluated_sample.json").read_text())["profile"]
+PRODUCTS = json.loads((SAMPLES_DIR / "searched_sample.json").read_text())["results"]
+
+JITTER = float(os.getenv("STUB_JITTER", "0.5"))
+ERROR_STATUS = int(os.getenv("STUB_ERROR_STATUS", "503"))
+LATENCY_MS = {
+    "openrouter": float(os.getenv("STUB_OPENROUTER_LATENCY_MS", "800")),
+    "shopify": float(os.getenv("STUB_SHOPIFY_LATENCY_MS", "300")),
+    "cdn": float(os.getenv("STUB_CDN_LATENCY_MS", "20")),
+}
+ERROR_RATE = {
+    "openrouter": float(os.getenv("STUB_OPENROUTER_ERROR_RATE", "0")),
+    "shopify": float(os.getenv("STUB_SHOPIFY_ERROR_RATE", "0")),
+    "cdn": 0.0,
+}
+
+STYLE_ANSWER = {
+    "current_style": {k: v for k, v in PROFILE.items() if k != "hexcolors"},
+    "current_summary": [
+        "neutral base with jewel-tone accents",
+        "relaxed but tailored silhouettes",
+        "layering adds depth",
+        "accessories could be more intentional",
+        "footwear choice is strong",
+    ],
+    "current_score": 7,
+    "improved_style": PROFILE,
+    "personality": "Explorer",
+    "emoji": "\U0001F9ED",
+}
+SEARCH_TERMS_ANSWER = ["charcoal wool overshirt", "tapered olive chinos", "merino knit beanie"]
+PERSONALITY_ANSWER = {"personality": "Explorer", "emoji": "\U0001F9ED"}
+
+app = FastAPI()
+
+
+async def upstream(name: str) -> Response | None:
+    """Sleep for the injected latency; return an error response for injected failures."""
+    mean = LATENCY_MS[name] / 1000
+    await asyncio.sleep(max(0.0, random.uniform(mean * (1 - JITTER), mean * (1 + JITTER))))
+    if random.random() < ERROR_RATE[name]:
+        return JSONResponse({"error": f"injected {name} failure"}, status_code=ERROR_STATUS)
+    return None
+
+
+def completion_text(messages: list[dict]) -> str:
+    content = messages[-1]["content"]
+    if isinstance(content, list):
+        # Multimodal message: the eval-style prompt with images
+        return "```json\n" + json.dumps(STYLE_ANSWER, indent=2) + "\n```"
+    if "personality" in content and "emoji" in content:
+        return json.dumps(PERSONALITY_ANSWER)
+    return json.dumps(SEARCH_TERMS_ANSWER)
+
+
+async def stream_completion(text: str, chunks: int = 20):
+    # Spread the answer over the upstream latency already spent, like a model emitting tokens
+    step = max(1, len(text) // chunks)
+    for i in range(0, len(text), step):
+        delta = {"choices": [{"delta": {"content": text[i:i + step]}}]}
+        yield f"data: {json.dumps(delta)}\n\n"
+        await asyncio.sleep(0.005)
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/openrouter/chat/completions")
+async def chat_completions(request: Request):
+    payload = await request.json()
+    failure = await upstream("openrouter")
+    if failure is not None:
+        return failure
+    text = completion_text(payload["messages"])
+    if payload.get("stream"):
+        return StreamingResponse(stream_completion(text), media_type="text/event-stream")
+    return {"choices": [{"message": {"role": "assistant", "content": text}}]}
+
+
+@app.post("/shopify/auth")
+async def shopify_auth():
+    failure = await upstream("shopify")
+    if failure is not None:
+        return failure
+    return {"access_token": "stub-token", "expires_in": 3600}
+
+
+def search_offers(query: str, limit: int, base_url: str) -> list[dict]:
+    """Sample products, relabelled per query so each search returns distinct ids."""
+    offers = []
+    seed = zlib.crc32(query.encode())
+    for i in range(limit):
+        product = json.loads(json.dumps(PRODUCTS[i % len(PRODUCTS)]))
+        product_id = f"gid://shopify/p/stub-{seed:08x}-{i}"
+        product["id"] = product_id
+        product["title"] = f"{query.title()} {i + 1} - {product['title']}"
+        product["media"] = [{"url": f"{base_url}cdn/{seed:08x}-{i}.jpg"}]
+        offers.append(product)
+    return offers
+
+
+@app.post("/shopify/mcp")
+async def shopify_mcp(request: Request):
+    payload = await request.json()
+    failure = await upstream("shopify")
+    if failure is not None:
+        return failure
+    arguments = payload["params"]["arguments"]
+    offers = search_offers(arguments.get("query", ""), int(arguments.get("limit", 10)), str(request.base_url))
+    text = json.dumps({"offers": offers})
+    return {"jsonrpc": "2.0", "id": payload.get("id"), "result": {"content": [{"type": "text", "text": text}]}}
+
+
+@app.get("/cdn/{name}.jpg")
+async def cdn_image(name: str):
+    await upstream("cdn")
+    rng = random.Random(name)
+    color = tuple(rng.randrange(256) for _ in range(3))
+    img = Image.new("RGB", (128, 128), (245, 245, 245))
+    img.paste(color, (24, 16, 104, 120))
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=80)
+    return Response(buf.getvalue(), media_type="image/jpeg")
@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable
+
+
+def json_size(value: Any) -> int:
+    """Approximate memory cost of a JSON-like value by its encoded length."""
+    return len(json.dumps(value, default=str))
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with TTL expiry, bounded by entry count and approximate bytes.
+
+    If `disk_dir` is set, entries are also written there as JSON files. A memory miss
+    falls back to disk and promotes the entry, so answers survive restarts and memory
+    eviction. Keys must be filesystem-safe strings (e.g. hex digests) when using disk.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        max_bytes: int | None = None,
+        ttl: float | None = None,
+        disk_dir: str | Path | None = None,
+        sizeof: Callable[[Any], int] = json_size,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof
+        self._disk_dir = Path(disk_dir) if disk_dir else None
+        if self._disk_dir:
+            self._disk_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # key -> (value, stored_at wall time, size)
+        self._entries: OrderedDict[Any, tuple[Any, float, int]] = OrderedDict()
+        self._bytes = 0
+        self._counts = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def _disk_path(self, key) -> Path:
+        return self._disk_dir / f"{key}.json"
+
+    def _drop(self, key):
+        # Caller must hold _lock
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _insert(self, key, value, stored_at: float):
+        # Caller must hold _lock
+        if key in self._entries:
+            self._drop(key)
+        size = self._sizeof(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        self._entries[key] = (value, stored_at, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or (self.max_bytes is not None and self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self._counts["evictions"] += 1
+
+    def _read_disk(self, key, now: float):
+        path = self._disk_path(key)
+        try:
+            record = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+        if self._expired(record["stored_at"], now):
+            path.unlink(missing_ok=True)
+            return None
+        return record
+
+    def _lookup(self, key):
+        # Returns (value, stored_at) or None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at, _ = entry
+                if not self._expired(stored_at, now):
+                    self._entries.move_to_end(key)
+                    self._counts["hits"] += 1
+                    return value, stored_at
+                self._drop(key)
+                self._counts["expirations"] += 1
+
+        if self._disk_dir:
+            record = self._read_disk(key, now)
+            if record is not None:
+                with self._lock:
+                    self._insert(key, record["value"], record["stored_at"])
+                    self._counts["disk_hits"] += 1
+                return record["value"], record["stored_at"]
+
+        with self._lock:
+            self._counts["misses"] += 1
+        return None
+
+    def get(self, key, default=None):
+        entry = self._lookup(key)
+        return default if entry is None else entry[0]
+
+    def get_with_age(self, key) -> tuple[Any, float] | None:
+        """Like get(), but returns (value, age in seconds), or None on a miss."""
+        entry = self._lookup(key)
+        if entry is None:
+            return None
+        value, stored_at = entry
+        return value, time.time() - stored_at
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._insert(key, value, now)
+        if self._disk_dir:
+            try:
+                # Write then rename so readers never see a partial file
+                path = self._disk_path(key)
+                tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+                tmp.write_text(json.dumps({"stored_at": now, "value": value}))
+                tmp.replace(path)
+            except OSError as e:
+                print(f"Cache disk write failed for {key}: {e}")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counts)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["hits"] + stats["disk_hits"]) / lookups, 3) if lookups else 0.0
+        return stats
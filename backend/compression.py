@@ -0,0 +1,88 @@
+import gzip
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only without it
+    brotli = None
+
+# Skip streams (compressing SSE would buffer it) and formats that are already compressed
+UNCOMPRESSIBLE_TYPES = (b"text/event-stream", b"image/", b"application/zip", b"application/gzip")
+
+
+def accepted_encodings(header: str) -> set[str]:
+    """Codings from an Accept-Encoding header, minus any refused with q=0."""
+    accepted = set()
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = params.strip().removeprefix("q=")
+        if coding and not (params and q.replace(".", "", 1).isdigit() and float(q) == 0):
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing complete responses with brotli or gzip, whichever the client
+    accepts (brotli preferred, when installed). Responses smaller than `minimum_size`,
+    already encoded, or streamed as Server-Sent Events pass through untouched.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 5):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def choose(self, scope) -> str | None:
+        header = dict(scope.get("headers") or []).get(b"accept-encoding", b"").decode("latin-1")
+        accepted = accepted_encodings(header)
+        if brotli is not None and "br" in accepted:
+            return "br"
+        if "gzip" in accepted:
+            return "gzip"
+        return None
+
+    def compress(self, body: bytes, coding: str) -> bytes:
+        if coding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level)
+
+    async def __call__(self, scope, receive, send):
+        coding = self.choose(scope) if scope["type"] == "http" else None
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        passthrough = False
+        parts = []
+
+        async def send_compressed(message):
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                headers = dict(message.get("headers", []))
+                content_type = headers.get(b"content-type", b"")
+                if b"content-encoding" in headers or content_type.startswith(UNCOMPRESSIBLE_TYPES):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            parts.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            body = b"".join(parts)
+            headers = [(k, v) for k, v in start.get("headers", []) if k != b"content-length"]
+            if len(body) >= self.minimum_size:
+                body = self.compress(body, coding)
+                headers.append((b"content-encoding", coding.encode()))
+            headers.append((b"content-length", str(len(body)).encode()))
+            headers.append((b"vary", b"Accept-Encoding"))
+            await send({**start, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from utils import PreprocessedImage
+
+
+def _entry_size(image: PreprocessedImage) -> int:
+    thumbnail = image.thumbnail.nbytes if image.thumbnail is not None else 0
+    return len(image.data) + thumbnail
+
+
+class ImageStore:
+    """
+    Normalized images kept once under their content hash (the sha256 of the normalized bytes),
+    so a client can upload a fit once and refer to it by id in later /eval-style calls.
+
+    - Memory tier: LRU bounded by bytes; evicted entries spill to disk instead of being lost
+    - Disk tier (optional): one .npz per image (bytes, thumbnail, metadata), oldest removed
+      past max_disk_bytes or once older than `ttl`
+    - Entries older than `ttl` are dropped from both tiers
+    """
+
+    def __init__(self, disk_dir: str | Path | None = None, max_bytes: int = 64 * 1024 * 1024,
+                 max_disk_bytes: int = 1024 * 1024 * 1024, ttl: float | None = 7 * 86400):
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # id -> (image, stored_at wall time, size)
+        self._memory: OrderedDict[str, tuple[PreprocessedImage, float, int]] = OrderedDict()
+        self._bytes = 0
+        # id -> file size, oldest first
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._disk_bytes = 0
+        self._disk_dir = Path(disk_dir) if disk_dir else None
+        self._counts = {"puts": 0, "hits": 0, "disk_hits": 0, "misses": 0, "spills": 0, "evictions": 0, "disk_evictions": 0}
+        if self._disk_dir:
+            self._disk_dir.mkdir(parents=True, exist_ok=True)
+            for path in sorted(self._disk_dir.glob("*.npz"), key=lambda p: p.stat().st_mtime):
+                self._disk[path.stem] = path.stat().st_size
+                self._disk_bytes += path.stat().st_size
+            self._prune_disk()
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl is not None and time.time() - stored_at > self.ttl
+
+    def _disk_path(self, image_id: str) -> Path:
+        return self._disk_dir / f"{image_id}.npz"
+
+    def _write_disk(self, image_id: str, image: PreprocessedImage, stored_at: float):
+        # Caller must hold _lock
+        if not self._disk_dir or image_id in self._disk:
+            return
+        path = self._disk_path(image_id)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        meta = {"mime_type": image.mime_type, "size": image.size, "passthrough": image.passthrough, "stored_at": stored_at}
+        try:
+            with open(tmp, "wb") as f:
+                np.savez(
+                    f,
+                    data=np.frombuffer(image.data, dtype=np.uint8),
+                    thumbnail=image.thumbnail if image.thumbnail is not None else np.zeros((0, 0, 3), np.uint8),
+                    meta=np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8),
+                )
+            tmp.replace(path)
+        except OSError as e:
+            print(f"Image store disk write failed for {image_id}: {e}")
+            tmp.unlink(missing_ok=True)
+            return
+        size = path.stat().st_size
+        self._disk[image_id] = size
+        self._disk_bytes += size
+        self._prune_disk()
+
+    def _prune_disk(self):
+        # Caller must hold _lock (or be in __init__). Files are oldest first, so stop at the
+        # first one that is both within the byte cap and not expired (its write time is
+        # never earlier than its stored_at, so this never drops a live entry early).
+        while self._disk:
+            oldest = next(iter(self._disk))
+            try:
+                written_at = self._disk_path(oldest).stat().st_mtime
+            except OSError:
+                written_at = 0.0
+            if self._disk_bytes <= self.max_disk_bytes and not self._expired(written_at):
+                break
+            self._disk_bytes -= self._disk.pop(oldest)
+            self._disk_path(oldest).unlink(missing_ok=True)
+            self._counts["disk_evictions"] += 1
+
+    def _read_disk(self, image_id: str) -> tuple[PreprocessedImage, float] | None:
+        try:
+            with np.load(self._disk_path(image_id)) as record:
+                meta = json.loads(record["meta"].tobytes())
+                thumbnail = record["thumbnail"]
+                image = PreprocessedImage(
+                    data=record["data"].tobytes(),
+                    mime_type=meta["mime_type"],
+                    digest=image_id,
+                    size=tuple(meta["size"]) if meta["size"] else None,
+                    passthrough=meta["passthrough"],
+                    thumbnail=thumbnail if thumbnail.size else None,
+                    timings={},
+                )
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Image store disk read failed for {image_id}: {e}")
+            return None
+        return image, meta["stored_at"]
+
+    def _insert(self, image_id: str, image: PreprocessedImage, stored_at: float):
+        # Caller must hold _lock
+        if image_id in self._memory:
+            self._memory.move_to_end(image_id)
+            return
+        size = _entry_size(image)
+        self._memory[image_id] = (image, stored_at, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes and len(self._memory) > 1:
+            oldest, (evicted, evicted_at, evicted_size) = self._memory.popitem(last=False)
+            self._bytes -= evicted_size
+            self._write_disk(oldest, evicted, evicted_at)
+            self._counts["spills" if self._disk_dir else "evictions"] += 1
+
+    def put(self, image: PreprocessedImage) -> str:
+        """Store a normalized image and return its id (the content hash)."""
+        with self._lock:
+            self._counts["puts"] += 1
+            self._insert(image.digest, image._replace(timings={}), time.time())
+        return image.digest
+
+    def get(self, image_id: str) -> PreprocessedImage | None:
+        with self._lock:
+            entry = self._memory.get(image_id)
+            if entry is not None:
+                image, stored_at, size = entry
+                if not self._expired(stored_at):
+                    self._memory.move_to_end(image_id)
+                    self._counts["hits"] += 1
+                    return image
+                del self._memory[image_id]
+                self._bytes -= size
+            on_disk = image_id in self._disk
+
+        if on_disk:
+            record = self._read_disk(image_id)
+            with self._lock:
+                if record is not None and not self._expired(record[1]):
+                    # Promote; the disk copy stays, so a later spill needs no rewrite
+                    self._insert(image_id, *record)
+                    self._counts["disk_hits"] += 1
+                    return record[0]
+                if image_id in self._disk:
+                    self._disk_bytes -= self._disk.pop(image_id)
+                    self._disk_path(image_id).unlink(missing_ok=True)
+
+        with self._lock:
+            self._counts["misses"] += 1
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._counts,
+                "entries": len(self._memory),
+                "bytes": self._bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
@@ -0,0 +1,157 @@
+import os
+import asyncio
+import time
+from io import BytesIO
+from typing import NamedTuple
+
+from fastapi import HTTPException, UploadFile
+from PIL import Image
+
+from metrics import record
+from utils import image_executor, preprocess_image, PreprocessedImage
+
+# Upload limits, enforced while reading so an oversized upload is never fully buffered
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", "15")) * 1024 * 1024)
+MAX_REQUEST_BYTES = int(float(os.getenv("MAX_REQUEST_UPLOAD_MB", "60")) * 1024 * 1024)
+# Originals held in memory per request while waiting for the preprocessing pool
+INGEST_BUFFER_BYTES = int(float(os.getenv("INGEST_BUFFER_MB", "24")) * 1024 * 1024)
+# Reject images whose header declares more pixels than this, before decoding them
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(50_000_000)))
+
+CHUNK_SIZE = 256 * 1024
+HEADER_BYTES = 64 * 1024
+
+# Magic numbers for formats the vision model takes even when PIL can't parse them
+_MAGIC = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF8", "image/gif"),
+)
+
+
+class UploadHeader(NamedTuple):
+    mime_type: str
+    size: tuple[int, int] | None  # (width, height), None if the header didn't say
+
+
+class IngestMeter:
+    """Bytes read and held in memory for one request, with the peak buffered at once."""
+
+    def __init__(self, max_bytes: int = MAX_REQUEST_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+        self.buffered = 0
+        self.peak_buffered = 0
+
+    def read(self, n: int):
+        self.bytes_read += n
+        if self.bytes_read > self.max_bytes:
+            raise HTTPException(status_code=413, detail=f"Uploads exceed {self.max_bytes // (1024 * 1024)}MB per request")
+        self.hold(n)
+
+    def hold(self, n: int):
+        self.buffered += n
+        self.peak_buffered = max(self.peak_buffered, self.buffered)
+
+    def release(self, n: int):
+        self.buffered -= n
+
+    def stats(self) -> dict[str, int]:
+        return {"bytes_read": self.bytes_read, "peak_buffered": self.peak_buffered}
+
+
+def sniff_image(head: bytes) -> UploadHeader | None:
+    """Format and dimensions from the first bytes of an upload, without decoding pixels."""
+    try:
+        img = Image.open(BytesIO(head))
+        # Phone cameras write multi-picture JPEGs, which PIL reports as MPO
+        mime_type = "image/jpeg" if img.format == "MPO" else Image.MIME.get(img.format)
+        if mime_type:
+            return UploadHeader(mime_type, img.size)
+    except Exception:
+        pass
+    # Header too long for the sniffed bytes (e.g. big EXIF), or a format PIL doesn't read
+    for magic, mime_type in _MAGIC:
+        if head.startswith(magic):
+            return UploadHeader(mime_type, None)
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return UploadHeader("image/webp", None)
+    if head[4:8] == b"ftyp" and head[8:12] in (b"heic", b"heix", b"mif1", b"msf1"):
+        return UploadHeader("image/heic", None)
+    return None
+
+
+async def read_upload_header(upload: UploadFile) -> UploadHeader:
+    """Sniff an upload's real type and size, rejecting non-images and decompression bombs."""
+    if upload.size is not None and upload.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"{upload.filename} exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)}MB")
+    head = await upload.read(HEADER_BYTES)
+    await upload.seek(0)
+    header = sniff_image(head)
+    if header is None:
+        raise HTTPException(status_code=415, detail=f"Unsupported image format: {upload.filename}")
+    if header.size and header.size[0] * header.size[1] > MAX_IMAGE_PIXELS:
+        raise HTTPException(status_code=413, detail=f"Image dimensions too large: {upload.filename}")
+    return header
+
+
+async def read_upload(upload: UploadFile, meter: IngestMeter, max_bytes: int = MAX_UPLOAD_BYTES) -> bytes:
+    """Read an upload in chunks, failing with 413 as soon as it passes a limit."""
+    chunks = []
+    size = 0
+    try:
+        while chunk := await upload.read(CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(status_code=413, detail=f"{upload.filename} exceeds {max_bytes // (1024 * 1024)}MB")
+            meter.read(len(chunk))
+            chunks.append(chunk)
+    except BaseException:
+        meter.release(sum(len(c) for c in chunks))
+        raise
+    finally:
+        # Drop starlette's spooled copy right away
+        await upload.close()
+    return b"".join(chunks)
+
+
+async def normalize_uploads(uploads: list[UploadFile], headers: list[UploadHeader], max_pixels: list[int | None],
+                            meter: IngestMeter, timings: dict[str, float]) -> list[PreprocessedImage]:
+    """
+    Stream uploads into the preprocessing pool one at a time.
+
+    Each original is released as soon as its normalized form exists; while more than
+    INGEST_BUFFER_BYTES are buffered (originals waiting for the pool plus normalized
+    copies), reading the next upload waits for the pool to catch up.
+    """
+    loop = asyncio.get_running_loop()
+    pending: list[asyncio.Future] = []
+
+    def on_done(future: asyncio.Future, original_size: int):
+        meter.release(original_size)
+        if not future.cancelled() and future.exception() is None:
+            # The normalized copy stays until the message is built
+            meter.hold(len(future.result().data))
+
+    try:
+        for upload, header, limit in zip(uploads, headers, max_pixels):
+            running = [f for f in pending if not f.done()]
+            while running and meter.buffered > INGEST_BUFFER_BYTES:
+                await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                running = [f for f in pending if not f.done()]
+
+            read_start = time.perf_counter()
+            image_bytes = await read_upload(upload, meter)
+            read_seconds = time.perf_counter() - read_start
+            timings["read"] = timings.get("read", 0.0) + read_seconds
+            record("image_read", read_seconds)
+
+            future = loop.run_in_executor(image_executor, preprocess_image, image_bytes, header.mime_type, limit or None)
+            future.add_done_callback(lambda f, n=len(image_bytes): on_done(f, n))
+            pending.append(future)
+            del image_bytes
+        return await asyncio.gather(*pending)
+    except BaseException:
+        for future in pending:
+            future.cancel()
+        raise
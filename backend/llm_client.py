@@ -0,0 +1,199 @@
+import os
+import json
+import asyncio
+import random
+from typing import Any, AsyncIterator
+
+import httpx
+
+from resilience import call_timeout, time_left
+
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+
+# Statuses worth another attempt (rate limits and transient upstream errors)
+RETRY_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class OpenRouterClient:
+    """
+    Async, pooled client for the OpenRouter chat completions API.
+
+    - One httpx.AsyncClient per process, so connections are kept alive and reused
+    - Connect/read timeouts on every call, cut to the request's remaining budget (see resilience)
+    - Retries on transport errors and retryable statuses, with full-jitter exponential backoff,
+      as long as the backoff fits in the remaining budget
+    - A semaphore caps how many calls are in flight toward OpenRouter at once. Streams hold
+      their slot until the last token, so they get a separate cap (max_streams) and a few
+      slow streams can't starve post()
+    """
+
+    def __init__(
+        self,
+        api_key: str | None,
+        url: str = OPENROUTER_URL,
+        headers: dict[str, str] | None = None,
+        timeout: float = 60.0,
+        connect_timeout: float = 10.0,
+        max_retries: int = 2,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        max_concurrency: int = 32,
+        max_streams: int = 16,
+        max_connections: int = 64,
+    ):
+        self.url = url
+        self._headers = {"Authorization": f"Bearer {api_key}", **(headers or {})}
+        self._timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=60.0,
+        )
+        self._max_retries = max_retries
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._stream_semaphore = asyncio.Semaphore(max_streams)
+        self._client: httpx.AsyncClient | None = None
+        self._counts = {"requests": 0, "retries": 0, "failures": 0, "in_flight": 0}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created lazily so it binds to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers=self._headers,
+                timeout=self._timeout,
+                limits=self._limits,
+            )
+        return self._client
+
+    def _backoff(self, attempt: int, retry_after: str | None = None) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), self._backoff_max)
+            except ValueError:
+                pass
+        # Full jitter: uniform between 0 and the exponential cap
+        return random.uniform(0, min(self._backoff_max, self._backoff_base * 2 ** attempt))
+
+    def _retry_delay(self, attempt: int, retry_after: str | None = None) -> float | None:
+        """Seconds to back off before the next attempt, or None when out of retries or budget."""
+        if attempt >= self._max_retries:
+            return None
+        delay = self._backoff(attempt, retry_after)
+        left = time_left()
+        if left is not None and delay >= left:
+            return None
+        return delay
+
+    def _attempt_timeout(self) -> httpx.Timeout:
+        # Raises DeadlineExceeded if the request budget is already spent
+        read = call_timeout(self._timeout.read)
+        return httpx.Timeout(read, connect=min(self._timeout.connect, read))
+
+    async def post(self, payload: dict[str, Any]) -> dict[str, Any]:
+        """
+        POST a chat completions payload and return the decoded JSON body.
+        Raises httpx.HTTPError once retries are exhausted.
+        """
+        attempt = 0
+        while True:
+            delay = None
+            async with self._semaphore:
+                self._counts["requests"] += 1
+                self._counts["in_flight"] += 1
+                try:
+                    resp = await self.client.post(self.url, json=payload, timeout=self._attempt_timeout())
+                    if resp.status_code in RETRY_STATUSES:
+                        delay = self._retry_delay(attempt, resp.headers.get("Retry-After"))
+                    if delay is None:
+                        resp.raise_for_status()
+                        return resp.json()
+                    print(f"OpenRouter returned {resp.status_code}, retrying (attempt {attempt + 1})")
+                except httpx.TransportError as e:
+                    delay = self._retry_delay(attempt)
+                    if delay is None:
+                        self._counts["failures"] += 1
+                        raise
+                    print(f"OpenRouter transport error {e!r}, retrying (attempt {attempt + 1})")
+                except httpx.HTTPStatusError:
+                    self._counts["failures"] += 1
+                    raise
+                finally:
+                    self._counts["in_flight"] -= 1
+
+            # Sleep outside the semaphore so waiting retries don't hold a slot
+            self._counts["retries"] += 1
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def stream(self, payload: dict[str, Any]) -> AsyncIterator[str]:
+        """
+        POST a chat completions payload with "stream": true and yield content deltas as they arrive.
+        Only failures before the first token are retried; after that, errors propagate.
+        """
+        payload = {**payload, "stream": True}
+        attempt = 0
+        while True:
+            delay = None
+            yielded = False
+            async with self._stream_semaphore:
+                self._counts["requests"] += 1
+                self._counts["in_flight"] += 1
+                try:
+                    async with self.client.stream("POST", self.url, json=payload, timeout=self._attempt_timeout()) as resp:
+                        if resp.status_code in RETRY_STATUSES:
+                            delay = self._retry_delay(attempt, resp.headers.get("Retry-After"))
+                        if delay is None:
+                            if resp.is_error:
+                                await resp.aread()
+                                resp.raise_for_status()
+                            async for line in resp.aiter_lines():
+                                # SSE: skip comments / keep-alives, stop at [DONE]
+                                if not line.startswith("data:"):
+                                    continue
+                                data = line[len("data:"):].strip()
+                                if data == "[DONE]":
+                                    break
+                                chunk = json.loads(data)
+                                if "error" in chunk:
+                                    self._counts["failures"] += 1
+                                    raise RuntimeError(f"OpenRouter stream error: {chunk['error']}")
+                                delta = (chunk["choices"][0].get("delta") or {}).get("content")
+                                if delta:
+                                    yielded = True
+                                    yield delta
+                            return
+                        print(f"OpenRouter returned {resp.status_code}, retrying stream (attempt {attempt + 1})")
+                except httpx.TransportError as e:
+                    delay = None if yielded else self._retry_delay(attempt)
+                    if delay is None:
+                        self._counts["failures"] += 1
+                        raise
+                    print(f"OpenRouter transport error {e!r}, retrying stream (attempt {attempt + 1})")
+                except httpx.HTTPStatusError:
+                    self._counts["failures"] += 1
+                    raise
+                finally:
+                    self._counts["in_flight"] -= 1
+
+            self._counts["retries"] += 1
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def warm_up(self, connections: int = 1):
+        """
+        Open up to `connections` keep-alive connections to the API host ahead of the first call.
+        Any HTTP answer will do, the point is the TCP/TLS handshake.
+        """
+        origin = httpx.URL(self.url).copy_with(path="/", query=None)
+        await asyncio.gather(*(self.client.head(origin) for _ in range(connections)))
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        return dict(self._counts)
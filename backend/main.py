@@ -1,37 +1,95 @@
+import time
+# Measured from here, so the startup log covers this module's imports
+IMPORT_STARTED = time.perf_counter()
+
 import os
 import json
 import traceback
 from pathlib import Path
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-import base64
-from typing import Any, List
+from fastapi.responses import StreamingResponse, Response
+from pydantic import BaseModel, ValidationError
+import asyncio
+import hashlib
+import contextvars
+from contextlib import asynccontextmanager
+from typing import Any, List, NamedTuple
 import requests
-from utils import compress_image
-
-from google import genai
+import httpx
+from utils import (
+    image_executor, preprocess_image, group_near_duplicates,
+    allocate_pixel_budget, estimate_image_tokens, to_data_url,
+)
+from llm_client import OpenRouterClient
+from cache import LRUCache
+from streaming import JSONFieldStream, sse_event
+from product_index import ProductIndex, rank_offers, rerank_offers
+from palette import PaletteMatcher, outfit_palette
+from image_store import ImageStore
+from ingest import IngestMeter, read_upload_header, normalize_uploads
+from metrics import ServerTimingMiddleware, STARTUP_SECONDS, record, timed, metrics_response
+from singleflight import AsyncSingleFlight
+from admission import Admission, AdmissionMiddleware
+from payload import FastJSONResponse, parse_fields, compact_items, compact_recommendations
+from compression import CompressionMiddleware
+from resilience import Upstream, CircuitOpen, DeadlineExceeded, request_budget, stream_with_budget, call_timeout
 
 load_dotenv()
 
 API_KEY = os.getenv("GEMINI_API_KEY")
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-if not API_KEY:
-    raise RuntimeError("Missing GEMINI_API_KEY in backend/.env")
 
 MODEL_NAME = os.getenv("OPENROUTER_MODEL", "google/gemini-2.5-flash-lite")
 
-client = genai.Client(api_key=API_KEY)
+# Seconds each endpoint may spend on upstream calls; every LLM/Shopify call's timeout
+# is cut to what is left, and retries or hedges that wouldn't fit are skipped
+EVAL_STYLE_BUDGET = float(os.getenv("EVAL_STYLE_BUDGET", "75"))
+SEARCH_TERMS_BUDGET = float(os.getenv("SEARCH_TERMS_BUDGET", "20"))
+RECOMMENDATIONS_BUDGET = float(os.getenv("RECOMMENDATIONS_BUDGET", "30"))
+# Seconds to wait for each category's Shopify search in /recommendations-multi
+CATEGORY_TIMEOUT = float(os.getenv("RECOMMENDATIONS_CATEGORY_TIMEOUT", "20"))
+# Offers fetched per category, reranked locally down to RECOMMENDATIONS_PER_CATEGORY
+CANDIDATE_POOL = int(os.getenv("RECOMMENDATIONS_CANDIDATE_POOL", "20"))
+RECOMMENDATIONS_PER_CATEGORY = int(os.getenv("RECOMMENDATIONS_PER_CATEGORY", "5"))
+# Rerank candidates by how well their product image colors match the Style DNA hexcolors
+PALETTE_MATCHING = os.getenv("PALETTE_MATCHING", "1").lower() not in ("0", "false", "no")
+PALETTE_WEIGHT = float(os.getenv("PALETTE_WEIGHT", "0.3"))
+# Send only one of each group of near-duplicate uploads (bursts of the same outfit) to the model
+DEDUP_IMAGES = os.getenv("DEDUP_IMAGES", "1").lower() not in ("0", "false", "no")
+
+_gemini_client = None
+
+def gemini_client():
+    # All model traffic goes through OpenRouter; the Gemini SDK is only imported if something asks for it
+    global _gemini_client
+    if _gemini_client is None:
+        if not API_KEY:
+            raise RuntimeError("Missing GEMINI_API_KEY in backend/.env")
+        from google import genai
+        _gemini_client = genai.Client(api_key=API_KEY)
+    return _gemini_client
 
 # Prompts directory
 PROMPTS_DIR = Path(__file__).parent / "prompts"
+# Prompt files read once, at startup or on first use
+PROMPTS: dict[str, str] = {}
+# Prompts the endpoints need, and the placeholders each must contain
+REQUIRED_PROMPTS = {
+    "eval-style": ("<styledesc>",),
+    "personality-emoji": ("<styledesc>",),
+    "search-terms": ("<styledesc>",),
+}
 
 def load_prompt(prompt_name: str, default: str = "") -> str:
+    if prompt_name in PROMPTS:
+        return PROMPTS[prompt_name]
     prompt_file = PROMPTS_DIR / f"{prompt_name}.txt"
     try:
         if prompt_file.exists():
-            return prompt_file.read_text().strip()
+            PROMPTS[prompt_name] = prompt_file.read_text().strip()
+            return PROMPTS[prompt_name]
         else:
             print(f"Warning: Prompt file {prompt_file} not found, using default")
             return default
@@ -39,7 +97,111 @@ def load_prompt(prompt_name: str, default: str = "") -> str:
         print(f"Error loading prompt {prompt_name}: {e}")
         return default
 
+def preload_prompts():
+    """Read every prompt into memory and fail startup if a required one is missing or malformed."""
+    for prompt_file in sorted(PROMPTS_DIR.glob("*.txt")):
+        PROMPTS[prompt_file.stem] = prompt_file.read_text().strip()
+    for name, placeholders in REQUIRED_PROMPTS.items():
+        if not PROMPTS.get(name):
+            raise RuntimeError(f"Missing or empty prompt {PROMPTS_DIR / name}.txt")
+        missing = [p for p in placeholders if p not in PROMPTS[name]]
+        if missing:
+            raise RuntimeError(f"Prompt {name} is missing {', '.join(missing)}")
+
+# Use personality/emoji from the eval-style answer when valid, instead of a second LLM call
+SINGLE_ROUNDTRIP = os.getenv("EVAL_SINGLE_ROUNDTRIP", "1").lower() not in ("0", "false", "no")
+
+# Emojis that directly depict clothing or accessories, which the prompts rule out
+CLOTHING_EMOJIS = set(
+    "👕👖👗👘👙👚👛👜👝🎒👞👟👠👡👢👑👒🎩🎓🧢⛑👓🕶🥽🥼🦺👔🧣🧤🧥🧦🩱🩲🩳🩴🥻🥿🥾🩰🪖💄💍💼🌂🧳🪭🪮"
+)
+ZWJ = "\u200d"
+EMOJI_MODIFIERS = {"\ufe0f", "\ufe0e", "\u20e3"} | {chr(c) for c in range(0x1F3FB, 0x1F400)}
+
+personality_stats = {"single_roundtrip": 0, "fallbacks": 0, "fallback_seconds": 0.0}
+
+def is_valid_personality(value: Any) -> bool:
+    """A single word, e.g. "Explorer"."""
+    return isinstance(value, str) and value.strip().replace("-", "").isalpha() and len(value.strip()) <= 30
+
+def is_emoji_char(ch: str) -> bool:
+    code = ord(ch)
+    return (
+        0x1F000 <= code <= 0x1FAFF
+        or 0x2600 <= code <= 0x27BF
+        or 0x2B00 <= code <= 0x2BFF
+        or 0x2190 <= code <= 0x21FF
+        or 0x2300 <= code <= 0x23FF
+        or code in (0x00A9, 0x00AE, 0x203C, 0x2049, 0x2122, 0x2139, 0x3030, 0x303D)
+    )
+
+def is_valid_emoji(value: Any) -> bool:
+    """Exactly one emoji (ZWJ sequences, skin tones and flags count as one) that isn't clothing."""
+    if not isinstance(value, str):
+        return False
+    chars = [ch for ch in value.strip() if ch not in EMOJI_MODIFIERS]
+    if not chars or any(ch in CLOTHING_EMOJIS for ch in chars):
+        return False
+    # Count base emojis, treating ZWJ-joined parts and regional indicator pairs as one
+    bases = 0
+    previous = ""
+    regional = 0
+    for ch in chars:
+        if ch == ZWJ:
+            previous = ch
+            continue
+        if not is_emoji_char(ch):
+            return False
+        if 0x1F1E6 <= ord(ch) <= 0x1F1FF:
+            regional += 1
+            if regional % 2 == 0:
+                previous = ch
+                continue
+        if previous != ZWJ:
+            bases += 1
+        previous = ch
+    return bases == 1
+
+# Every offer fetched from Shopify, for local ranking against Style DNA
+product_index = ProductIndex(os.getenv("PRODUCT_INDEX_PATH", ":memory:"))
+
+# Dominant colors of product images, cached by image URL
+palette_matcher = PaletteMatcher(timeout=float(os.getenv("PALETTE_TIMEOUT", "1.5")))
+
+# Style DNA results keyed by image content, prompts and model
+style_cache = LRUCache(
+    max_entries=int(os.getenv("STYLE_CACHE_MAX_ENTRIES", "512")),
+    max_bytes=int(float(os.getenv("STYLE_CACHE_MAX_MB", "16")) * 1024 * 1024),
+    ttl=float(os.getenv("STYLE_CACHE_TTL", "86400")),
+    disk_dir=os.getenv("STYLE_CACHE_DIR") or None,
+)
+
+# Normalized uploads by content hash, so clients can re-evaluate a selection by image id.
+# Memory only unless IMAGE_STORE_DIR is set: these are user photos, don't keep them on disk by default.
+image_store = ImageStore(
+    disk_dir=os.getenv("IMAGE_STORE_DIR") or None,
+    max_bytes=int(float(os.getenv("IMAGE_STORE_MAX_MB", "64")) * 1024 * 1024),
+    max_disk_bytes=int(float(os.getenv("IMAGE_STORE_MAX_DISK_MB", "1024")) * 1024 * 1024),
+    ttl=float(os.getenv("IMAGE_STORE_TTL", str(7 * 86400))),
+)
+
+def style_cache_key(image_digests: list[str], prompt: str) -> str:
+    """
+    Content address for an /eval-style request. Image order does not matter,
+    so the same fits selected in a different order still hit.
+    """
+    h = hashlib.sha256()
+    for digest in sorted(image_digests):
+        h.update(digest.encode())
+    for part in (prompt, load_prompt("personality-emoji"), MODEL_NAME):
+        h.update(b"\0" + part.encode())
+    return h.hexdigest()
+
 def extract_json(text: str, brace_1: str = '{', brace_2: str = '}') -> dict:
+    with timed("extract_json"):
+        return _extract_json(text, brace_1, brace_2)
+
+def _extract_json(text: str, brace_1: str, brace_2: str) -> dict:
 
     start_idx = text.find(brace_1)
     if start_idx == -1:
@@ -64,22 +226,156 @@ def extract_json(text: str, brace_1: str = '{', brace_2: str = '}') -> dict:
     
     return json.loads(json_str)
 
-def openrouter_post(messages: list[dict[str, Any]]) -> dict[str, Any]:
-    return requests.post(
-        url="https://openrouter.ai/api/v1/chat/completions",
-        headers={
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+llm = OpenRouterClient(
+    api_key=OPENROUTER_API_KEY,
+    headers={
         "HTTP-Referer": "https://www.google.com",
         "X-Title": "Google"
-        },
-        data=json.dumps({
-            "model": MODEL_NAME,
-            "messages": messages
-        })
-    ).json()
+    },
+    timeout=float(os.getenv("OPENROUTER_TIMEOUT", "60")),
+    max_retries=int(os.getenv("OPENROUTER_MAX_RETRIES", "2")),
+    max_concurrency=int(os.getenv("OPENROUTER_MAX_CONCURRENCY", "32")),
+    max_streams=int(os.getenv("OPENROUTER_MAX_STREAMS", "16")),
+    max_connections=int(os.getenv("OPENROUTER_MAX_CONNECTIONS", "64")),
+)
+
+# Breaker, hedging and latency tracking for OpenRouter calls
+openrouter_upstream = Upstream("openrouter")
+# Identical prompts in flight at once (same photos, a trending profile) share one call
+openrouter_flight = AsyncSingleFlight("openrouter")
+
+async def openrouter_post(messages: list[dict[str, Any]], kind: str = "text", key: str | None = None,
+                          budget: float = SEARCH_TERMS_BUDGET) -> dict[str, Any]:
+    # kind separates latency tracking (and so hedge delays) of vision and text-only calls.
+    # key identifies the request for coalescing; pass one for image payloads, hashing
+    # megabytes of base64 on the event loop per call is what it avoids. budget bounds the
+    # shared call, each caller still waits at most its own request budget.
+    payload = {
+        "model": MODEL_NAME,
+        "messages": messages
+    }
+    if key is None:
+        key = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    with timed("openrouter"):
+        return await openrouter_flight.do(
+            f"{kind}:{key}", lambda: openrouter_upstream.call(lambda: llm.post(payload), kind=kind), budget=budget
+        )
+
+async def openrouter_stream(messages: list[dict[str, Any]]):
+    # Streams aren't hedged, a duplicate would double the tokens of the longest call
+    async with openrouter_upstream.guard():
+        async for delta in llm.stream({"model": MODEL_NAME, "messages": messages}):
+            yield delta
+
+def upstream_error(e: CircuitOpen | DeadlineExceeded) -> HTTPException:
+    # Fail fast with a hint of when to come back instead of queueing on a sick upstream
+    if isinstance(e, DeadlineExceeded):
+        return HTTPException(status_code=504, detail=str(e))
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(max(1, round(e.retry_after)))})
 
 
-app = FastAPI()
+# Seconds each warm-up step may take before the worker starts taking traffic anyway
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "10"))
+# Keep-alive connections to open to OpenRouter before the first request
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", "4"))
+
+# Set once startup is done, cleared on shutdown; see /ready
+ready = False
+startup_stats: dict[str, Any] = {}
+
+async def warm_up() -> dict[str, dict[str, Any]]:
+    """
+    Open upstream connections and fetch the Shopify token before taking traffic, so the
+    first requests don't pay for TLS handshakes and auth. Best-effort: a step that fails
+    or takes longer than WARMUP_TIMEOUT is reported by /ready, not fatal.
+    """
+    def warm_up_shopify():
+        # Imported here rather than at module level, it raises without the Shopify env vars
+        import shopfiy_mcp_example
+        shopfiy_mcp_example.warm_up()
+
+    steps = {
+        "openrouter": llm.warm_up(WARMUP_CONNECTIONS),
+        "shopify": asyncio.to_thread(warm_up_shopify),
+    }
+
+    async def run(step):
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(step, timeout=WARMUP_TIMEOUT)
+            return {"ok": True, "ms": round((time.perf_counter() - start) * 1000, 1)}
+        except Exception as e:
+            return {"ok": False, "ms": round((time.perf_counter() - start) * 1000, 1), "error": repr(e)}
+
+    results = await asyncio.gather(*(run(step) for step in steps.values()))
+    return dict(zip(steps, results))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global ready
+    started = time.perf_counter()
+    phases = {"imports": started - IMPORT_STARTED}
+    preload_prompts()
+    phases["prompts"] = time.perf_counter() - started
+    warmup_start = time.perf_counter()
+    warmup = await warm_up()
+    phases["warmup"] = time.perf_counter() - warmup_start
+    phases["total"] = time.perf_counter() - IMPORT_STARTED
+    for phase, seconds in phases.items():
+        STARTUP_SECONDS.labels(phase).set(seconds)
+    startup_stats.update({f"{phase}_ms": round(seconds * 1000, 1) for phase, seconds in phases.items()})
+    startup_stats["warmup"] = warmup
+    failed = [name for name, step in warmup.items() if not step["ok"]]
+    print(f"Startup took {startup_stats['total_ms']} ms ({startup_stats['imports_ms']} ms imports, "
+          f"{startup_stats['warmup_ms']} ms warm-up{', failed: ' + ', '.join(failed) if failed else ''})")
+    ready = True
+    yield
+    ready = False
+    for task in list(prefetch_tasks.values()):
+        task.cancel()
+    # Close pooled upstream connections on shutdown
+    await llm.aclose()
+    await palette_matcher.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Admission control for the endpoints that fan out to LLM and Shopify calls: a token bucket
+# per IP (or per X-API-Key, for keys listed in ADMISSION_API_KEYS) and a bounded queue with a
+# wait deadline. Clients get a quick 429/503 with Retry-After instead of piling up behind a burst.
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "1").lower() not in ("0", "false", "no")
+eval_style_admission = Admission(
+    "eval_style",
+    rate_per_min=float(os.getenv("EVAL_STYLE_RATE_PER_MIN", "10")),
+    burst=float(os.getenv("EVAL_STYLE_BURST", "5")),
+    max_concurrent=int(os.getenv("EVAL_STYLE_MAX_CONCURRENT", "8")),
+    max_queue=int(os.getenv("EVAL_STYLE_MAX_QUEUE", "16")),
+    max_wait=float(os.getenv("EVAL_STYLE_MAX_WAIT", "10")),
+)
+recommendations_admission = Admission(
+    "recommendations",
+    rate_per_min=float(os.getenv("RECOMMENDATIONS_RATE_PER_MIN", "30")),
+    burst=float(os.getenv("RECOMMENDATIONS_BURST", "10")),
+    max_concurrent=int(os.getenv("RECOMMENDATIONS_MAX_CONCURRENT", "16")),
+    max_queue=int(os.getenv("RECOMMENDATIONS_MAX_QUEUE", "32")),
+    max_wait=float(os.getenv("RECOMMENDATIONS_MAX_WAIT", "5")),
+)
+if ADMISSION_CONTROL:
+    # Added first so it runs inside CORS (rejections still carry CORS headers)
+    app.add_middleware(
+        AdmissionMiddleware,
+        routes={
+            "/eval-style": eval_style_admission,
+            "/eval-style/stream": eval_style_admission,
+            # Same decode and compress work as /eval-style, so it shares its limits
+            "/images": eval_style_admission,
+            "/recommendations-multi": recommendations_admission,
+            "/recommendations-multi/stream": recommendations_admission,
+        },
+        trust_forwarded=os.getenv("TRUST_FORWARDED_FOR", "0").lower() in ("1", "true", "yes"),
+        api_keys=frozenset(key.strip() for key in os.getenv("ADMISSION_API_KEYS", "").split(",") if key.strip()),
+    )
 
 app.add_middleware(
     CORSMiddleware,
@@ -87,14 +383,36 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "Retry-After"],
 )
+# Per-stage timings: Prometheus histograms on /metrics and a Server-Timing header per response
+app.add_middleware(ServerTimingMiddleware)
+# brotli/gzip for complete responses the client accepts; SSE streams are left alone
+if os.getenv("COMPRESSION", "1").lower() not in ("0", "false", "no"):
+    app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("COMPRESSION_MIN_BYTES", "1024")))
 
 
 class StyleResponse(BaseModel):
     answer: dict[str, Any]
+    timings: dict[str, float] | None = None  # milliseconds per stage
+    cached: bool = False
+    merged: List[List[int]] = []  # groups of near-duplicate image indexes; only the first was analyzed
+    image_ids: List[str] = []  # id of each image, uploads first then image_ids, for later requests
+    ingest: dict[str, int] | None = None  # upload bytes read and peak bytes buffered at once
+
+class StoredImage(BaseModel):
+    id: str
+    mime_type: str
+    width: int | None = None
+    height: int | None = None
+    bytes: int
+
+class ImageUploadResponse(BaseModel):
+    images: List[StoredImage]
 
 class SearchTermsResponse(BaseModel):
     answer: List[str]
+    degraded: bool = False  # generic terms from the profile, the model was unavailable
 
 class SearchTermsRequest(BaseModel):
     profile: dict[str, Any]
@@ -102,70 +420,403 @@ class SearchTermsRequest(BaseModel):
     looking_for: str | None = None
 
 
+def validate_images(images: List[UploadFile], image_ids: List[str] | None = None):
+    # Validate number of images
+    count = len(images) + len(image_ids or [])
+    if count == 0:
+        raise HTTPException(status_code=400, detail="At least one image is required")
+    if count > 10:
+        raise HTTPException(status_code=400, detail="Maximum 10 images allowed")
+    
+    # Validate all images are image types
+    for image in images:
+        if not image.content_type.startswith("image/"):
+            raise HTTPException(status_code=400, detail=f"Invalid image type: {image.filename}")
+
+# What the normalizer sends to the vision model, across requests
+image_stats = {
+    "uploaded": 0, "sent": 0, "passthrough": 0, "bytes_uploaded": 0, "bytes_sent": 0,
+    "pixels_sent": 0, "estimated_tokens": 0, "peak_buffered_max": 0,
+}
+
+def record_image_stats(uploaded: list, kept: list, meter: IngestMeter) -> None:
+    image_stats["uploaded"] += len(uploaded)
+    image_stats["bytes_uploaded"] += meter.bytes_read
+    image_stats["peak_buffered_max"] = max(image_stats["peak_buffered_max"], meter.peak_buffered)
+    for p in kept:
+        image_stats["sent"] += 1
+        image_stats["passthrough"] += p.passthrough
+        image_stats["bytes_sent"] += len(p.data)
+        if p.size:
+            image_stats["pixels_sent"] += p.size[0] * p.size[1]
+            image_stats["estimated_tokens"] += estimate_image_tokens(*p.size)
+
+class StyleRequest(NamedTuple):
+    content: list[dict[str, Any]]  # message content for the vision call
+    cache_key: str
+    thumbnails: list  # analysis thumbnails of the images sent
+    merged: list[list[int]]  # near-duplicate groups of image indexes, first one kept
+    image_ids: list[str]  # image store id of each image, uploads first
+    ingest: dict[str, int]  # bytes read and peak bytes buffered
+    timings: dict[str, float]  # seconds per stage
+
+def load_stored_images(image_ids: List[str]) -> list:
+    stored = [image_store.get(image_id) for image_id in image_ids]
+    missing = [image_id for image_id, image in zip(image_ids, stored) if image is None]
+    if missing:
+        # The client should fall back to uploading these images again
+        raise HTTPException(status_code=404, detail=f"Unknown image ids: {', '.join(missing)}")
+    return stored
+
+async def prepare_style_request(images: List[UploadFile], image_ids: List[str] | None, prompt: str | None) -> StyleRequest:
+    """
+    Validate and preprocess the images for the vision call: fresh uploads plus images
+    already in the image store (by id), collapsing near-duplicates into one image each.
+    Uploads are stored, so later requests can send their ids instead.
+    """
+    image_ids = image_ids or []
+    validate_images(images, image_ids)
+    stored = await asyncio.to_thread(load_stored_images, image_ids)
+    
+    # Load prompt from file if not provided, with fallback default
+    if prompt is None:
+        prompt = load_prompt(
+            "eval-style",
+            "Identify the style of dress of the person in the image. Return a JSON object with the style name and a description. "
+        )
+    
+    content = [{"type": "text", "text": prompt}]
+    timings = {"read": 0.0, "compress": 0.0, "thumbnail": 0.0}
+    
+    # Sniff every upload's real format and dimensions from its first bytes, then size
+    # each image against its share of the request's pixel budget. Uploads stream into
+    # the preprocessing pool; stored images are already normalized and only redone when
+    # the budget is tighter than when they were stored.
+    preprocess_start = time.perf_counter()
+    meter = IngestMeter()
+    headers = [await read_upload_header(image) for image in images]
+    max_pixels = allocate_pixel_budget([h.size for h in headers] + [p.size for p in stored])
+    loop = asyncio.get_running_loop()
+    
+    async def normalize_stored(p, limit):
+        if not p.size or not limit or p.size[0] * p.size[1] <= limit:
+            return p
+        return await loop.run_in_executor(image_executor, preprocess_image, p.data, p.mime_type, limit)
+    
+    processed = await normalize_uploads(images, headers, max_pixels[:len(images)], meter, timings)
+    processed += await asyncio.gather(*(
+        normalize_stored(p, limit) for p, limit in zip(stored, max_pixels[len(images):])
+    ))
+    # Store spills to disk, so keep it off the event loop
+    all_ids = await asyncio.to_thread(lambda: [image_store.put(p) for p in processed[:len(images)]]) + image_ids
+    for image_timings in (p.timings for p in processed):
+        for stage, seconds in image_timings.items():
+            timings[stage] += seconds
+            record(stage, seconds)
+    timings["preprocess_wall"] = time.perf_counter() - preprocess_start
+    
+    dedup_start = time.perf_counter()
+    if DEDUP_IMAGES and len(processed) > 1:
+        groups = group_near_duplicates([p.thumbnail for p in processed])
+    else:
+        groups = [[i] for i in range(len(processed))]
+    timings["dedup"] = time.perf_counter() - dedup_start
+    record("dedup", timings["dedup"])
+    
+    kept = [processed[group[0]] for group in groups]
+    base64_start = time.perf_counter()
+    for p in kept:
+        content.append({"type": "image_url", "image_url": {"url": to_data_url(p.data, p.mime_type)}})
+    timings["base64"] = time.perf_counter() - base64_start
+    record("base64", timings["base64"])
+    record_image_stats(processed[:len(images)], kept, meter)
+    merged = [group for group in groups if len(group) > 1]
+    if merged:
+        print(f"Merged near-duplicate uploads: {merged}")
+    
+    # Keyed on the images actually sent, so a burst and its best shot share an answer
+    cache_key = style_cache_key([p.digest for p in kept], prompt)
+    return StyleRequest(content, cache_key, [p.thumbnail for p in kept], merged, all_ids, meter.stats(), timings)
+
+async def local_palette(thumbnails: list, timings: dict[str, float]) -> list[str]:
+    """
+    current_style hexcolors, measured from the uploads instead of asked of the model.
+    Runs on the image pool, alongside the vision call.
+    """
+    start = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(image_executor, outfit_palette, thumbnails)
+    except Exception as e:
+        print(f"Local palette extraction failed: {e!r}")
+        return []
+    finally:
+        timings["palette"] = time.perf_counter() - start
+        record("palette", timings["palette"])
+
+def with_hexcolors(style: dict[str, Any], hexcolors: list[str]) -> dict[str, Any]:
+    # Keep hexcolors right after the name, where the prompt used to put it
+    return {"name": style.get("name"), "hexcolors": hexcolors, **{k: v for k, v in style.items() if k not in ("name", "hexcolors")}}
+
+async def resolve_personality(json_answer_1: dict[str, Any], timings: dict[str, float]) -> dict[str, Any]:
+    """
+    The eval-style prompt already asks for personality + emoji; only make the
+    dedicated personality call when those fields are missing or invalid.
+    """
+    if SINGLE_ROUNDTRIP:
+        personality = json_answer_1.get("personality")
+        emoji = json_answer_1.get("emoji")
+        if is_valid_personality(personality) and is_valid_emoji(emoji):
+            personality_stats["single_roundtrip"] += 1
+            return {"personality": personality.strip(), "emoji": emoji.strip()}
+
+    messages = [{"role": "user", "content": load_prompt("personality-emoji").replace("<styledesc>", json.dumps(json_answer_1))}]
+    llm_start = time.perf_counter()
+    resp = await openrouter_post(messages)
+    timings["personality_llm"] = time.perf_counter() - llm_start
+    personality_stats["fallbacks"] += 1
+    personality_stats["fallback_seconds"] += timings["personality_llm"]
+    answer = (resp["choices"][0]["message"]["content"] or "").strip()
+    if not answer:
+        raise HTTPException(status_code=502, detail="Model returned empty text")
+    
+    return extract_json(answer)
+
+def normalize_style_field(key: str, value: Any) -> Any:
+    # Capitalization rules
+    if key in ("current_style", "improved_style"):
+        return {**value, "name": value["name"].title()}
+    if key == "current_summary":
+        # Force capitalize bullet point start
+        return list([i.capitalize() for i in value])
+    if key == "personality":
+        return value.title()
+    return value
+
+def format_timings(timings: dict[str, float]) -> dict[str, float]:
+    return {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()}
+
+
+@app.post("/images", response_model=ImageUploadResponse)
+async def upload_images(images: List[UploadFile] = File(...)):
+    """
+    Normalize and store images once; /eval-style then takes their ids (image_ids form field)
+    instead of the files, so changing a selection re-sends no image data.
+    """
+    try:
+        validate_images(images)
+        headers = [await read_upload_header(image) for image in images]
+        processed = await normalize_uploads(images, headers, [None] * len(images), IngestMeter(), {})
+        results = []
+        for p in processed:
+            results.append({
+                "id": await asyncio.to_thread(image_store.put, p),
+                "mime_type": p.mime_type,
+                "width": p.size[0] if p.size else None,
+                "height": p.size[1] if p.size else None,
+                "bytes": len(p.data),
+            })
+        return {"images": results}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print("ERROR in /images:", repr(e))
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Backend error: {str(e)}")
+
+
 @app.post("/eval-style", response_model=StyleResponse)
-async def eval_style(images: List[UploadFile] = File(...), prompt: str = None):
+async def eval_style(images: List[UploadFile] = File(None), image_ids: List[str] = Form(None), prompt: str = None):
+    with request_budget(EVAL_STYLE_BUDGET):
+        return await _eval_style(images, image_ids, prompt)
+
+
+async def _eval_style(images: List[UploadFile] | None, image_ids: List[str] | None, prompt: str | None) -> dict:
     try: 
-        # Validate number of images
-        if len(images) == 0:
-            raise HTTPException(status_code=400, detail="At least one image is required")
-        if len(images) > 10:
-            raise HTTPException(status_code=400, detail="Maximum 10 images allowed")
-        
-        # Validate all images are image types
-        for image in images:
-            if not image.content_type.startswith("image/"):
-                raise HTTPException(status_code=400, detail=f"Invalid image type: {image.filename}")
+        content, cache_key, thumbnails, merged, all_ids, ingest, timings = await prepare_style_request(images or [], image_ids, prompt)
         
-        # Load prompt from file if not provided, with fallback default
-        if prompt is None:
-            prompt = load_prompt(
-                "eval-style",
-                "Identify the style of dress of the person in the image. Return a JSON object with the style name and a description. "
-            )
-        
-        content = [{"type": "text", "text": prompt}]
-        # iteratively add all images to the content
-        for image in images:
-            image_bytes = await image.read()
-            compressed_bytes, mime_type = compress_image(image_bytes, image.content_type)
-            image_base64 = base64.b64encode(compressed_bytes).decode('utf-8')
-            data_url = f"data:image/{mime_type};base64,{image_base64}"
-            content.append({"type": "image_url", "image_url": {"url": data_url}})
+        # Same outfit set + same prompts + same model -> same answer, skip the LLM
+        cached_answer = style_cache.get(cache_key)
+        if cached_answer is not None:
+            prefetch_recommendations(cached_answer.get("improved_style"))
+            return {"answer": cached_answer, "timings": format_timings(timings), "cached": True, "merged": merged, "image_ids": all_ids, "ingest": ingest}
         
+        palette_task = asyncio.create_task(local_palette(thumbnails, timings))
         messages = [{"role": "user", "content": content}]
-        resp = openrouter_post(messages)
+        llm_start = time.perf_counter()
+        resp = await openrouter_post(messages, kind="vision", key=cache_key, budget=EVAL_STYLE_BUDGET)
+        timings["style_llm"] = time.perf_counter() - llm_start
         answer = (resp["choices"][0]["message"]["content"] or "").strip()
         if not answer:
             raise HTTPException(status_code=502, detail="Model returned empty text")
         
         json_answer_1 = extract_json(answer)
+        json_answer_1["current_style"] = with_hexcolors(json_answer_1["current_style"], await palette_task)
+        json_answer_2 = await resolve_personality(json_answer_1, timings)
 
-        messages = [{"role": "user", "content": load_prompt("personality-emoji").replace("<styledesc>", json.dumps(json_answer_1))}]
-        resp = openrouter_post(messages)
-        answer = (resp["choices"][0]["message"]["content"] or "").strip()
-        if not answer:
-            raise HTTPException(status_code=502, detail="Model returned empty text")
-        
-        json_answer_2 = extract_json(answer)
+        for key in ("current_style", "improved_style", "current_summary"):
+            json_answer_1[key] = normalize_style_field(key, json_answer_1[key])
+        json_answer_2["personality"] = normalize_style_field("personality", json_answer_2["personality"])
 
-        # Capitalization rules
-        json_answer_1["current_style"]["name"] = json_answer_1["current_style"]["name"].title()
-        json_answer_1["improved_style"]["name"] = json_answer_1["improved_style"]["name"].title()
-        # Force capitalize bullet point start
-        json_answer_1["current_summary"] = list([i.capitalize() for i in json_answer_1["current_summary"]])
-        json_answer_2["personality"] = json_answer_2["personality"].title()
+        final_answer = {**json_answer_1, **json_answer_2}
+        style_cache.set(cache_key, final_answer)
+        prefetch_recommendations(final_answer["improved_style"])
 
-        return {"answer": {**json_answer_1, **json_answer_2}}
+        return {"answer": final_answer, "timings": format_timings(timings), "merged": merged, "image_ids": all_ids, "ingest": ingest}
     except HTTPException:
         raise
+    except (CircuitOpen, DeadlineExceeded) as e:
+        print("ERROR in /eval-style:", repr(e))
+        raise upstream_error(e)
     except Exception as e:
         print("ERROR in /eval-style:", repr(e))
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Backend error: {str(e)}")
 
+
+# Style DNA fields sent as their own events by /eval-style/stream, in prompt order
+STREAMED_STYLE_FIELDS = ("current_style", "current_summary", "current_score", "improved_style")
+
+@app.post("/eval-style/stream")
+async def eval_style_stream(images: List[UploadFile] = File(None), image_ids: List[str] = Form(None), prompt: str = None):
+    """
+    Server-Sent Events variant of /eval-style.
+    
+    Streams the vision call and emits each part of the answer as soon as its JSON is complete:
+    current_style, current_summary, current_score, improved_style, then personality
+    ({personality, emoji}), and finally done ({answer, timings, cached, merged, image_ids, ingest}).
+    Failures after the stream has started are sent as an error event ({detail}).
+    """
+    try:
+        content, cache_key, thumbnails, merged, all_ids, ingest, timings = await prepare_style_request(images or [], image_ids, prompt)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print("ERROR in /eval-style/stream:", repr(e))
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Backend error: {str(e)}")
+    
+    async def events():
+        try:
+            cached_answer = style_cache.get(cache_key)
+            if cached_answer is not None:
+                prefetch_recommendations(cached_answer.get("improved_style"))
+                for key in STREAMED_STYLE_FIELDS:
+                    yield sse_event(key, cached_answer.get(key))
+                yield sse_event("personality", {"personality": cached_answer.get("personality"), "emoji": cached_answer.get("emoji")})
+                yield sse_event("done", {"answer": cached_answer, "timings": format_timings(timings), "cached": True, "merged": merged, "image_ids": all_ids, "ingest": ingest})
+                return
+            
+            palette_task = asyncio.create_task(local_palette(thumbnails, timings))
+            parser = JSONFieldStream()
+            json_answer_1 = {}
+            personality_sent = False
+            llm_start = time.perf_counter()
+            async for delta in openrouter_stream([{"role": "user", "content": content}]):
+                if "style_llm_first_token" not in timings:
+                    timings["style_llm_first_token"] = time.perf_counter() - llm_start
+                    record("openrouter_first_token", timings["style_llm_first_token"])
+                for key, value in parser.feed(delta):
+                    if key == "current_style":
+                        value = with_hexcolors(value, await palette_task)
+                    json_answer_1[key] = value
+                    if key in STREAMED_STYLE_FIELDS:
+                        value = normalize_style_field(key, value)
+                        if key == "improved_style":
+                            # The rest of the answer doesn't change the recommendations
+                            prefetch_recommendations(value)
+                        yield sse_event(key, value)
+                    elif (
+                        SINGLE_ROUNDTRIP and not personality_sent
+                        and is_valid_personality(json_answer_1.get("personality"))
+                        and is_valid_emoji(json_answer_1.get("emoji"))
+                    ):
+                        # Valid personality/emoji in the first answer: no need to wait for the end
+                        personality_sent = True
+                        yield sse_event("personality", {
+                            "personality": normalize_style_field("personality", json_answer_1["personality"].strip()),
+                            "emoji": json_answer_1["emoji"].strip()
+                        })
+            timings["style_llm"] = time.perf_counter() - llm_start
+            record("openrouter_stream", timings["style_llm"])
+            
+            missing = [key for key in STREAMED_STYLE_FIELDS if key not in json_answer_1]
+            if missing:
+                raise ValueError(f"Model answer is missing {', '.join(missing)}")
+            
+            json_answer_2 = await resolve_personality(json_answer_1, timings)
+            json_answer_2["personality"] = normalize_style_field("personality", json_answer_2["personality"])
+            if not personality_sent:
+                yield sse_event("personality", json_answer_2)
+            
+            for key in ("current_style", "improved_style", "current_summary"):
+                json_answer_1[key] = normalize_style_field(key, json_answer_1[key])
+            final_answer = {**json_answer_1, **json_answer_2}
+            style_cache.set(cache_key, final_answer)
+            
+            yield sse_event("done", {"answer": final_answer, "timings": format_timings(timings), "cached": False, "merged": merged, "image_ids": all_ids, "ingest": ingest})
+        except Exception as e:
+            print("ERROR in /eval-style/stream:", repr(e))
+            traceback.print_exc()
+            detail = e.detail if isinstance(e, HTTPException) else f"Backend error: {str(e)}"
+            yield sse_event("error", {"detail": detail})
+    
+    return StreamingResponse(
+        stream_with_budget(events(), EVAL_STYLE_BUDGET),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Style DNA fields that feed the search-terms prompt; anything else (hexcolors,
+# personality, scores...) doesn't change the suggested items
+SEARCH_TERMS_FIELDS = ("name", "colors", "fit", "textures", "layering", "accessories")
+
+search_terms_cache = LRUCache(
+    max_entries=int(os.getenv("SEARCH_TERMS_CACHE_MAX_ENTRIES", "1024")),
+    ttl=float(os.getenv("SEARCH_TERMS_CACHE_TTL", "86400")),
+)
+
+def _normalize_text(value: Any) -> Any:
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, list):
+        return [_normalize_text(v) for v in value]
+    return value
+
+def canonical_search_profile(style_profile: dict[str, Any]) -> dict[str, Any]:
+    """
+    Keep only the fields used by the search-terms prompt, with whitespace collapsed
+    and empty values dropped. Keys are sorted so equal profiles dump identically.
+    """
+    profile = {}
+    for key in sorted(SEARCH_TERMS_FIELDS):
+        value = _normalize_text(style_profile.get(key))
+        if value not in (None, "", []):
+            profile[key] = value
+    return profile
+
+def search_terms_cache_key(profile: dict[str, Any], template: str) -> str:
+    # Case doesn't change the suggestions; the prompt text and model act as the version
+    canonical = json.dumps(profile, sort_keys=True).lower()
+    prompt_version = hashlib.sha256(f"{template}\0{MODEL_NAME}".encode()).hexdigest()
+    return hashlib.sha256(f"{prompt_version}\0{canonical}".encode()).hexdigest()
+
+
+def fallback_search_terms(profile: dict[str, Any]) -> list[str]:
+    """Generic top / bottom / accessory terms from the profile, for when the model is unavailable."""
+    colors = profile.get("colors") or ["neutral"]
+    accessories = profile.get("accessories") or ["leather belt"]
+    return [f"{colors[0]} shirt", f"{colors[1 % len(colors)]} trousers", accessories[0]]
+
+
 # Provides the list of 3 suggested search terms for clothing, based on the style JSON
 @app.post("/search-terms", response_model=SearchTermsResponse)
 async def search_terms(req: SearchTermsRequest):
+    # Nested under /recommendations-multi, the outer (shorter) budget wins
+    with request_budget(SEARCH_TERMS_BUDGET):
+        return await _search_terms(req)
+
+
+async def _search_terms(req: SearchTermsRequest) -> dict:
     try:
         style_profile = req.profile
         #weather = req.weather
@@ -173,18 +824,29 @@ async def search_terms(req: SearchTermsRequest):
         if not style_profile:
             raise HTTPException(status_code=400, detail="Style response is required")
         
-        prompt = load_prompt(
-            "search-terms",
-            ""
-        ).replace("<styledesc>", json.dumps(style_profile))
+        template = load_prompt("search-terms", "")
+        profile = canonical_search_profile(style_profile)
+        
+        # Identical profiles (up to case/whitespace/irrelevant fields) reuse the last answer
+        cache_key = search_terms_cache_key(profile, template)
+        cached_answer = search_terms_cache.get(cache_key)
+        if cached_answer is not None:
+            return {"answer": cached_answer}
+        
+        prompt = template.replace("<styledesc>", json.dumps(profile))
 
-        resp = openrouter_post([{"role": "user", "content": prompt}])
+        try:
+            resp = await openrouter_post([{"role": "user", "content": prompt}])
+        except (CircuitOpen, DeadlineExceeded, httpx.HTTPError) as e:
+            # Degraded but usable: recommendations still come back, and the answer isn't cached
+            print(f"Search terms fell back to the profile: {e!r}")
+            return {"answer": fallback_search_terms(profile), "degraded": True}
         answer = (resp["choices"][0]["message"]["content"] or "").strip()
         if not answer: 
             raise HTTPException(status_code=502, detail="Model returned empty text")
         
         json_answer = extract_json(answer, '[', ']')
-        
+        search_terms_cache.set(cache_key, json_answer)
         
         return {"answer": json_answer}
     except HTTPException:
@@ -208,17 +870,9 @@ class SearchShopifyResponse(BaseModel):
 @app.post("/search-shopify", response_model=SearchShopifyResponse)
 def search_shopify(req: SearchShopifyRequest):
     print("search_shopify called")
-    response = requests.post(
-        url="https://api.shopify.com/auth/access_token",
-        headers={
-            'Content-Type': 'application/json'
-        }, 
-        data=json.dumps({
-            "client_id": os.getenv("SHOPIFY_CLIENT_ID"),
-            "client_secret": os.getenv("SHOPIFY_CLIENT_SECRET"),
-            "grant_type": "client_credentials"
-        }))
-    token = response.json()["access_token"]
+    # Import Shopify functions here to avoid env var issues on startup
+    from shopfiy_mcp_example import get_token
+    token = get_token()
     response = requests.post(
         'https://discover.shopifyapps.com/global/mcp',
         headers={
@@ -252,6 +906,7 @@ class RecommendationsRequest(BaseModel):
     fit: str
     textures: str
     accessories: List[str]
+    hexcolors: List[str] = []
 
 class RecommendationsResponse(BaseModel):
     results: List[dict[str, Any]]
@@ -262,9 +917,14 @@ class CategorizedRecommendationsRequest(BaseModel):
     fit: str
     textures: str
     accessories: List[str]
+    hexcolors: List[str] = []
 
 class CategorizedRecommendationsResponse(BaseModel):
     results: dict[str, List[dict[str, Any]]]
+    failed: List[str] = []  # categories whose search failed or timed out
+    degraded: List[str] = []  # categories served from the local product index, Shopify was unavailable
+    search_terms_degraded: bool = False  # searched with generic terms from the profile, the model was unavailable
+    reasons: dict[str, List[str]] = {}  # compact mode only: each category's reasons, dropped from its items
 
 @app.post("/recommendations", response_model=RecommendationsResponse)
 def get_recommendations(req: RecommendationsRequest):
@@ -321,8 +981,14 @@ def get_recommendations(req: RecommendationsRequest):
             f"Great for {req.fit}" if req.fit else "Great for your style"
         ]
         
+        # Rank the shirts against the Style DNA before returning them
+        offers = rerank_offers(
+            product_index, mcp_response.get("offers", []), style_profile_from_request(req),
+            search_query, limit=10
+        )
+        
         # Parse offers into recommendations
-        recommendations = parse_shopify_offers_to_recommendations(mcp_response, reasons=reasons)
+        recommendations = parse_shopify_offers_to_recommendations({"offers": offers}, reasons=reasons)
         
         return {"results": recommendations}
         
@@ -334,85 +1000,410 @@ def get_recommendations(req: RecommendationsRequest):
         raise HTTPException(status_code=500, detail=f"Backend error: {str(e)}")
 
 
+def style_profile_from_request(req: CategorizedRecommendationsRequest | RecommendationsRequest) -> dict[str, Any]:
+    # Style DNA fields used for local ranking
+    return {
+        "name": req.style_name,
+        "colors": req.colors,
+        "hexcolors": req.hexcolors,
+        "fit": req.fit,
+        "textures": req.textures,
+        "accessories": req.accessories,
+    }
+
+async def fetch_shopify_token() -> str:
+    # Import Shopify functions here to avoid env var issues on startup
+    from shopfiy_mcp_example import get_token
+    try:
+        # Off the event loop, it may block on a refresh
+        return await asyncio.to_thread(get_token)
+    except Exception as e:
+        print(f"Shopify auth failed: {e}")
+        raise HTTPException(status_code=502, detail="Failed to authenticate with Shopify")
+
+async def generate_category_queries(req: CategorizedRecommendationsRequest) -> tuple[dict[str, str], bool]:
+    """
+    Ask search_terms for 3 clothing items and map them to tops, bottoms, accessories.
+    Returns: (category mapping, degraded), degraded when the terms are the profile fallback
+    """
+    search_terms_req = SearchTermsRequest(profile={
+        "name": req.style_name,
+        "colors": req.colors,
+        "fit": req.fit,
+        "textures": req.textures,
+        "layering": "",
+        "accessories": req.accessories,
+        "hexcolors": []
+    })
+    
+    # Call search_terms asynchronously
+    search_terms_result = await search_terms(search_terms_req)
+    clothing_items = search_terms_result.get("answer", [])
+    
+    if not clothing_items or len(clothing_items) < 3:
+        raise HTTPException(status_code=502, detail="Failed to generate search terms")
+    
+    # Extract the 3 items (tops, bottoms, accessories)
+    return {
+        "tops": clothing_items[0],
+        "bottoms": clothing_items[1],
+        "accessories": clothing_items[2]
+    }, search_terms_result.get("degraded", False)
+
+async def search_offers(token: str, item_query: str, context: str) -> tuple[dict, bool]:
+    """
+    Shopify search for one category, bounded by CATEGORY_TIMEOUT and the request budget.
+    
+    Cached results (fresh or stale) are served by search_products_by_style without calling
+    Shopify. On a miss while Shopify is failing (breaker open, error, timeout), fall back to
+    matching products already in the local index.
+    Returns: (mcp_response, degraded)
+    """
+    from shopfiy_mcp_example import search_products_by_style
+    try:
+        # requests is blocking, so each search runs in a worker thread.
+        # Fetch a larger pool once and rerank it locally against the Style DNA.
+        mcp_response = await asyncio.wait_for(
+            asyncio.to_thread(search_products_by_style, token, item_query, context, CANDIDATE_POOL),
+            timeout=call_timeout(CATEGORY_TIMEOUT)
+        )
+        return mcp_response, False
+    except (CircuitOpen, DeadlineExceeded, asyncio.TimeoutError, requests.RequestException) as e:
+        offers = await asyncio.to_thread(lambda: product_index.get_offers(product_index.search(item_query, CANDIDATE_POOL)))
+        if not offers:
+            raise
+        print(f"Shopify search for {item_query!r} degraded to {len(offers)} indexed products: {e!r}")
+        return {"offers": offers}, True
+
+async def search_category(token: str, category: str, item_query: str, req: CategorizedRecommendationsRequest) -> tuple[list, bool]:
+    """
+    Run one category's Shopify search and parse it into recommendations.
+    Returns: (recommendations, degraded)
+    """
+    from shopfiy_mcp_example import parse_shopify_offers_to_recommendations
+    
+    # Build context from style profile
+    colors_str = ", ".join(req.colors) if req.colors else "neutral tones"
+    context = f"Style: {req.style_name}. Fit: {req.fit}. Colors: {colors_str}"
+    
+    mcp_response, degraded = await search_offers(token, item_query, context)
+    with timed("rank_offers"):
+        ranked = await asyncio.to_thread(
+            rank_offers, product_index, mcp_response.get("offers", []), style_profile_from_request(req), item_query
+        )
+    if PALETTE_MATCHING and req.hexcolors:
+        # Check the best candidates' product images against the Style DNA palette
+        with timed("palette_rerank"):
+            offers = await palette_matcher.rerank(ranked, req.hexcolors, RECOMMENDATIONS_PER_CATEGORY, weight=PALETTE_WEIGHT)
+    else:
+        offers = [offer for offer, _ in ranked[:RECOMMENDATIONS_PER_CATEGORY]]
+    
+    # Generate reasons
+    reasons = [
+        f"Perfect {category} for {req.style_name}",
+        f"Complements your palette: {colors_str}",
+        f"Great for {req.fit}" if req.fit else "Great for your style"
+    ]
+    
+    # Parse offers into recommendations
+    return parse_shopify_offers_to_recommendations({"offers": offers}, reasons=reasons), degraded
+
+async def search_category_safe(token: str, category: str, item_query: str, req: CategorizedRecommendationsRequest) -> tuple[str, list, bool, bool]:
+    """
+    A failed or timed out category comes back empty instead of failing the whole request.
+    Returns: (category, recommendations, failed, degraded)
+    """
+    try:
+        recommendations, degraded = await search_category(token, category, item_query, req)
+        return category, recommendations, False, degraded
+    except Exception as e:
+        print(f"Shopify search failed for {category}: {e!r}")
+        return category, [], True, False
+
+
+async def compute_recommendations(req: CategorizedRecommendationsRequest) -> dict:
+    """
+    Search terms, then the 3 category searches concurrently.
+    Returns: {search_terms, search_terms_degraded, results, failed, degraded}
+    """
+    # The token doesn't depend on the search terms, so fetch both at once
+    token_task = asyncio.create_task(fetch_shopify_token())
+    try:
+        category_mapping, search_terms_degraded = await generate_category_queries(req)
+    except BaseException:
+        token_task.cancel()
+        raise
+    token = await token_task
+    
+    outcomes = await asyncio.gather(
+        *(search_category_safe(token, category, item_query, req) for category, item_query in category_mapping.items())
+    )
+    
+    results = {category: recommendations for category, recommendations, _, _ in outcomes}
+    failed = [category for category, _, category_failed, _ in outcomes if category_failed]
+    degraded = [category for category, _, _, category_degraded in outcomes if category_degraded]
+    return {
+        "search_terms": category_mapping, "search_terms_degraded": search_terms_degraded,
+        "results": results, "failed": failed, "degraded": degraded,
+    }
+
+
+# Speculative /recommendations-multi: the page always asks for recommendations for the
+# improved_style it just got, so start that work as soon as /eval-style has it and park
+# the answer for a few minutes. Prefetch runs at most PREFETCH_CONCURRENCY at a time so
+# it can't crowd out foreground requests, and is dropped beyond PREFETCH_MAX_PENDING.
+PREFETCH_RECOMMENDATIONS = os.getenv("PREFETCH_RECOMMENDATIONS", "1").lower() not in ("0", "false", "no")
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "2"))
+PREFETCH_MAX_PENDING = int(os.getenv("PREFETCH_MAX_PENDING", "16"))
+
+prefetched_recommendations = LRUCache(
+    max_entries=int(os.getenv("PREFETCH_MAX_ENTRIES", "256")),
+    ttl=float(os.getenv("PREFETCH_TTL", "300")),
+)
+prefetch_tasks: dict[str, asyncio.Task] = {}
+prefetch_running: set[str] = set()  # keys past the semaphore, actually calling upstreams
+prefetch_semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+prefetch_stats = {"started": 0, "skipped": 0, "hits": 0, "joined": 0, "cancelled": 0, "failed": 0}
+
+def recommendations_key(req: CategorizedRecommendationsRequest) -> str:
+    return hashlib.sha256(json.dumps(style_profile_from_request(req), sort_keys=True).encode()).hexdigest()
+
+def prefetch_recommendations(style: dict[str, Any] | None):
+    """
+    Start computing /recommendations-multi for an improved_style in the background,
+    with the request the frontend builds from it.
+    """
+    if not PREFETCH_RECOMMENDATIONS or not isinstance(style, dict):
+        return
+    try:
+        req = CategorizedRecommendationsRequest(
+            style_name=style.get("name"),
+            colors=style.get("colors"),
+            fit=style.get("fit"),
+            textures=style.get("textures"),
+            accessories=style.get("accessories"),
+            hexcolors=style.get("hexcolors") or [],
+        )
+    except ValidationError:
+        return
+    key = recommendations_key(req)
+    if key in prefetch_tasks or prefetched_recommendations.get(key) is not None:
+        return
+    if len(prefetch_tasks) >= PREFETCH_MAX_PENDING:
+        prefetch_stats["skipped"] += 1
+        return
+    prefetch_stats["started"] += 1
+    # Fresh context: the prefetch must not inherit the /eval-style budget or Server-Timing
+    prefetch_tasks[key] = asyncio.create_task(run_prefetch(key, req), context=contextvars.Context())
+
+def is_complete(answer: dict) -> bool:
+    """Every category answered by Shopify, for search terms the model chose."""
+    return not answer["failed"] and not answer["degraded"] and not answer["search_terms_degraded"]
+
+async def run_prefetch(key: str, req: CategorizedRecommendationsRequest):
+    try:
+        async with prefetch_semaphore:
+            prefetch_running.add(key)
+            with request_budget(RECOMMENDATIONS_BUDGET):
+                answer = await compute_recommendations(req)
+        # Only park complete answers; a foreground request should retry failed categories
+        # and placeholder search terms
+        if is_complete(answer):
+            prefetched_recommendations.set(key, answer)
+        return answer
+    except asyncio.CancelledError:
+        prefetch_stats["cancelled"] += 1
+        raise
+    except Exception as e:
+        prefetch_stats["failed"] += 1
+        print(f"Recommendations prefetch failed: {e!r}")
+    finally:
+        prefetch_running.discard(key)
+        prefetch_tasks.pop(key, None)
+
+async def take_prefetched(req: CategorizedRecommendationsRequest) -> dict | None:
+    """
+    A parked or in-flight prefetch for this request, or None to compute it in the foreground.
+    A prefetch still queued behind the semaphore is cancelled rather than waited for.
+    """
+    if not PREFETCH_RECOMMENDATIONS:
+        return None
+    key = recommendations_key(req)
+    answer = prefetched_recommendations.get(key)
+    if answer is not None:
+        prefetch_stats["hits"] += 1
+        return answer
+    task = prefetch_tasks.get(key)
+    if task is None:
+        return None
+    if key not in prefetch_running:
+        task.cancel()
+        return None
+    prefetch_stats["joined"] += 1
+    # Shielded: a client hanging up mustn't cancel the prefetch for the next one
+    answer = await asyncio.shield(task)
+    return answer if answer is not None and is_complete(answer) else None
+
+
 @app.post("/recommendations-multi", response_model=CategorizedRecommendationsResponse)
-async def get_recommendations_multi(req: CategorizedRecommendationsRequest):
+async def get_recommendations_multi(req: CategorizedRecommendationsRequest, compact: bool = False, fields: str | None = None):
     """
     Generate multi-category product recommendations (tops, bottoms, accessories).
     
-    Calls search_terms to get 3 clothing items, then makes 3 separate Shopify queries.
-    Each query uses style_name and fit as context.
+    Calls search_terms to get 3 clothing items, then makes 3 concurrent Shopify queries.
+    Each query uses style_name and fit as context. A category that fails or times out
+    is returned empty and listed in `failed`; one answered from the local product index
+    because Shopify is unavailable is listed in `degraded`. `search_terms_degraded` is set
+    when the model was unavailable and generic terms from the profile were searched instead.
+    
+    Usually answered from the prefetch started by /eval-style for the same improved_style.
+    
+    `compact=true` drops empty fields and sends each category's reasons once, in `reasons`,
+    instead of on every item; `fields=id,title,price,...` keeps only those item fields
+    (and implies compact).
     """
+    with request_budget(RECOMMENDATIONS_BUDGET):
+        body = await _get_recommendations_multi(req)
+    if compact or fields:
+        body["results"], body["reasons"] = compact_recommendations(body["results"], parse_fields(fields))
+    return FastJSONResponse(body)
+
+
+async def _get_recommendations_multi(req: CategorizedRecommendationsRequest) -> dict:
     try:
-        # Import Shopify functions here to avoid env var issues on startup
-        from shopfiy_mcp_example import get_token, search_products_by_style, parse_shopify_offers_to_recommendations
-        
-        # Step 1: Get 3 clothing items from search-terms
-        search_terms_req = SearchTermsRequest(profile={
-            "name": req.style_name,
-            "colors": req.colors,
-            "fit": req.fit,
-            "textures": req.textures,
-            "layering": "",
-            "accessories": req.accessories,
-            "hexcolors": []
-        })
-        
-        # Call search_terms asynchronously
-        search_terms_result = await search_terms(search_terms_req)
-        clothing_items = search_terms_result.get("answer", [])
-        
-        if not clothing_items or len(clothing_items) < 3:
-            raise HTTPException(status_code=502, detail="Failed to generate search terms")
-        
-        # Extract the 3 items (tops, bottoms, accessories)
-        tops_item = clothing_items[0]
-        bottoms_item = clothing_items[1]
-        accessories_item = clothing_items[2]
-        
-        # Step 2: Build context from style profile
-        colors_str = ", ".join(req.colors) if req.colors else "neutral tones"
-        context = f"Style: {req.style_name}. Fit: {req.fit}. Colors: {colors_str}"
-        
-        # Step 3: Get Shopify token
-        try:
-            token = get_token()
-        except Exception as e:
-            print(f"Shopify auth failed: {e}")
-            raise HTTPException(status_code=502, detail="Failed to authenticate with Shopify")
-        
-        # Step 4: Make 3 separate Shopify queries and collect results
-        results = {}
-        category_mapping = {
-            "tops": tops_item,
-            "bottoms": bottoms_item,
-            "accessories": accessories_item
+        answer = await take_prefetched(req) or await compute_recommendations(req)
+        return {
+            "results": answer["results"], "failed": answer["failed"], "degraded": answer["degraded"],
+            "search_terms_degraded": answer["search_terms_degraded"],
         }
         
-        for category, item_query in category_mapping.items():
-            try:
-                # Search Shopify for this category
-                mcp_response = search_products_by_style(token, item_query, context, limit=5)
-                
-                # Generate reasons
-                reasons = [
-                    f"Perfect {category} for {req.style_name}",
-                    f"Complements your palette: {colors_str}",
-                    f"Great for {req.fit}" if req.fit else "Great for your style"
-                ]
-                
-                # Parse offers into recommendations
-                recommendations = parse_shopify_offers_to_recommendations(mcp_response, reasons=reasons)
-                results[category] = recommendations
-                
-            except Exception as e:
-                print(f"Shopify search failed for {category}: {e}")
-                results[category] = []
-        
-        return {"results": results}
-        
     except HTTPException:
         raise
     except Exception as e:
         print(f"ERROR in /recommendations-multi: {repr(e)}")
         traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Backend error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Backend error: {str(e)}")
+
+
+@app.post("/recommendations-multi/stream")
+async def get_recommendations_multi_stream(req: CategorizedRecommendationsRequest, compact: bool = False, fields: str | None = None):
+    """
+    Server-Sent Events variant of /recommendations-multi.
+    
+    Events, in order of availability:
+    - search_terms: {tops, bottoms, accessories} queries, as soon as search_terms returns
+    - category: {category, results, failed, degraded} for each category as its Shopify query finishes
+      (plus `reasons` with compact / fields, as in /recommendations-multi)
+    - done: {failed, degraded, search_terms_degraded}
+    - error: {detail} if search terms or auth fail
+    """
+    field_set = parse_fields(fields)
+    
+    def category_event(category: str, recommendations: list, category_failed: bool, category_degraded: bool) -> str:
+        data = {"category": category, "results": recommendations, "failed": category_failed, "degraded": category_degraded}
+        if compact or field_set:
+            data["results"], data["reasons"] = compact_items(recommendations, field_set)
+        return sse_event("category", data)
+    
+    async def events():
+        try:
+            prefetched = await take_prefetched(req)
+        except Exception:
+            prefetched = None
+        if prefetched is not None:
+            yield sse_event("search_terms", prefetched["search_terms"])
+            for category, recommendations in prefetched["results"].items():
+                yield category_event(category, recommendations, False, False)
+            yield sse_event("done", {"failed": [], "degraded": [], "search_terms_degraded": False})
+            return
+        
+        token_task = asyncio.create_task(fetch_shopify_token())
+        try:
+            category_mapping, search_terms_degraded = await generate_category_queries(req)
+            yield sse_event("search_terms", category_mapping)
+            token = await token_task
+            
+            failed = []
+            degraded = []
+            for next_done in asyncio.as_completed([
+                search_category_safe(token, category, item_query, req)
+                for category, item_query in category_mapping.items()
+            ]):
+                category, recommendations, category_failed, category_degraded = await next_done
+                if category_failed:
+                    failed.append(category)
+                if category_degraded:
+                    degraded.append(category)
+                yield category_event(category, recommendations, category_failed, category_degraded)
+            
+            yield sse_event("done", {"failed": failed, "degraded": degraded, "search_terms_degraded": search_terms_degraded})
+        except Exception as e:
+            token_task.cancel()
+            print(f"ERROR in /recommendations-multi/stream: {repr(e)}")
+            if not isinstance(e, HTTPException):
+                traceback.print_exc()
+            detail = e.detail if isinstance(e, HTTPException) else f"Backend error: {str(e)}"
+            yield sse_event("error", {"detail": detail})
+    
+    return StreamingResponse(
+        stream_with_budget(events(), RECOMMENDATIONS_BUDGET),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def personality_summary() -> dict:
+    single = personality_stats["single_roundtrip"]
+    fallbacks = personality_stats["fallbacks"]
+    total = single + fallbacks
+    # Each single round trip saves roughly one average fallback call
+    avg_fallback_ms = personality_stats["fallback_seconds"] * 1000 / fallbacks if fallbacks else 0.0
+    return {
+        "single_roundtrip": single,
+        "fallbacks": fallbacks,
+        "fallback_rate": round(fallbacks / total, 3) if total else 0.0,
+        "avg_fallback_ms": round(avg_fallback_ms, 1),
+        "estimated_saved_ms": round(single * avg_fallback_ms, 1),
+    }
+
+
+@app.get("/ready")
+def get_ready():
+    """Readiness probe: 503 until startup (prompts, warm-up) is done and again while shutting down."""
+    if not ready:
+        raise HTTPException(status_code=503, detail="Starting up")
+    return {"ready": True, **startup_stats}
+
+
+# Process-level counters for the caches and upstream clients
+@app.get("/metrics")
+def get_metrics():
+    body, content_type = metrics_response()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/stats")
+def get_stats():
+    stats = {
+        "openrouter": llm.stats(),
+        "upstreams": {"openrouter": openrouter_upstream.stats()},
+        "single_flight": {"openrouter": openrouter_flight.stats()},
+        "style_cache": style_cache.stats(),
+        "personality": personality_summary(),
+        "images": image_stats,
+        "image_store": image_store.stats(),
+        "search_terms_cache": search_terms_cache.stats(),
+        "admission": {"eval_style": eval_style_admission.stats(), "recommendations": recommendations_admission.stats()},
+        "prefetch": {**prefetch_stats, "pending": len(prefetch_tasks), "parked": len(prefetched_recommendations)},
+        "product_index": product_index.stats(),
+        "palette": palette_matcher.stats(),
+    }
+    try:
+        from shopfiy_mcp_example import token_manager, search_cache_stats, mcp_upstream, mcp_flight
+        stats["upstreams"]["shopify_mcp"] = mcp_upstream.stats()
+        stats["single_flight"]["shopify_mcp"] = mcp_flight.stats()
+        stats["shopify_token"] = token_manager.stats()
+        stats["shopify_search"] = search_cache_stats()
+    except Exception as e:
+        stats["shopify"] = {"error": str(e)}
+    return stats
@@ -0,0 +1,142 @@
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+# Seconds; stages range from sub-millisecond parsing to multi-second LLM calls
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+
+STAGE_SECONDS = Histogram(
+    "fitcheck_stage_seconds",
+    "Time spent in each stage of request handling",
+    ["stage"],
+    buckets=BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "fitcheck_request_seconds",
+    "Time to the last response byte, per endpoint",
+    ["method", "path", "status"],
+    buckets=BUCKETS,
+)
+
+COALESCED_CALLS = Counter(
+    "fitcheck_coalesced_calls",
+    "Upstream calls that joined an identical call already in flight",
+    ["upstream"],
+)
+
+STARTUP_SECONDS = Gauge(
+    "fitcheck_startup_seconds",
+    "Time spent in each startup phase (imports, prompts, warmup, total)",
+    ["phase"],
+)
+
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "fitcheck_admission_queue_depth",
+    "Requests waiting for an admission slot",
+    ["endpoint"],
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "fitcheck_admission_in_flight",
+    "Requests holding an admission slot",
+    ["endpoint"],
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "fitcheck_admission_wait_seconds",
+    "Time admitted or timed out requests spent queued",
+    ["endpoint"],
+    buckets=BUCKETS,
+)
+ADMISSION_REJECTED = Counter(
+    "fitcheck_admission_rejected",
+    "Requests turned away by admission control",
+    ["endpoint", "reason"],
+)
+
+
+class ServerTiming:
+    """Per-request stage totals, written from the event loop and worker threads alike."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self._stages[stage] = self._stages.get(stage, 0.0) + seconds
+
+    def header(self, total: float) -> str:
+        with self._lock:
+            parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self._stages.items()]
+        parts.append(f"app;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+# Set by ServerTimingMiddleware for the duration of each request. asyncio tasks and
+# asyncio.to_thread copy the context, so stages timed there land on the same request.
+_current: ContextVar[ServerTiming | None] = ContextVar("server_timing", default=None)
+
+
+def record(stage: str, seconds: float):
+    """Observe a stage duration in the histogram and the current request's Server-Timing."""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    timing = _current.get()
+    if timing is not None:
+        timing.add(stage, seconds)
+
+
+@contextmanager
+def timed(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def metrics_response() -> tuple[bytes, str]:
+    """Prometheus text exposition of every metric, and its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware adding a Server-Timing header with the stages recorded so far,
+    and observing each request's total time per route.
+
+    Written as plain ASGI rather than BaseHTTPMiddleware so streamed (SSE) responses
+    pass through unbuffered; their header covers the stages done before the first byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timing = ServerTiming()
+        token = _current.set(timing)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timing.header(time.perf_counter() - start).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            # Label by route template, not the raw path, to keep cardinality bounded
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            REQUEST_SECONDS.labels(scope["method"], path, str(status)).observe(time.perf_counter() - start)
@@ -0,0 +1,326 @@
+import asyncio
+from io import BytesIO
+from typing import Any
+from urllib.parse import urlparse
+
+import httpx
+import numpy as np
+from PIL import Image
+
+from cache import LRUCache
+from product_index import hex_to_rgb
+
+# Side of the square thumbnail each product image is reduced to before clustering
+THUMBNAIL_SIZE = 32
+# Dominant colors extracted per image
+PALETTE_SIZE = 4
+KMEANS_ITERATIONS = 8
+# Scale of the CIE76 delta E at which a palette match drops to 1/e
+MATCH_SCALE = 25.0
+# Colors clustered across an upload set, and the smallest share of clothing pixels one must cover
+OUTFIT_PALETTE_SIZE = 6
+OUTFIT_MIN_SHARE = 0.05
+# Largest product image downloaded for a palette; CDN renditions at THUMBNAIL_SIZE * 4 are a few KB
+MAX_IMAGE_BYTES = 4 * 1024 * 1024
+
+# D65 reference white
+_WHITE = np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+_RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+], dtype=np.float32)
+
+
+def srgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """Convert sRGB values in 0-255 (any shape ending in 3) to CIELAB."""
+    c = np.asarray(rgb, dtype=np.float32) / 255.0
+    linear = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ _RGB_TO_XYZ.T / _WHITE
+    f = np.where(xyz > 216 / 24389, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    return np.stack([
+        116 * f[..., 1] - 16,
+        500 * (f[..., 0] - f[..., 1]),
+        200 * (f[..., 1] - f[..., 2]),
+    ], axis=-1)
+
+
+def lab_to_hex(lab: np.ndarray) -> list[str]:
+    """Convert CIELAB colors of shape (n, 3) back to sRGB hex strings."""
+    lab = np.asarray(lab, dtype=np.float32)
+    fy = (lab[:, 0] + 16) / 116
+    f = np.stack([fy + lab[:, 1] / 500, fy, fy - lab[:, 2] / 200], axis=-1)
+    xyz = np.where(f ** 3 > 216 / 24389, f ** 3, (116 * f - 16) / (24389 / 27)) * _WHITE
+    linear = xyz @ np.linalg.inv(_RGB_TO_XYZ).T
+    c = np.where(linear <= 0.0031308, 12.92 * linear, 1.055 * np.clip(linear, 0, None) ** (1 / 2.4) - 0.055)
+    rgb = np.clip(np.round(c * 255), 0, 255).astype(int)
+    return [f"#{r:02X}{g:02X}{b:02X}" for r, g, b in rgb]
+
+
+def kmeans_batch(points: np.ndarray, weights: np.ndarray, k: int = PALETTE_SIZE,
+                 iterations: int = KMEANS_ITERATIONS) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Weighted k-means over a batch of images at once.
+
+    Args:
+        points: (B, N, 3) pixel colors, one row of N pixels per image
+        weights: (B, N) per-pixel weights (0 drops a pixel)
+        k: clusters per image
+
+    Returns:
+        (centers (B, k, 3), share of weight per center (B, k))
+    """
+    _, n, _ = points.shape
+    # Deterministic init: pixels at evenly spaced lightness quantiles
+    order = np.argsort(points[..., 0], axis=1)
+    picks = order[:, ((np.arange(k) + 0.5) * n / k).astype(int)]
+    centers = np.take_along_axis(points, picks[..., None], axis=1)
+
+    for _ in range(iterations):
+        distances = ((points[:, :, None, :] - centers[:, None, :, :]) ** 2).sum(axis=-1)
+        assigned = (distances.argmin(axis=-1)[..., None] == np.arange(k)) * weights[..., None]  # (B, N, k)
+        totals = assigned.sum(axis=1)  # (B, k)
+        sums = np.einsum("bnk,bnc->bkc", assigned, points)
+        centers = np.where(totals[..., None] > 0, sums / np.maximum(totals, 1e-9)[..., None], centers)
+
+    shares = totals / np.maximum(totals.sum(axis=1, keepdims=True), 1e-9)
+    return centers.astype(np.float32), shares.astype(np.float32)
+
+
+def background_weights(lab: np.ndarray, min_share: float = 0.1) -> np.ndarray:
+    """
+    Per-pixel weights that ignore the near-white, low-chroma backdrop of product shots.
+    Falls back to uniform weights for images that are mostly white (e.g. white products).
+    """
+    chroma = np.hypot(lab[..., 1], lab[..., 2])
+    weights = ~((lab[..., 0] > 92) & (chroma < 8))
+    keep_all = weights.mean(axis=-1, keepdims=True) < min_share
+    return np.where(keep_all, 1.0, weights).astype(np.float32)
+
+
+def extract_palettes(thumbnails: list[np.ndarray]) -> list[dict[str, list]]:
+    """
+    Dominant colors for a batch of (THUMBNAIL_SIZE, THUMBNAIL_SIZE, 3) RGB thumbnails,
+    clustered together in one k-means pass.
+    Returns one {"lab": [[L, a, b], ...], "weights": [...]} per thumbnail.
+    """
+    if not thumbnails:
+        return []
+    lab = srgb_to_lab(np.stack(thumbnails).reshape(len(thumbnails), -1, 3))
+    centers, shares = kmeans_batch(lab, background_weights(lab))
+    return [
+        {"lab": np.round(c, 2).tolist(), "weights": np.round(s, 4).tolist()}
+        for c, s in zip(centers, shares)
+    ]
+
+
+def outfit_weights(lab: np.ndarray) -> np.ndarray:
+    """
+    Per-pixel weights for (B, H, W, 3) CIELAB photos of a person, favoring their clothing:
+    - a centered Gaussian, since the subject is usually framed in the middle
+    - pixels close to the image's border color (the backdrop) are faded out
+    - likely skin tones are damped so faces and arms don't dominate
+    """
+    _, h, w, _ = lab.shape
+    ys = (np.arange(h, dtype=np.float32) - (h - 1) / 2) / (0.35 * h)
+    xs = (np.arange(w, dtype=np.float32) - (w - 1) / 2) / (0.25 * w)
+    center = np.exp(-0.5 * (ys[:, None] ** 2 + xs[None, :] ** 2))  # (H, W)
+
+    border = np.concatenate([lab[:, 0], lab[:, -1], lab[:, :, 0], lab[:, :, -1]], axis=1)  # (B, 2H+2W, 3)
+    backdrop = np.median(border, axis=1)  # (B, 3)
+    distance = np.linalg.norm(lab - backdrop[:, None, None, :], axis=-1)
+    foreground = np.clip(distance / 30.0, 0.0, 1.0)
+
+    l, a, b = lab[..., 0], lab[..., 1], lab[..., 2]
+    skin = (l > 25) & (l < 90) & (a > 5) & (a < 30) & (b > 8) & (b < 40) & (b > 0.7 * a)
+    weights = center * foreground * np.where(skin, 0.2, 1.0)
+    # Subject matching the backdrop: fall back to the center weighting alone
+    empty = weights.reshape(len(lab), -1).sum(axis=1) < 0.05 * center.sum()
+    return np.where(empty[:, None, None], center, weights).astype(np.float32)
+
+
+def outfit_palette(thumbnails: list[np.ndarray], k: int = OUTFIT_PALETTE_SIZE,
+                   min_share: float = OUTFIT_MIN_SHARE) -> list[str]:
+    """
+    Dominant clothing colors across a set of (H, W, 3) RGB outfit photos, as hex strings
+    ordered by share. All photos are clustered together in one deterministic k-means pass,
+    so the same uploads always give the same palette.
+    """
+    thumbnails = [t for t in thumbnails if t is not None]
+    if not thumbnails:
+        return []
+    lab = srgb_to_lab(np.stack(thumbnails))
+    weights = outfit_weights(lab)
+    centers, shares = kmeans_batch(lab.reshape(1, -1, 3), weights.reshape(1, -1), k=k)
+    order = [i for i in np.argsort(-shares[0], kind="stable") if shares[0][i] >= min_share]
+    return list(dict.fromkeys(lab_to_hex(centers[0][order])))
+
+
+def palette_match(hexcolors: list[str], palettes: list[dict[str, list] | None]) -> np.ndarray:
+    """
+    Score how well each candidate palette sits inside the Style DNA palette, in one pass.
+
+    For every dominant color of a candidate, take the delta E (CIE76) to the nearest
+    Style DNA color, average by the color's share, and map to (0, 1] with exp(-d / MATCH_SCALE).
+    Candidates without a palette get NaN.
+    """
+    scores = np.full(len(palettes), np.nan, dtype=np.float32)
+    target_rgb = [c for c in (hex_to_rgb(h) for h in hexcolors or []) if c is not None]
+    present = [i for i, p in enumerate(palettes) if p and p.get("lab")]
+    if not target_rgb or not present:
+        return scores
+
+    target = srgb_to_lab(np.asarray(target_rgb, dtype=np.float32))  # (P, 3)
+    centers = np.asarray([palettes[i]["lab"] for i in present], dtype=np.float32)  # (B, k, 3)
+    shares = np.asarray([palettes[i]["weights"] for i in present], dtype=np.float32)  # (B, k)
+    nearest = np.linalg.norm(centers[:, :, None, :] - target[None, None, :, :], axis=-1).min(axis=-1)
+    distance = (nearest * shares).sum(axis=1) / np.maximum(shares.sum(axis=1), 1e-9)
+    scores[present] = np.exp(-distance / MATCH_SCALE)
+    return scores
+
+
+def _thumbnail_url(url: str) -> str:
+    # Shopify's CDN resizes on the fly, so only a small rendition is downloaded
+    if urlparse(url).hostname == "cdn.shopify.com":
+        return str(httpx.URL(url).copy_merge_params({"width": THUMBNAIL_SIZE * 4}))
+    return url
+
+
+def _decode_thumbnail(data: bytes) -> np.ndarray:
+    img = Image.open(BytesIO(data))
+    img.draft("RGB", (THUMBNAIL_SIZE * 2, THUMBNAIL_SIZE * 2))
+    img = img.convert("RGB").resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.Resampling.BILINEAR)
+    return np.asarray(img, dtype=np.uint8)
+
+
+class PaletteMatcher:
+    """
+    Extracts dominant colors from product images and compares them to a Style DNA palette.
+
+    Palettes are cached by image URL, so each product image is downloaded and clustered once.
+    Downloads that miss the request's deadline keep running in the background and are
+    clustered together afterwards, so the next request finds them cached.
+    """
+
+    def __init__(self, timeout: float = 1.5, max_concurrency: int = 16, cache_entries: int = 20000,
+                 max_bytes: int = MAX_IMAGE_BYTES):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client: httpx.AsyncClient | None = None
+        self._background: set[asyncio.Task] = set()
+        self._in_flight: dict[str, asyncio.Task] = {}
+        self.cache = LRUCache(max_entries=cache_entries)
+        self._counts = {"downloads": 0, "download_failures": 0, "too_large": 0, "late": 0}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(10.0, connect=3.0),
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+                follow_redirects=True,
+            )
+        return self._client
+
+    async def _fetch_thumbnail(self, url: str) -> np.ndarray | None:
+        async with self._semaphore:
+            try:
+                data = await self._download(_thumbnail_url(url))
+                if data is None:
+                    self._counts["too_large"] += 1
+                    return None
+                self._counts["downloads"] += 1
+                return await asyncio.to_thread(_decode_thumbnail, data)
+            except Exception as e:
+                print(f"Palette download failed for {url}: {e!r}")
+                self._counts["download_failures"] += 1
+                return None
+
+    async def _download(self, url: str) -> bytes | None:
+        """The image's bytes, read in chunks; None as soon as it passes max_bytes."""
+        async with self.client.stream("GET", url) as resp:
+            resp.raise_for_status()
+            chunks = []
+            size = 0
+            async for chunk in resp.aiter_bytes():
+                size += len(chunk)
+                if size > self.max_bytes:
+                    return None
+                chunks.append(chunk)
+        return b"".join(chunks)
+
+    async def _store(self, tasks: dict[str, asyncio.Task]):
+        # Cluster every finished download in one batch and cache the palettes
+        try:
+            thumbnails = {
+                url: task.result() for url, task in tasks.items()
+                if not task.cancelled() and task.result() is not None
+            }
+            palettes = await asyncio.to_thread(extract_palettes, list(thumbnails.values()))
+            for url, palette in zip(thumbnails, palettes):
+                self.cache.set(url, palette)
+            return dict(zip(thumbnails, palettes))
+        finally:
+            for url, task in tasks.items():
+                if self._in_flight.get(url) is task:
+                    del self._in_flight[url]
+
+    async def _store_late(self, tasks: dict[str, asyncio.Task]):
+        await asyncio.wait(tasks.values())
+        await self._store(tasks)
+
+    async def palettes(self, urls: list[str | None]) -> list[dict[str, list] | None]:
+        """Palettes for each image URL (None when missing or not ready within the timeout)."""
+        found = {}
+        missing = {}
+        for url in dict.fromkeys(u for u in urls if u):
+            palette = self.cache.get(url)
+            if palette is not None:
+                found[url] = palette
+            else:
+                # Reuse a download another request already started
+                if url not in self._in_flight:
+                    self._in_flight[url] = asyncio.create_task(self._fetch_thumbnail(url))
+                missing[url] = self._in_flight[url]
+
+        if missing:
+            done, pending = await asyncio.wait(missing.values(), timeout=self.timeout)
+            found.update(await self._store({url: t for url, t in missing.items() if t in done}))
+            late = {url: t for url, t in missing.items() if t in pending}
+            if late:
+                self._counts["late"] += len(late)
+                task = asyncio.create_task(self._store_late(late))
+                self._background.add(task)
+                task.add_done_callback(self._background.discard)
+
+        return [found.get(url) if url else None for url in urls]
+
+    async def rerank(self, ranked: list[tuple[dict, float]], hexcolors: list[str], limit: int,
+                     weight: float = 0.3, candidates: int | None = None) -> list[dict]:
+        """
+        Blend each offer's text score with its palette match and keep the `limit` best.
+        Only the top `candidates` (default 2 * limit) are checked; offers without a palette
+        get the median match so they are neither boosted nor buried.
+        """
+        pool = ranked[:candidates or 2 * limit]
+        if not hexcolors or not pool:
+            return [offer for offer, _ in ranked[:limit]]
+
+        urls = [(offer.get("media") or [{}])[0].get("url") for offer, _ in pool]
+        matches = palette_match(hexcolors, await self.palettes(urls))
+        if np.isnan(matches).all():
+            return [offer for offer, _ in ranked[:limit]]
+        matches = np.where(np.isnan(matches), np.nanmedian(matches), matches)
+
+        scores = np.asarray([score for _, score in pool], dtype=np.float32) + weight * matches
+        order = np.argsort(-scores, kind="stable")
+        return [pool[i][0] for i in order[:limit]]
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict[str, Any]:
+        return {**self._counts, "cache": self.cache.stats(), "in_flight": len(self._in_flight)}
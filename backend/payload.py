@@ -0,0 +1,61 @@
+import json
+from typing import Any, Iterable
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # optional, falls back to the stdlib encoder
+    orjson = None
+
+
+def dumps(value: Any) -> bytes:
+    """Encode JSON to UTF-8 bytes, with orjson when it is installed (several times faster)."""
+    if orjson is not None:
+        # numpy scalars show up in scores and palette distances
+        return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse encoded with dumps(); return it directly to skip response_model re-validation."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def parse_fields(fields: str | None) -> frozenset[str] | None:
+    """`fields` query parameter ("id,title,price") to a set of names; None keeps every field."""
+    if not fields:
+        return None
+    names = frozenset(name.strip() for name in fields.split(",") if name.strip())
+    return names or None
+
+
+def compact_items(items: Iterable[dict[str, Any]], fields: frozenset[str] | None = None) -> tuple[list[dict], list[str]]:
+    """
+    Compact one category's recommendations.
+
+    - `reasons` is the same list on every item of a category; it is returned once instead
+    - empty values (None, "", []) are dropped; clients treat missing and empty alike
+    - with `fields`, only those keys are kept
+
+    Returns: (items, reasons)
+    """
+    compacted = []
+    reasons: list[str] = []
+    for item in items:
+        reasons = reasons or item.get("reasons") or []
+        compacted.append({
+            key: value for key, value in item.items()
+            if key != "reasons" and value not in (None, "", []) and (fields is None or key in fields)
+        })
+    return compacted, reasons
+
+
+def compact_recommendations(results: dict[str, list[dict]], fields: frozenset[str] | None = None) -> tuple[dict, dict]:
+    """compact_items() over every category. Returns: (results, reasons per category)"""
+    compacted, reasons = {}, {}
+    for category, items in results.items():
+        compacted[category], reasons[category] = compact_items(items, fields)
+    return compacted, reasons
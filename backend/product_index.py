@@ -0,0 +1,313 @@
+import os
+import re
+import json
+import sqlite3
+import threading
+import zlib
+from typing import Any
+
+import numpy as np
+
+# Size of the hashed bag-of-words feature vectors
+FEATURE_DIM = int(os.getenv("PRODUCT_INDEX_DIM", "512"))
+
+# Weight of each Style DNA field in the profile vector
+PROFILE_WEIGHTS = {
+    "colors": 2.0,
+    "hexcolors": 1.5,
+    "textures": 1.5,
+    "fit": 1.0,
+    "accessories": 1.0,
+    "name": 1.0,
+}
+
+# Small share of the score from the product's rating, mostly a tie-breaker
+RATING_WEIGHT = 0.05
+# Weight of the offer's similarity to the category query (e.g. "white linen shirt"),
+# so a candidate that fits the palette but is the wrong item doesn't win
+QUERY_WEIGHT = 1.0
+
+# Reference colors for turning hexcolors into words products use in titles/options
+NAMED_COLORS = {
+    "black": (20, 20, 20),
+    "charcoal": (54, 69, 79),
+    "grey": (128, 128, 128),
+    "white": (245, 245, 245),
+    "cream": (245, 240, 220),
+    "beige": (215, 195, 160),
+    "camel": (193, 154, 107),
+    "tan": (210, 180, 140),
+    "brown": (110, 70, 40),
+    "khaki": (170, 160, 110),
+    "olive": (85, 107, 47),
+    "green": (34, 139, 34),
+    "navy": (0, 0, 110),
+    "blue": (50, 100, 200),
+    "burgundy": (128, 0, 32),
+    "red": (200, 30, 30),
+    "rust": (183, 65, 14),
+    "orange": (240, 130, 30),
+    "mustard": (220, 170, 40),
+    "yellow": (245, 220, 60),
+    "pink": (240, 150, 180),
+    "purple": (110, 50, 140),
+}
+_NAMED_COLOR_NAMES = list(NAMED_COLORS)
+_NAMED_COLOR_RGB = np.array(list(NAMED_COLORS.values()), dtype=np.float32)
+
+_WORD_RE = re.compile(r"[a-z]+")
+_STOPWORDS = {
+    "and", "the", "for", "with", "of", "in", "on", "or", "to", "a", "an", "your", "you",
+    "is", "are", "by", "from", "that", "this", "as", "at", "it", "its", "be", "but", "not",
+}
+
+
+def tokenize(text: str) -> list[str]:
+    return [w for w in _WORD_RE.findall(text.lower()) if len(w) > 2 and w not in _STOPWORDS]
+
+
+def _flatten(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, dict):
+        return " ".join(_flatten(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return " ".join(_flatten(v) for v in value)
+    return str(value)
+
+
+def hex_to_rgb(hex_color: str) -> tuple[int, int, int] | None:
+    value = hex_color.strip().lstrip("#")
+    if len(value) == 3:
+        value = "".join(c * 2 for c in value)
+    if len(value) != 6:
+        return None
+    try:
+        return int(value[0:2], 16), int(value[2:4], 16), int(value[4:6], 16)
+    except ValueError:
+        return None
+
+
+def hexcolor_names(hexcolors: list[str]) -> list[str]:
+    """Map each hex color to the nearest NAMED_COLORS word, in one vectorized pass."""
+    rgb = [c for c in (hex_to_rgb(h) for h in hexcolors or []) if c is not None]
+    if not rgb:
+        return []
+    diff = np.asarray(rgb, dtype=np.float32)[:, None, :] - _NAMED_COLOR_RGB[None, :, :]
+    nearest = np.argmin((diff ** 2).sum(axis=2), axis=1)
+    return [_NAMED_COLOR_NAMES[i] for i in nearest]
+
+
+def hashed_vector(weighted_texts: list[tuple[str, float]], dim: int = FEATURE_DIM) -> np.ndarray:
+    """
+    Hashed bag-of-words: each token adds its weight to bucket crc32(token) % dim,
+    counts are log-damped and the vector is L2-normalized.
+    """
+    vec = np.zeros(dim, dtype=np.float32)
+    for text, weight in weighted_texts:
+        for token in tokenize(text):
+            vec[zlib.crc32(token.encode()) % dim] += weight
+    np.log1p(vec, out=vec)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+def offer_text(offer: dict) -> dict[str, str]:
+    """Searchable text fields of an MCP offer."""
+    colors = []
+    for option in offer.get("options", []):
+        if "color" in option.get("name", "").lower():
+            colors.extend(v.get("value", "") for v in option.get("values", []))
+    attributes = " ".join(
+        f"{a.get('name', '')} {_flatten(a.get('values'))}" for a in offer.get("attributes", [])
+    )
+    vendor = ""
+    variants = offer.get("variants", [])
+    if variants and variants[0].get("shop"):
+        vendor = variants[0]["shop"].get("name") or ""
+    return {
+        "title": offer.get("title") or "",
+        "description": " ".join(filter(None, [
+            offer.get("description"),
+            offer.get("uniqueSellingPoint"),
+            _flatten(offer.get("topFeatures")),
+            _flatten(offer.get("techSpecs")),
+        ])),
+        "colors": " ".join(colors),
+        "attributes": attributes,
+        "vendor": vendor,
+    }
+
+
+def offer_vector(offer: dict) -> np.ndarray:
+    text = offer_text(offer)
+    return hashed_vector([
+        (text["title"], 2.0),
+        (text["colors"], 2.0),
+        (text["attributes"], 1.0),
+        (text["description"], 1.0),
+    ])
+
+
+def profile_vector(profile: dict[str, Any]) -> np.ndarray:
+    """Feature vector for a Style DNA profile (colors, hexcolors, fit, textures, accessories, name)."""
+    weighted = []
+    for field, weight in PROFILE_WEIGHTS.items():
+        if field == "hexcolors":
+            weighted.append((" ".join(hexcolor_names(profile.get("hexcolors") or [])), weight))
+        else:
+            weighted.append((_flatten(profile.get(field)), weight))
+    return hashed_vector(weighted)
+
+
+def offer_rating(offer: dict) -> float:
+    rating = offer.get("rating")
+    if isinstance(rating, dict):
+        rating = rating.get("rating")
+    try:
+        return float(rating or 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _fts_query(text: str) -> str:
+    # OR the query's tokens, quoted so FTS5 syntax characters can't leak in
+    return " OR ".join(f'"{token}"' for token in dict.fromkeys(tokenize(text)))
+
+
+class ProductIndex:
+    """
+    Local index of every Shopify offer we have fetched.
+
+    - SQLite FTS5 table over title/description/colors/attributes/vendor for keyword lookups
+    - NumPy matrix of hashed feature vectors, one row per product, for batch scoring
+      against a Style DNA profile with a single matrix-vector product
+    """
+
+    def __init__(self, path: str = ":memory:", max_products: int = 20000):
+        self.dim = FEATURE_DIM
+        self.max_products = max_products
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+            "id UNINDEXED, title, description, colors, attributes, vendor)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS offers (id TEXT PRIMARY KEY, offer TEXT NOT NULL)")
+        self._rows: dict[str, int] = {}
+        self._ids: list[str] = []
+        self._features = np.zeros((256, self.dim), dtype=np.float32)
+        self._ratings = np.zeros(256, dtype=np.float32)
+        self._offers: dict[str, dict] = {}
+        self._load()
+
+    def _load(self):
+        # Rebuild the feature matrix from a file-backed index
+        for product_id, offer_json in self._db.execute("SELECT id, offer FROM offers"):
+            self._set_features(product_id, json.loads(offer_json))
+
+    def _set_features(self, product_id: str, offer: dict):
+        # Caller must hold _lock (or be in __init__)
+        row = self._rows.get(product_id)
+        if row is None:
+            row = len(self._ids)
+            if row >= len(self._features):
+                self._features = np.concatenate([self._features, np.zeros_like(self._features)])
+                self._ratings = np.concatenate([self._ratings, np.zeros_like(self._ratings)])
+            self._rows[product_id] = row
+            self._ids.append(product_id)
+        self._features[row] = offer_vector(offer)
+        self._ratings[row] = offer_rating(offer) / 5.0
+        self._offers[product_id] = offer
+
+    def add_offers(self, offers: list[dict]) -> list[str]:
+        """Insert or update offers; returns the ids that are indexed, in input order."""
+        ids = []
+        with self._lock:
+            for offer in offers:
+                product_id = offer.get("id")
+                if not product_id:
+                    continue
+                if product_id not in self._rows and len(self._ids) >= self.max_products:
+                    # Index is full; rerank_offers keeps unindexed offers in Shopify's order
+                    continue
+                text = offer_text(offer)
+                self._db.execute("DELETE FROM products_fts WHERE id = ?", (product_id,))
+                self._db.execute(
+                    "INSERT INTO products_fts (id, title, description, colors, attributes, vendor) VALUES (?, ?, ?, ?, ?, ?)",
+                    (product_id, text["title"], text["description"], text["colors"], text["attributes"], text["vendor"]),
+                )
+                self._db.execute(
+                    "INSERT OR REPLACE INTO offers (id, offer) VALUES (?, ?)",
+                    (product_id, json.dumps(offer)),
+                )
+                self._set_features(product_id, offer)
+                ids.append(product_id)
+            self._db.commit()
+        return ids
+
+    def search(self, query: str, limit: int = 20) -> list[str]:
+        """Keyword lookup over previously fetched products, best BM25 match first."""
+        match = _fts_query(query)
+        if not match:
+            return []
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id FROM products_fts WHERE products_fts MATCH ? ORDER BY bm25(products_fts) LIMIT ?",
+                (match, limit),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def rank(self, ids: list[str], profile: dict[str, Any], query: str = "") -> list[tuple[str, float]]:
+        """
+        Score candidates against a Style DNA profile, and the search query if given, in one batch.
+        Returns (id, score) pairs, best first; unknown ids are skipped.
+        """
+        target = profile_vector(profile)
+        if query:
+            target = target + QUERY_WEIGHT * hashed_vector([(query, 1.0)])
+        with self._lock:
+            known = [product_id for product_id in dict.fromkeys(ids) if product_id in self._rows]
+            rows = np.fromiter((self._rows[product_id] for product_id in known), dtype=np.int64, count=len(known))
+            features = self._features[rows]
+            ratings = self._ratings[rows]
+        if not known:
+            return []
+        scores = features @ target + RATING_WEIGHT * ratings
+        # Stable sort keeps Shopify's order among equal scores
+        order = np.argsort(-scores, kind="stable")
+        return [(known[i], float(scores[i])) for i in order]
+
+    def get_offers(self, ids: list[str]) -> list[dict]:
+        with self._lock:
+            return [self._offers[product_id] for product_id in ids if product_id in self._offers]
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"products": len(self._ids), "dim": self.dim, "feature_bytes": int(self._features.nbytes)}
+
+
+def rank_offers(index: ProductIndex, offers: list[dict], profile: dict[str, Any],
+                query: str = "") -> list[tuple[dict, float]]:
+    """
+    Index the offers and return them as (offer, score), best first, scored against the
+    profile and `query`.
+    """
+    ids = index.add_offers(offers)
+    ranked = index.rank(ids, profile, query)
+    by_id = {offer.get("id"): offer for offer in index.get_offers([product_id for product_id, _ in ranked])}
+    results = [(by_id[product_id], score) for product_id, score in ranked if product_id in by_id]
+    # Offers the index couldn't take (no id, or index full) follow in their original order
+    results += [(offer, 0.0) for offer in offers if offer.get("id") not in by_id]
+    return results
+
+
+def rerank_offers(index: ProductIndex, offers: list[dict], profile: dict[str, Any], query: str = "",
+                  limit: int = 5) -> list[dict]:
+    """rank_offers, keeping only the `limit` best offers."""
+    return [offer for offer, _ in rank_offers(index, offers, profile, query)[:limit]]
@@ -0,0 +1,347 @@
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, TypeVar
+
+import numpy as np
+
+T = TypeVar("T")
+
+# Consecutive failures that open a breaker, and seconds before it lets a trial call through
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+# Largest share of calls that may be hedged (0 disables hedging), and the shortest hedge delay
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", "0.05"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.2"))
+
+# HTTP statuses that say the upstream itself is in trouble; other 4xx are the caller's fault
+UPSTREAM_FAILURE_STATUSES = {408, 429}
+
+# Threads for hedged blocking calls; a losing attempt can't be cancelled, it runs out its own timeout
+HEDGE_WORKERS = 16
+_hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out before an upstream call could start."""
+
+
+class CircuitOpen(Exception):
+    """The upstream is failing; calls are refused until the breaker's reset timeout."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is unavailable, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+# Absolute time.monotonic() deadline of the current request, if it has a budget
+_deadline: ContextVar[float | None] = ContextVar("deadline", default=None)
+
+
+@contextmanager
+def request_budget(seconds: float):
+    """Give the enclosed work a time budget; nested budgets never extend an outer one."""
+    deadline = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+async def stream_with_budget(events, seconds: float):
+    """
+    Run an async generator (an SSE body) under a time budget. The budget has to be set
+    inside the generator: a streamed body runs after the endpoint has already returned.
+    """
+    with request_budget(seconds):
+        async for event in events:
+            yield event
+
+
+def time_left() -> float | None:
+    """Seconds left in the current request's budget (None without a budget)."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def call_timeout(cap: float) -> float:
+    """Timeout for one upstream call: `cap`, cut to what is left of the request budget."""
+    left = time_left()
+    if left is None:
+        return cap
+    if left <= 0:
+        raise DeadlineExceeded("Request budget exhausted")
+    return min(cap, left)
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """
+    Whether an error should count against the upstream's breaker: transport errors, timeouts,
+    5xx and 429 do; a 4xx (malformed upload, expired token) says nothing about its health.
+    Works for httpx.HTTPStatusError and requests.HTTPError alike, both carry `.response`.
+    """
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    return status is None or status >= 500 or status in UPSTREAM_FAILURE_STATUSES
+
+
+def first_error(attempts) -> BaseException:
+    """The exception of the first attempt that failed rather than being cancelled."""
+    failed = [a for a in attempts if not a.cancelled() and a.exception() is not None]
+    return failed[0].exception() if failed else asyncio.CancelledError()
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies."""
+
+    def __init__(self, window: int = 200):
+        self._samples: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> float | None:
+        with self._lock:
+            samples = list(self._samples)
+        return float(np.percentile(samples, q)) if samples else None
+
+
+class CircuitBreaker:
+    """
+    Classic three-state breaker.
+
+    - closed: calls go through; `failure_threshold` consecutive failures open it
+    - open: calls are refused with CircuitOpen for `reset_timeout` seconds
+    - half-open: one trial call goes through; success closes, failure re-opens
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._counts = {"opened": 0, "rejected": 0}
+
+    def allow(self):
+        """Raise CircuitOpen unless a call may go through now."""
+        with self._lock:
+            if self._state == "open":
+                waited = time.monotonic() - self._opened_at
+                if waited < self.reset_timeout:
+                    self._counts["rejected"] += 1
+                    raise CircuitOpen(self.name, self.reset_timeout - waited)
+                self._state = "half-open"
+                self._trial_running = False
+            if self._state == "half-open":
+                if self._trial_running:
+                    self._counts["rejected"] += 1
+                    raise CircuitOpen(self.name, 1.0)
+                self._trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self._state = "closed"
+            self._failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == "half-open" or self._failures >= self.failure_threshold:
+                if self._state != "open":
+                    self._counts["opened"] += 1
+                self._state = "open"
+                self._opened_at = time.monotonic()
+                self._trial_running = False
+
+    def release_trial(self):
+        """End a half-open trial that told us nothing (cancelled, out of budget); the next call retries."""
+        with self._lock:
+            self._trial_running = False
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {"state": self._state, "consecutive_failures": self._failures, **self._counts}
+
+
+class Upstream:
+    """
+    Resilience policy for one upstream service:
+
+    - circuit breaker in front of every call
+    - hedging: if a call is slower than the recent p95 for its kind, a duplicate is started
+      and whichever finishes first wins; hedges are capped at `hedge_ratio` of calls so a
+      slow upstream doesn't get double the load
+    - latency tracking per kind of call (a vision call and a text call have different p95s)
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT, hedge_ratio: float = HEDGE_MAX_RATIO,
+                 hedge_min_delay: float = HEDGE_MIN_DELAY, hedge_min_samples: int = 20):
+        self.name = name
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.hedge_ratio = hedge_ratio
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self._latency: dict[str, LatencyTracker] = {}
+        self._lock = threading.Lock()
+        self._counts = {"calls": 0, "failures": 0, "hedges": 0, "hedge_wins": 0, "deadline_exceeded": 0, "client_errors": 0}
+
+    def tracker(self, kind: str) -> LatencyTracker:
+        with self._lock:
+            return self._latency.setdefault(kind, LatencyTracker())
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counts[name] += 1
+
+    def hedge_delay(self, kind: str) -> float | None:
+        """Seconds to wait before hedging a call of this kind, or None to not hedge."""
+        tracker = self.tracker(kind)
+        if self.hedge_ratio <= 0 or len(tracker) < self.hedge_min_samples:
+            return None
+        with self._lock:
+            if self._counts["hedges"] >= self.hedge_ratio * max(self._counts["calls"], 1):
+                return None
+        return max(self.hedge_min_delay, tracker.percentile(95))
+
+    def _record(self, kind: str, start: float, error: BaseException | None):
+        if error is None:
+            self.tracker(kind).add(time.monotonic() - start)
+            self.breaker.record_success()
+        elif isinstance(error, DeadlineExceeded):
+            self._count("deadline_exceeded")
+            self.breaker.release_trial()
+        elif isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+            # A cancelled call (client went away, hedge lost) says nothing about upstream health,
+            # but if it was the half-open trial the breaker must let another one through
+            self.breaker.release_trial()
+        elif not is_upstream_failure(error):
+            self._count("client_errors")
+            self.breaker.release_trial()
+        else:
+            self._count("failures")
+            self.breaker.record_failure()
+
+    async def call(self, fn: Callable[[], Awaitable[T]], kind: str = "default", hedge: bool = True) -> T:
+        """
+        Run `fn()` (a fresh awaitable per attempt) under the breaker, hedging slow attempts.
+        Raises CircuitOpen without calling fn when the upstream is unhealthy.
+        """
+        self.breaker.allow()
+        self._count("calls")
+        start = time.monotonic()
+        attempts = []
+        try:
+            delay = self.hedge_delay(kind) if hedge else None
+            primary = asyncio.ensure_future(fn())
+            attempts.append(primary)
+            if delay is not None:
+                done, _ = await asyncio.wait(attempts, timeout=delay)
+                left = time_left()
+                if not done and (left is None or left > delay):
+                    self._count("hedges")
+                    attempts.append(asyncio.ensure_future(fn()))
+            while True:
+                done, _ = await asyncio.wait(attempts, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((t for t in done if not t.cancelled() and t.exception() is None), None)
+                if winner is not None or len(done) == len(attempts):
+                    break
+                # One attempt failed; keep waiting on the other
+                attempts = [t for t in attempts if t not in done]
+            if winner is None:
+                raise first_error(done)
+            if winner is not primary:
+                self._count("hedge_wins")
+            self._record(kind, start, None)
+            return winner.result()
+        except BaseException as e:
+            self._record(kind, start, e)
+            raise
+        finally:
+            for task in attempts:
+                task.cancel()
+
+    def call_sync(self, fn: Callable[[], T], kind: str = "default", hedge: bool = True) -> T:
+        """
+        Blocking variant of call() for thread-based clients (requests). Unhedged calls run
+        in the caller's thread; hedged ones run in _hedge_executor with the caller's context.
+        """
+        self.breaker.allow()
+        self._count("calls")
+        start = time.monotonic()
+        try:
+            delay = self.hedge_delay(kind) if hedge else None
+            if delay is None:
+                result = fn()
+            else:
+                result = self._hedged_sync(fn, delay)
+        except BaseException as e:
+            self._record(kind, start, e)
+            raise
+        self._record(kind, start, None)
+        return result
+
+    def _hedged_sync(self, fn: Callable[[], T], delay: float) -> T:
+        # Each attempt needs its own copy, a Context can't be entered by two threads at once
+        primary = _hedge_executor.submit(contextvars.copy_context().run, fn)
+        attempts = [primary]
+        done, _ = wait(attempts, timeout=delay)
+        left = time_left()
+        if not done and (left is None or left > delay):
+            self._count("hedges")
+            attempts.append(_hedge_executor.submit(contextvars.copy_context().run, fn))
+        while True:
+            done, pending = wait(attempts, return_when=FIRST_COMPLETED)
+            winner = next((f for f in done if f.exception() is None), None)
+            if winner is not None or not pending:
+                break
+            attempts = list(pending)
+        if winner is None:
+            raise first_error(done)
+        if winner is not primary:
+            self._count("hedge_wins")
+        return winner.result()
+
+    @asynccontextmanager
+    async def guard(self):
+        """Breaker accounting for calls that can't be hedged (e.g. streams)."""
+        self.breaker.allow()
+        self._count("calls")
+        start = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self._record("stream", start, e)
+            raise
+        else:
+            self.breaker.record_success()
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+            trackers = dict(self._latency)
+        return {
+            **counts,
+            "breaker": self.breaker.stats(),
+            "p95_ms": {
+                kind: round(tracker.percentile(95) * 1000, 1)
+                for kind, tracker in trackers.items() if len(tracker)
+            },
+        }
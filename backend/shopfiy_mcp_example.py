@@ -1,7 +1,14 @@
 import os
 import json
+import time
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+from cache import LRUCache
+from metrics import timed
+from resilience import Upstream, call_timeout
+from singleflight import SingleFlight
 
 load_dotenv()
 
@@ -14,12 +21,39 @@ if not CLIENT_ID or not CLIENT_SECRET:
 if not SAVED_CATALOG:
     raise RuntimeError("Missing SHOPIFY_SAVED_CATALOG_ID in .env")
 
-AUTH_URL = "https://api.shopify.com/auth/access_token"
-MCP_URL = "https://discover.shopifyapps.com/global/mcp"
+# Overridable so benchmarks can point at local stubs (see bench/)
+AUTH_URL = os.getenv("SHOPIFY_AUTH_URL", "https://api.shopify.com/auth/access_token")
+MCP_URL = os.getenv("SHOPIFY_MCP_URL", "https://discover.shopifyapps.com/global/mcp")
 
+# Seconds for one auth or MCP call; cut to what is left of the request budget
+SHOPIFY_TIMEOUT = float(os.getenv("SHOPIFY_TIMEOUT", "30"))
 
-def get_token() -> str:
-    resp = requests.post(
+# Pooled keep-alive connections shared by auth, search and background refresh threads
+SHOPIFY_MAX_CONNECTIONS = int(os.getenv("SHOPIFY_MAX_CONNECTIONS", "32"))
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=SHOPIFY_MAX_CONNECTIONS))
+session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=SHOPIFY_MAX_CONNECTIONS))
+
+# Used when the auth response has no expires_in
+DEFAULT_TOKEN_TTL = float(os.getenv("SHOPIFY_TOKEN_TTL", "3600"))
+# Start refreshing this many seconds before the token expires
+TOKEN_REFRESH_MARGIN = float(os.getenv("SHOPIFY_TOKEN_REFRESH_MARGIN", "120"))
+
+# Search results are fresh for MAX_AGE seconds, then served stale (and refreshed) up to MAX_STALE
+SEARCH_CACHE_MAX_AGE = float(os.getenv("SHOPIFY_SEARCH_CACHE_MAX_AGE", "300"))
+SEARCH_CACHE_MAX_STALE = float(os.getenv("SHOPIFY_SEARCH_CACHE_MAX_STALE", "3600"))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SHOPIFY_SEARCH_CACHE_MAX_ENTRIES", "1024"))
+SEARCH_CACHE_MAX_MB = float(os.getenv("SHOPIFY_SEARCH_CACHE_MAX_MB", "32"))
+
+
+def fetch_token() -> tuple[str, float]:
+    """
+    Request a fresh client-credentials token from Shopify.
+
+    Returns:
+        (access_token, expires_in seconds)
+    """
+    resp = session.post(
         AUTH_URL,
         json={
             "client_id": CLIENT_ID,
@@ -27,14 +61,153 @@ def get_token() -> str:
             "grant_type": "client_credentials",
         },
         headers={"Content-Type": "application/json"},
-        timeout=30,
+        timeout=call_timeout(SHOPIFY_TIMEOUT),
     )
     resp.raise_for_status()
     data = resp.json()
     token = data.get("access_token")
     if not token:
         raise RuntimeError(f"No access_token in response: {data}")
-    return token
+    try:
+        expires_in = float(data.get("expires_in") or DEFAULT_TOKEN_TTL)
+    except (TypeError, ValueError):
+        expires_in = DEFAULT_TOKEN_TTL
+    return token, expires_in
+
+
+class TokenManager:
+    """
+    Process-wide cache for the Shopify access token.
+
+    - Serves the cached token until it gets close to `expires_in`
+    - Inside the refresh margin, keeps serving the cached token and refreshes in a background thread
+    - Once expired (or never fetched), callers block, but only one of them talks to Shopify
+    """
+
+    def __init__(self, fetch=fetch_token, refresh_margin: float = TOKEN_REFRESH_MARGIN):
+        self._fetch = fetch
+        self._refresh_margin = refresh_margin
+        self._state_lock = threading.Lock()    # guards token / expiry / counters
+        self._refresh_lock = threading.Lock()  # only one refresh at a time
+        self._token = None
+        self._expires_at = 0.0
+        self._refresh_at = 0.0
+        self._background_running = False
+        self._counts = {
+            "hits": 0,
+            "misses": 0,
+            "refreshes": 0,
+            "background_refreshes": 0,
+            "refresh_failures": 0,
+            "invalidations": 0,
+        }
+
+    def _count(self, name: str):
+        with self._state_lock:
+            self._counts[name] += 1
+
+    def _cached(self, now: float):
+        # Returns (token, needs_background_refresh), token is None if expired
+        with self._state_lock:
+            if self._token is None or now >= self._expires_at:
+                return None, False
+            return self._token, now >= self._refresh_at
+
+    def _refresh(self) -> str:
+        # Caller must hold _refresh_lock
+        token, expires_in = self._fetch()
+        now = time.monotonic()
+        # Never refresh ahead by more than half the token lifetime
+        margin = min(self._refresh_margin, expires_in / 2)
+        with self._state_lock:
+            self._token = token
+            self._expires_at = now + expires_in
+            self._refresh_at = self._expires_at - margin
+            self._counts["refreshes"] += 1
+        return token
+
+    def _background_refresh(self):
+        try:
+            # Skip if a foreground caller is already refreshing
+            if self._refresh_lock.acquire(blocking=False):
+                try:
+                    self._refresh()
+                    self._count("background_refreshes")
+                finally:
+                    self._refresh_lock.release()
+        except Exception as e:
+            print(f"Shopify background token refresh failed: {e}")
+            self._count("refresh_failures")
+        finally:
+            with self._state_lock:
+                self._background_running = False
+
+    def _start_background_refresh(self):
+        with self._state_lock:
+            if self._background_running:
+                return
+            self._background_running = True
+        threading.Thread(target=self._background_refresh, name="shopify-token-refresh", daemon=True).start()
+
+    def get(self) -> str:
+        token, stale = self._cached(time.monotonic())
+        if token is not None:
+            self._count("hits")
+            if stale:
+                self._start_background_refresh()
+            return token
+
+        with self._refresh_lock:
+            # Another caller may have refreshed while we waited for the lock
+            token, _ = self._cached(time.monotonic())
+            if token is not None:
+                self._count("hits")
+                return token
+            self._count("misses")
+            try:
+                return self._refresh()
+            except Exception:
+                self._count("refresh_failures")
+                raise
+
+    def invalidate(self, token: str | None = None):
+        """
+        Drop the cached token (e.g. after a 401). If `token` is given, only drop it if it is still current.
+        """
+        with self._state_lock:
+            if token is not None and token != self._token:
+                return
+            self._token = None
+            self._expires_at = 0.0
+            self._refresh_at = 0.0
+            self._counts["invalidations"] += 1
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._state_lock:
+            stats = dict(self._counts)
+            stats["expires_in"] = max(0.0, round(self._expires_at - now, 1)) if self._token else 0.0
+        return stats
+
+
+token_manager = TokenManager()
+
+# Breaker, hedging and latency tracking for MCP searches
+mcp_upstream = Upstream("shopify_mcp")
+# Concurrent cache misses for the same search share one MCP call
+mcp_flight = SingleFlight("shopify_mcp")
+
+
+def get_token() -> str:
+    with timed("shopify_token"):
+        return token_manager.get()
+
+
+def warm_up():
+    """Fetch the access token and open a connection to the MCP host ahead of the first search."""
+    get_token()
+    # Any answer will do, the point is the TCP/TLS handshake
+    session.head(MCP_URL, timeout=call_timeout(SHOPIFY_TIMEOUT))
 
 
 def call_mcp(token: str):
@@ -77,9 +250,9 @@ def format_mcp_response(mcp_response: dict) -> dict:
 
 
 
-def search_products_by_style(token: str, query: str, context: str = "", limit: int = 10) -> dict:
+def fetch_products_by_style(token: str, query: str, context: str = "", limit: int = 10) -> dict:
     """
-    Search for products using Shopify MCP with custom query.
+    Search for products using Shopify MCP with custom query, bypassing the cache.
     
     Args:
         token: Shopify auth token
@@ -105,17 +278,105 @@ def search_products_by_style(token: str, query: str, context: str = "", limit: i
         },
     }
 
-    resp = requests.post(
-        MCP_URL,
-        json=payload,
-        headers={
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {token}",
-        },
-        timeout=30,
-    )
-    resp.raise_for_status()
-    return format_mcp_response(resp.json())
+    def post() -> requests.Response:
+        resp = session.post(
+            MCP_URL,
+            json=payload,
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {token}",
+            },
+            timeout=call_timeout(SHOPIFY_TIMEOUT),
+        )
+        if resp.status_code == 401:
+            # Token was revoked or expired early, make the next caller fetch a new one
+            token_manager.invalidate(token)
+        resp.raise_for_status()
+        return resp
+
+    # Raises CircuitOpen right away while Shopify is failing
+    with timed("shopify_mcp"):
+        resp = mcp_upstream.call_sync(post, kind="search")
+    with timed("parse_mcp"):
+        return format_mcp_response(resp.json())
+
+
+# Parsed MCP responses keyed on (query, context, limit, saved_catalog).
+# Entries older than SEARCH_CACHE_MAX_AGE are still served, but refreshed in the background;
+# entries older than SEARCH_CACHE_MAX_STALE are dropped.
+search_cache = LRUCache(
+    max_entries=SEARCH_CACHE_MAX_ENTRIES,
+    max_bytes=int(SEARCH_CACHE_MAX_MB * 1024 * 1024),
+    ttl=SEARCH_CACHE_MAX_STALE,
+)
+_search_refresh_lock = threading.Lock()
+_search_refreshing = set()
+_search_counts = {"stale_served": 0, "background_refreshes": 0, "refresh_failures": 0}
+
+
+def _refresh_search(key: tuple, query: str, context: str, limit: int):
+    try:
+        # Use the current token, the caller's may have expired by now
+        search_cache.set(key, fetch_products_by_style(get_token(), query, context, limit))
+        with _search_refresh_lock:
+            _search_counts["background_refreshes"] += 1
+    except Exception as e:
+        print(f"Background search refresh failed for {query!r}: {e}")
+        with _search_refresh_lock:
+            _search_counts["refresh_failures"] += 1
+    finally:
+        with _search_refresh_lock:
+            _search_refreshing.discard(key)
+
+
+def search_products_by_style(token: str, query: str, context: str = "", limit: int = 10) -> dict:
+    """
+    Search for products using Shopify MCP, serving repeated (query, context, limit) searches
+    from search_cache. Stale entries are returned immediately and refreshed in the background.
+    
+    Args:
+        token: Shopify auth token
+        query: Search query (e.g., "charcoal wool overshirt")
+        context: Additional context
+        limit: Max results (default 10)
+    
+    Returns:
+        Formatted MCP response with offers
+    """
+    with timed("shopify_search"):
+        return _search_products_by_style(token, query, context, limit)
+
+
+def _search_products_by_style(token: str, query: str, context: str, limit: int) -> dict:
+    key = (query, context, limit, SAVED_CATALOG)
+    entry = search_cache.get_with_age(key)
+    if entry is None:
+        def fetch() -> dict:
+            result = fetch_products_by_style(token, query, context, limit)
+            search_cache.set(key, result)
+            return result
+        return mcp_flight.do(key, fetch)
+
+    result, age = entry
+    if age > SEARCH_CACHE_MAX_AGE:
+        with _search_refresh_lock:
+            _search_counts["stale_served"] += 1
+            start_refresh = key not in _search_refreshing
+            _search_refreshing.add(key)
+        if start_refresh:
+            threading.Thread(
+                target=_refresh_search, args=(key, query, context, limit),
+                name="shopify-search-refresh", daemon=True
+            ).start()
+    return result
+
+
+def search_cache_stats() -> dict:
+    stats = search_cache.stats()
+    with _search_refresh_lock:
+        stats.update(_search_counts)
+        stats["refreshing"] = len(_search_refreshing)
+    return stats
 
 
 def parse_shopify_offers_to_recommendations(parsed_mcp: dict, reasons: list = None) -> list:
@@ -129,6 +390,11 @@ def parse_shopify_offers_to_recommendations(parsed_mcp: dict, reasons: list = No
     Returns:
         List of recommendation dicts matching frontend Recommendation type
     """
+    with timed("parse_offers"):
+        return _parse_shopify_offers(parsed_mcp, reasons)
+
+
+def _parse_shopify_offers(parsed_mcp: dict, reasons: list | None) -> list:
     if reasons is None:
         reasons = ["Matches your style"]
     
@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import contextvars
+from typing import Any, Awaitable, Callable, Hashable, TypeVar
+
+from metrics import COALESCED_CALLS
+from resilience import DeadlineExceeded, request_budget, time_left
+
+T = TypeVar("T")
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+async def _run(fn: Callable[[], Awaitable[T]], budget: float | None) -> T:
+    if budget is None:
+        return await fn()
+    with request_budget(budget):
+        return await fn()
+
+
+class AsyncSingleFlight:
+    """
+    Coalesces identical in-flight coroutine calls: while a call for `key` is running,
+    later callers wait for it and share its result or exception instead of starting their own.
+    Nothing is kept once the call finishes; caching is left to the callers.
+
+    The shared call runs in a fresh context with its own `budget`, not in the first caller's
+    (whose deadline and Server-Timing would otherwise apply to everyone). Each caller waits
+    at most its own remaining budget, and the call is cancelled once nobody is waiting.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: dict[Hashable, _Flight] = {}
+        self._counts = {"calls": 0, "coalesced": 0}
+
+    def _forget(self, key: Hashable, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]], budget: float | None = None) -> T:
+        self._counts["calls"] += 1
+        flight = self._flights.get(key)
+        if flight is None:
+            task = asyncio.create_task(_run(fn, budget), context=contextvars.Context())
+            flight = self._flights[key] = _Flight(task)
+            task.add_done_callback(lambda _: self._forget(key, flight))
+        else:
+            self._counts["coalesced"] += 1
+            COALESCED_CALLS.labels(self.name).inc()
+        flight.waiters += 1
+        try:
+            # Shielded so one caller going away doesn't cancel the call for the others
+            return await asyncio.wait_for(asyncio.shield(flight.task), timeout=time_left())
+        except asyncio.TimeoutError:
+            if flight.task.done():
+                raise
+            raise DeadlineExceeded("Request budget exhausted") from None
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                self._forget(key, flight)
+                flight.task.cancel()
+
+    def stats(self) -> dict[str, Any]:
+        return {**self._counts, "in_flight": len(self._flights)}
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """Thread-based AsyncSingleFlight for blocking clients: the first caller runs fn, the rest wait."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._flights: dict[Hashable, _Call] = {}
+        self._counts = {"calls": 0, "coalesced": 0}
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        with self._lock:
+            self._counts["calls"] += 1
+            call = self._flights.get(key)
+            leader = call is None
+            if leader:
+                call = self._flights[key] = _Call()
+            else:
+                self._counts["coalesced"] += 1
+        if not leader:
+            COALESCED_CALLS.labels(self.name).inc()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            call.done.set()
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {**self._counts, "in_flight": len(self._flights)}
@@ -0,0 +1,80 @@
+import json
+from typing import Any
+
+from payload import dumps
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {dumps(data).decode()}\n\n"
+
+
+class JSONFieldStream:
+    """
+    Incrementally parse a streamed JSON object and yield each top-level field as soon as
+    its value is complete.
+
+    Text before the first '{' (e.g. a ```json fence) is ignored, as is anything after the
+    matching '}'. Strings are tracked so braces and commas inside values don't count.
+    """
+
+    def __init__(self):
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._started = False
+        self._done = False
+        self._field = []
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def _complete_field(self) -> tuple[str, Any] | None:
+        segment = "".join(self._field).strip()
+        self._field = []
+        if not segment:
+            return None
+        parsed = json.loads("{" + segment + "}")
+        return next(iter(parsed.items()))
+
+    def feed(self, text: str) -> list[tuple[str, Any]]:
+        """Consume the next chunk and return the (key, value) fields it completed."""
+        fields = []
+        for ch in text:
+            if self._done:
+                break
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    # Closing brace of the top-level object ends the last field
+                    field = self._complete_field()
+                    if field is not None:
+                        fields.append(field)
+                    self._done = True
+                    break
+            elif ch == "," and self._depth == 1:
+                field = self._complete_field()
+                if field is not None:
+                    fields.append(field)
+                continue
+
+            self._field.append(ch)
+        return fields
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from admission import MAX_RETRY_AFTER, Admission, AdmissionMiddleware, RateLimiter, Rejected, client_key
+
+
+def scope(api_key: str | None = None, ip: str = "10.0.0.1", path: str = "/eval-style") -> dict:
+    headers = [(b"x-api-key", api_key.encode())] if api_key else []
+    return {"type": "http", "method": "POST", "path": path, "headers": headers, "client": (ip, 1234)}
+
+
+def test_unknown_api_key_falls_back_to_ip():
+    assert client_key(scope("made-up")) == "ip:10.0.0.1"
+    assert client_key(scope("made-up"), api_keys=frozenset({"partner"})) == "ip:10.0.0.1"
+    assert client_key(scope("partner"), api_keys=frozenset({"partner"})) == "key:partner"
+
+
+def test_rotating_api_keys_share_one_bucket():
+    admission = Admission("test", rate_per_min=60, burst=2, max_concurrent=10, max_queue=0, max_wait=1)
+
+    async def scenario():
+        for i in range(2):
+            await admission.enter(client_key(scope(f"key-{i}")))
+        with pytest.raises(Rejected) as e:
+            await admission.enter(client_key(scope("key-2")))
+        return e.value
+
+    assert asyncio.run(scenario()).status == 429
+
+
+def test_zero_rate_gives_finite_retry_after():
+    limiter = RateLimiter(rate=0, burst=1)
+    assert limiter.acquire("client") == 0
+    assert limiter.acquire("client") == MAX_RETRY_AFTER
+
+
+def test_middleware_answers_429_when_rate_is_zero():
+    admission = Admission("test", rate_per_min=0, burst=0, max_concurrent=10, max_queue=0, max_wait=1)
+    sent = []
+
+    async def app(scope, receive, send):
+        raise AssertionError("request should have been rejected")
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(AdmissionMiddleware(app, {"/eval-style": admission})(scope(), None, send))
+    assert sent[0]["status"] == 429
+    assert dict(sent[0]["headers"])[b"retry-after"] == str(int(MAX_RETRY_AFTER)).encode()
@@ -0,0 +1,73 @@
+import json
+import time
+
+from cache import LRUCache, json_size
+
+
+def test_evicts_least_recently_used_past_max_entries():
+    cache = LRUCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" is now the oldest
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_evicts_past_max_bytes_and_skips_oversized_values():
+    value = {"answer": "x" * 100}
+    cache = LRUCache(max_entries=100, max_bytes=2 * json_size(value) + 1)
+    for key in "abc":
+        cache.set(key, value)
+    assert len(cache) == 2
+    assert cache.get("a") is None
+    assert cache.stats()["bytes"] <= cache.max_bytes
+
+    cache.set("huge", {"answer": "x" * 1000})
+    assert cache.get("huge") is None
+    assert cache.get("c") == value
+
+
+def test_overwrite_replaces_size():
+    cache = LRUCache(max_bytes=10_000)
+    cache.set("a", "x" * 100)
+    cache.set("a", "x")
+    assert cache.stats()["bytes"] == json_size("x")
+
+
+def test_entries_expire_after_ttl():
+    cache = LRUCache(ttl=0.05)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(0.1)
+    assert cache.get("a", "missing") == "missing"
+    assert cache.stats()["expirations"] == 1
+    assert len(cache) == 0
+
+
+def test_disk_tier_survives_restart_and_memory_eviction(tmp_path):
+    cache = LRUCache(max_entries=1, disk_dir=tmp_path)
+    cache.set("a", {"style": "minimal"})
+    cache.set("b", {"style": "street"})  # evicts "a" from memory only
+
+    assert cache.get("a") == {"style": "minimal"}
+    assert cache.stats()["disk_hits"] == 1
+
+    restarted = LRUCache(disk_dir=tmp_path)
+    assert restarted.get("b") == {"style": "street"}
+
+
+def test_disk_tier_drops_expired_files(tmp_path):
+    (tmp_path / "old.json").write_text(json.dumps({"stored_at": time.time() - 120, "value": 1}))
+    cache = LRUCache(ttl=60, disk_dir=tmp_path)
+    assert cache.get("old") is None
+    assert not (tmp_path / "old.json").exists()
+
+
+def test_hit_ratio():
+    cache = LRUCache()
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("b")
+    assert cache.stats()["hit_ratio"] == 0.5
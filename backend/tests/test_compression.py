@@ -0,0 +1,54 @@
+import gzip
+import asyncio
+
+import pytest
+
+from compression import CompressionMiddleware, accepted_encodings, brotli
+from payload import dumps
+
+BODY = dumps({"results": {"tops": [{"id": str(i), "title": "Linen shirt", "price": "$40"} for i in range(200)]}})
+
+
+def test_accepted_encodings_honours_q_zero():
+    assert accepted_encodings("gzip, br;q=0, deflate;q=0.5") == {"gzip", "deflate"}
+    assert accepted_encodings("") == set()
+
+
+def run(middleware_app, accept: str, content_type: bytes, chunks: list[bytes]) -> tuple[dict, bytes]:
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", content_type)]})
+        for i, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "headers": [(b"accept-encoding", accept.encode())]}
+    asyncio.run(middleware_app(app)(scope, None, send))
+    headers = dict(sent[0]["headers"])
+    return headers, b"".join(m.get("body", b"") for m in sent[1:])
+
+
+def test_gzip_when_brotli_not_accepted():
+    headers, body = run(CompressionMiddleware, "gzip", b"application/json", [BODY[:1000], BODY[1000:]])
+    assert headers[b"content-encoding"] == b"gzip"
+    assert headers[b"content-length"] == str(len(body)).encode()
+    assert headers[b"vary"] == b"Accept-Encoding"
+    assert gzip.decompress(body) == BODY
+
+
+@pytest.mark.skipif(brotli is None, reason="brotli not installed")
+def test_brotli_preferred():
+    headers, body = run(CompressionMiddleware, "gzip, br", b"application/json", [BODY])
+    assert headers[b"content-encoding"] == b"br"
+    assert brotli.decompress(body) == BODY
+
+
+def test_small_bodies_and_event_streams_are_not_compressed():
+    headers, body = run(CompressionMiddleware, "gzip", b"application/json", [b'{"a":1}'])
+    assert b"content-encoding" not in headers and body == b'{"a":1}'
+
+    headers, body = run(CompressionMiddleware, "gzip", b"text/event-stream", [BODY])
+    assert b"content-encoding" not in headers and body == BODY
@@ -0,0 +1,39 @@
+import os
+import time
+
+from image_store import ImageStore
+from utils import PreprocessedImage
+
+
+def image(n: int) -> PreprocessedImage:
+    return PreprocessedImage(
+        data=bytes([n]) * 1000, mime_type="image/jpeg", digest=f"img{n}", size=(10, 10),
+        passthrough=False, thumbnail=None, timings={},
+    )
+
+
+def test_memory_only_store_evicts_without_writing_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = ImageStore(max_bytes=1500)
+    store.put(image(1))
+    store.put(image(2))
+    assert store.get("img1") is None
+    assert store.get("img2") is not None
+    assert store.stats()["evictions"] == 1
+    assert store.stats()["disk_entries"] == 0
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_disk_tier_spills_and_prunes_expired_files(tmp_path):
+    store = ImageStore(disk_dir=tmp_path, max_bytes=1500, ttl=60)
+    store.put(image(1))
+    store.put(image(2))
+    assert store.stats()["spills"] == 1
+    assert store.get("img1") is not None
+
+    stale = time.time() - 120
+    os.utime(tmp_path / "img1.npz", (stale, stale))
+    reopened = ImageStore(disk_dir=tmp_path, ttl=60)
+    assert reopened.stats()["disk_entries"] == 1
+    assert not (tmp_path / "img1.npz").exists()
+    assert reopened.get("img2") is not None
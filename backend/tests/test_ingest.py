@@ -0,0 +1,95 @@
+import asyncio
+from io import BytesIO
+
+import numpy as np
+import pytest
+from fastapi import HTTPException, UploadFile
+from PIL import Image
+
+import ingest
+from ingest import IngestMeter, normalize_uploads, read_upload, read_upload_header, sniff_image
+
+
+def image_bytes(width: int = 64, height: int = 48, fmt: str = "JPEG", seed: int = 0) -> bytes:
+    pixels = np.random.default_rng(seed).integers(0, 255, (height, width, 3), dtype=np.uint8)
+    out = BytesIO()
+    Image.fromarray(pixels).save(out, fmt)
+    return out.getvalue()
+
+
+def upload(data: bytes, name: str = "fit.jpg", declared: int | None = None) -> UploadFile:
+    return UploadFile(BytesIO(data), filename=name, size=len(data) if declared is None else declared)
+
+
+def test_sniff_image_reads_format_and_size_from_header():
+    assert sniff_image(image_bytes(fmt="JPEG")) == ("image/jpeg", (64, 48))
+    assert sniff_image(image_bytes(fmt="PNG")) == ("image/png", (64, 48))
+    assert sniff_image(b"RIFF\0\0\0\0WEBPVP8 ") == ("image/webp", None)
+    assert sniff_image(b"\0\0\0\x18ftypheic") == ("image/heic", None)
+    assert sniff_image(b"%PDF-1.7") is None
+
+
+def test_non_image_is_rejected_with_415():
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(read_upload_header(upload(b"%PDF-1.7 not a photo", "cv.pdf")))
+    assert e.value.status_code == 415
+
+
+def test_declared_oversized_upload_is_rejected_before_reading(monkeypatch):
+    monkeypatch.setattr(ingest, "MAX_UPLOAD_BYTES", 1000)
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(read_upload_header(upload(image_bytes(), declared=5000)))
+    assert e.value.status_code == 413
+
+
+def test_decompression_bomb_is_rejected_from_its_header(monkeypatch):
+    monkeypatch.setattr(ingest, "MAX_IMAGE_PIXELS", 1000)
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(read_upload_header(upload(image_bytes(64, 48))))
+    assert e.value.status_code == 413
+
+
+def test_header_read_leaves_upload_at_start():
+    data = image_bytes()
+    file = upload(data)
+    asyncio.run(read_upload_header(file))
+    assert asyncio.run(read_upload(file, IngestMeter())) == data
+
+
+def test_upload_over_its_limit_fails_while_reading_and_releases_buffer():
+    meter = IngestMeter()
+    data = b"\xff\xd8\xff" + b"\0" * (3 * ingest.CHUNK_SIZE)
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(read_upload(upload(data, declared=0), meter, max_bytes=ingest.CHUNK_SIZE * 2))
+    assert e.value.status_code == 413
+    assert meter.buffered == 0
+
+
+def test_request_total_over_limit_is_rejected():
+    meter = IngestMeter(max_bytes=ingest.CHUNK_SIZE + 1)
+    asyncio.run(read_upload(upload(b"\0" * ingest.CHUNK_SIZE), meter))
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(read_upload(upload(b"\0" * ingest.CHUNK_SIZE), meter))
+    assert e.value.status_code == 413
+
+
+def test_normalize_uploads_keeps_order_and_bounds_buffered_originals(monkeypatch):
+    monkeypatch.setattr(ingest, "INGEST_BUFFER_BYTES", 0)
+    originals = [image_bytes(1200, 900, seed=i) for i in range(4)]
+    files = [upload(data) for data in originals]
+    meter = IngestMeter()
+
+    async def scenario():
+        headers = [await read_upload_header(f) for f in files]
+        return await normalize_uploads(files, headers, [200_000] * 4, meter, {})
+
+    images = asyncio.run(scenario())
+    assert len(images) == 4
+    assert all(img.size[0] * img.size[1] <= 200_000 for img in images)
+    assert [img.digest for img in images] == [
+        ingest.preprocess_image(data, "image/jpeg", 200_000).digest for data in originals
+    ]
+    # Originals are released once normalized, only the normalized copies stay held
+    assert meter.buffered == sum(len(img.data) for img in images)
+    assert meter.bytes_read == sum(len(data) for data in originals)
+    assert meter.peak_buffered < sum(len(data) for data in originals)
@@ -0,0 +1,80 @@
+import json
+import asyncio
+
+import httpx
+import pytest
+
+from llm_client import OpenRouterClient
+
+
+def client_for(handler, **kwargs) -> OpenRouterClient:
+    client = OpenRouterClient("key", url="https://llm.test/chat", backoff_base=0, **kwargs)
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+def sse(*chunks: dict) -> bytes:
+    return "".join(f"data: {json.dumps(c)}\n\n" for c in chunks).encode() + b"data: [DONE]\n\n"
+
+
+def test_post_retries_retryable_status():
+    statuses = iter([503, 200])
+
+    def handler(request):
+        return httpx.Response(next(statuses), json={"choices": []})
+
+    client = client_for(handler, max_retries=1)
+    assert asyncio.run(client.post({"messages": []})) == {"choices": []}
+    assert client.stats()["retries"] == 1
+
+
+def test_stream_yields_deltas():
+    def handler(request):
+        body = sse({"choices": [{"delta": {"content": "Hel"}}]}, {"choices": [{"delta": {"content": "lo"}}]})
+        return httpx.Response(200, content=body)
+
+    async def scenario():
+        return [delta async for delta in client_for(handler).stream({"messages": []})]
+
+    assert asyncio.run(scenario()) == ["Hel", "lo"]
+
+
+def test_stream_error_chunk_counts_as_failure():
+    def handler(request):
+        return httpx.Response(200, content=sse({"choices": [{"delta": {"content": "Hi"}}]}, {"error": {"message": "overloaded"}}))
+
+    client = client_for(handler)
+
+    async def scenario():
+        return [delta async for delta in client.stream({"messages": []})]
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(scenario())
+    assert client.stats()["failures"] == 1
+
+
+def test_open_streams_do_not_block_post():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def slow_stream():
+            await release.wait()
+            yield sse({"choices": [{"delta": {"content": "x"}}]})
+
+        def handler(request):
+            if json.loads(request.content).get("stream"):
+                return httpx.Response(200, content=slow_stream())
+            return httpx.Response(200, json={"ok": True})
+
+        client = client_for(handler, max_concurrency=1, max_streams=1)
+
+        async def consume():
+            return [delta async for delta in client.stream({"messages": []})]
+
+        stream = asyncio.create_task(consume())
+        await asyncio.sleep(0.01)
+        answer = await asyncio.wait_for(client.post({"messages": []}), timeout=1)
+        release.set()
+        return answer, await stream
+
+    assert asyncio.run(scenario()) == ({"ok": True}, ["x"])
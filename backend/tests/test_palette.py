@@ -0,0 +1,127 @@
+import asyncio
+from io import BytesIO
+
+import httpx
+import numpy as np
+import pytest
+from PIL import Image
+
+from palette import (
+    THUMBNAIL_SIZE, PaletteMatcher, extract_palettes, lab_to_hex, outfit_palette, palette_match, srgb_to_lab,
+)
+
+
+def png(color: tuple[int, int, int], size: int = 64) -> bytes:
+    out = BytesIO()
+    Image.new("RGB", (size, size), color).save(out, "PNG")
+    return out.getvalue()
+
+
+def solid(color: tuple[int, int, int], size: int = THUMBNAIL_SIZE) -> np.ndarray:
+    return np.full((size, size, 3), color, dtype=np.uint8)
+
+
+def test_lab_conversion_round_trips():
+    lab = srgb_to_lab(np.array([[255, 255, 255], [0, 0, 0], [200, 30, 30]]))
+    assert np.allclose(lab[0], [100, 0, 0], atol=0.1)
+    assert np.allclose(lab[1], [0, 0, 0], atol=0.1)
+    assert lab_to_hex(lab) == ["#FFFFFF", "#000000", "#C81E1E"]
+
+
+def test_product_palette_ignores_white_backdrop():
+    thumbnail = solid((245, 245, 245))
+    thumbnail[8:24, 8:24] = (0, 0, 110)  # navy product on a white backdrop
+    palette = extract_palettes([thumbnail])[0]
+    top = int(np.argmax(palette["weights"]))
+    assert lab_to_hex(np.array([palette["lab"][top]])) == ["#00006E"]
+    assert sum(palette["weights"]) == pytest.approx(1.0, abs=1e-3)
+
+
+def test_palette_match_prefers_colors_in_the_style_palette():
+    navy, red = extract_palettes([solid((0, 0, 110)), solid((200, 30, 30))])
+    scores = palette_match(["#000070", "#FFFFFF"], [navy, red, None])
+    assert scores[0] > 0.9 > scores[1]
+    assert np.isnan(scores[2])
+    assert np.isnan(palette_match([], [navy])).all()
+
+
+def test_outfit_palette_is_deterministic_and_skips_missing_thumbnails():
+    photo = solid((230, 230, 230), 64)
+    photo[16:48, 20:44] = (110, 70, 40)  # brown jacket, centered
+    first = outfit_palette([photo, None])
+    assert first == outfit_palette([photo])
+    assert first[0] == lab_to_hex(srgb_to_lab(np.array([[110, 70, 40]])))[0]
+    assert outfit_palette([None]) == []
+
+
+def matcher_for(handler, **kwargs) -> PaletteMatcher:
+    matcher = PaletteMatcher(**kwargs)
+    matcher._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return matcher
+
+
+def test_palettes_are_downloaded_once_and_cached():
+    requests = []
+
+    def handler(request):
+        requests.append(request.url)
+        return httpx.Response(200, content=png((200, 30, 30)))
+
+    matcher = matcher_for(handler)
+
+    async def scenario():
+        first = await matcher.palettes(["https://img.test/a.png", None])
+        second = await matcher.palettes(["https://img.test/a.png"])
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first[1] is None
+    assert first[0] == second[0]
+    assert len(requests) == 1
+    assert matcher.stats()["in_flight"] == 0
+
+
+def test_oversized_image_is_not_downloaded_in_full():
+    def handler(request):
+        return httpx.Response(200, content=b"\0" * 10_000)
+
+    matcher = matcher_for(handler, max_bytes=1000)
+    assert asyncio.run(matcher.palettes(["https://img.test/huge.png"])) == [None]
+    assert matcher.stats()["too_large"] == 1
+    assert matcher.stats()["downloads"] == 0
+
+
+def test_cancelled_download_does_not_fail_batch_or_stay_in_flight():
+    def handler(request):
+        return httpx.Response(200, content=png((30, 30, 200)))
+
+    matcher = matcher_for(handler)
+
+    async def scenario():
+        ok = asyncio.create_task(matcher._fetch_thumbnail("https://img.test/ok.png"))
+        stuck = asyncio.create_task(asyncio.sleep(10))
+        matcher._in_flight.update({"https://img.test/ok.png": ok, "https://img.test/stuck.png": stuck})
+        stuck.cancel()
+        await asyncio.wait([ok, stuck])
+        return await matcher._store({"https://img.test/ok.png": ok, "https://img.test/stuck.png": stuck})
+
+    stored = asyncio.run(scenario())
+    assert list(stored) == ["https://img.test/ok.png"]
+    assert matcher.stats()["in_flight"] == 0
+
+
+def test_rerank_blends_palette_match_into_text_score():
+    colors = {"navy": (0, 0, 110), "red": (200, 30, 30)}
+
+    def handler(request):
+        return httpx.Response(200, content=png(colors[request.url.path.strip("/").split(".")[0]]))
+
+    matcher = matcher_for(handler)
+    ranked = [
+        ({"id": "red", "media": [{"url": "https://img.test/red.png"}]}, 0.50),
+        ({"id": "navy", "media": [{"url": "https://img.test/navy.png"}]}, 0.45),
+        ({"id": "bare"}, 0.40),
+    ]
+    offers = asyncio.run(matcher.rerank(ranked, ["#000070"], limit=3, weight=0.3))
+    # The imageless offer gets the median match, so it lands between the two
+    assert [o["id"] for o in offers] == ["navy", "bare", "red"]
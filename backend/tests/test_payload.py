@@ -0,0 +1,43 @@
+import json
+
+import numpy as np
+
+from payload import FastJSONResponse, compact_items, compact_recommendations, dumps, parse_fields
+
+ITEMS = [
+    {"id": "1", "title": "Linen shirt", "price": "$40", "vendor": "", "sizes": [], "reasons": ["Fits", "Palette"]},
+    {"id": "2", "title": "Chinos", "price": None, "vendor": "Acme", "sizes": ["M"], "reasons": ["Fits", "Palette"]},
+]
+
+
+def test_dumps_matches_stdlib_and_handles_numpy():
+    value = {"name": "Café", "scores": [1, 2.5], "nested": {"ok": True, "none": None}}
+    assert json.loads(dumps(value)) == value
+    assert json.loads(dumps({"score": np.float32(0.5), "n": np.int64(3)})) == {"score": 0.5, "n": 3}
+    assert FastJSONResponse({"a": 1}).body == b'{"a":1}'
+
+
+def test_parse_fields():
+    assert parse_fields(None) is None
+    assert parse_fields(" , ") is None
+    assert parse_fields("id, title,,price") == frozenset({"id", "title", "price"})
+
+
+def test_compact_items_drops_empty_values_and_sends_reasons_once():
+    items, reasons = compact_items(ITEMS)
+    assert reasons == ["Fits", "Palette"]
+    assert items == [
+        {"id": "1", "title": "Linen shirt", "price": "$40"},
+        {"id": "2", "title": "Chinos", "vendor": "Acme", "sizes": ["M"]},
+    ]
+
+
+def test_compact_items_projects_fields():
+    items, _ = compact_items(ITEMS, frozenset({"id", "price"}))
+    assert items == [{"id": "1", "price": "$40"}, {"id": "2"}]
+
+
+def test_compact_recommendations_per_category():
+    results, reasons = compact_recommendations({"tops": ITEMS, "bottoms": []})
+    assert set(results) == {"tops", "bottoms"} and results["bottoms"] == []
+    assert reasons == {"tops": ["Fits", "Palette"], "bottoms": []}
@@ -0,0 +1,24 @@
+from product_index import ProductIndex, rank_offers
+
+PROFILE = {"name": "Coastal Minimal", "colors": ["white", "navy"], "fit": "relaxed", "textures": ["linen"]}
+
+
+def offer(product_id: str, title: str) -> dict:
+    return {"id": product_id, "title": title, "description": "", "rating": {"rating": 4.5}}
+
+
+def test_rank_offers_only_returns_the_given_offers():
+    index = ProductIndex()
+    rank_offers(index, [offer("shoe", "White navy linen relaxed sneakers")], PROFILE, "white sneakers")
+    ranked = rank_offers(index, [offer("shirt", "Linen shirt")], PROFILE, "white linen shirt")
+    assert [o["id"] for o, _ in ranked] == ["shirt"]
+
+
+def test_query_relevance_outranks_palette_only_match():
+    index = ProductIndex()
+    offers = [
+        offer("shoe", "White navy linen relaxed sneakers"),
+        offer("shirt", "White linen shirt"),
+    ]
+    ranked = rank_offers(index, offers, PROFILE, "white linen shirt")
+    assert ranked[0][0]["id"] == "shirt"
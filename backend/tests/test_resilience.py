@@ -0,0 +1,216 @@
+import time
+import asyncio
+
+import httpx
+import pytest
+
+from resilience import (
+    CircuitBreaker, CircuitOpen, DeadlineExceeded, Upstream, call_timeout, request_budget, time_left,
+)
+
+
+def open_upstream(reset_timeout: float = 0.01) -> Upstream:
+    upstream = Upstream("test", failure_threshold=2, reset_timeout=reset_timeout, hedge_ratio=0)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            upstream.call_sync(fail)
+    assert upstream.breaker.stats()["state"] == "open"
+    return upstream
+
+
+def fail():
+    raise RuntimeError("upstream down")
+
+
+def ok():
+    return "ok"
+
+
+def test_breaker_opens_after_threshold_and_rejects():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=60)
+    for _ in range(3):
+        breaker.allow()
+        breaker.record_failure()
+    assert breaker.stats()["state"] == "open"
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_success_resets_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.stats()["state"] == "closed"
+
+
+def test_half_open_allows_one_trial():
+    upstream = open_upstream()
+    time.sleep(0.02)
+    upstream.breaker.allow()
+    assert upstream.breaker.stats()["state"] == "half-open"
+    with pytest.raises(CircuitOpen):
+        upstream.breaker.allow()
+
+
+def test_half_open_trial_success_closes():
+    upstream = open_upstream()
+    time.sleep(0.02)
+    assert upstream.call_sync(ok) == "ok"
+    assert upstream.breaker.stats()["state"] == "closed"
+
+
+def test_half_open_trial_failure_reopens():
+    upstream = open_upstream()
+    time.sleep(0.02)
+    with pytest.raises(RuntimeError):
+        upstream.call_sync(fail)
+    assert upstream.breaker.stats()["state"] == "open"
+    with pytest.raises(CircuitOpen):
+        upstream.call_sync(ok)
+
+
+def test_half_open_trial_out_of_budget_releases_trial():
+    upstream = open_upstream()
+    time.sleep(0.02)
+    with request_budget(0):
+        with pytest.raises(DeadlineExceeded):
+            upstream.call_sync(lambda: call_timeout(5))
+    assert upstream.breaker.stats()["state"] == "half-open"
+    # The next call is a new trial instead of CircuitOpen forever
+    assert upstream.call_sync(ok) == "ok"
+    assert upstream.breaker.stats()["state"] == "closed"
+
+
+def test_half_open_trial_cancelled_releases_trial():
+    upstream = open_upstream()
+    time.sleep(0.02)
+
+    async def scenario():
+        task = asyncio.ensure_future(upstream.call(lambda: asyncio.sleep(10), hedge=False))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        async def answer():
+            return "ok"
+        return await upstream.call(answer)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert upstream.breaker.stats()["state"] == "closed"
+
+
+def test_guard_generator_exit_releases_trial():
+    upstream = open_upstream()
+    time.sleep(0.02)
+
+    async def events():
+        async with upstream.guard():
+            yield 1
+            yield 2
+
+    async def scenario():
+        stream = events()
+        assert await stream.__anext__() == 1
+        # Client disconnects mid-stream
+        await stream.aclose()
+        async with upstream.guard():
+            pass
+
+    asyncio.run(scenario())
+    assert upstream.breaker.stats()["state"] == "closed"
+
+
+def test_request_budget_nesting_never_extends():
+    assert time_left() is None
+    assert call_timeout(5) == 5
+    with request_budget(1):
+        with request_budget(10):
+            assert time_left() <= 1
+        with request_budget(0.5):
+            assert time_left() <= 0.5
+        assert 0.5 < time_left() <= 1
+        assert call_timeout(5) <= 1
+    assert time_left() is None
+
+
+def test_call_timeout_raises_when_budget_spent():
+    with request_budget(0):
+        with pytest.raises(DeadlineExceeded):
+            call_timeout(5)
+
+
+def http_error(status: int) -> httpx.HTTPStatusError:
+    response = httpx.Response(status, request=httpx.Request("POST", "https://upstream.test"))
+    return httpx.HTTPStatusError(f"{status}", request=response.request, response=response)
+
+
+def test_client_errors_leave_breaker_closed():
+    upstream = Upstream("test", failure_threshold=2, reset_timeout=60, hedge_ratio=0)
+
+    def bad_request():
+        raise http_error(400)
+
+    for _ in range(5):
+        with pytest.raises(httpx.HTTPStatusError):
+            upstream.call_sync(bad_request)
+    assert upstream.breaker.stats()["state"] == "closed"
+    assert upstream.stats()["client_errors"] == 5
+    assert upstream.stats()["failures"] == 0
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_server_errors_and_rate_limits_open_breaker(status):
+    upstream = Upstream("test", failure_threshold=2, reset_timeout=60, hedge_ratio=0)
+
+    def unavailable():
+        raise http_error(status)
+
+    for _ in range(2):
+        with pytest.raises(httpx.HTTPStatusError):
+            upstream.call_sync(unavailable)
+    assert upstream.breaker.stats()["state"] == "open"
+
+
+def test_half_open_trial_client_error_releases_trial():
+    upstream = open_upstream()
+    time.sleep(0.02)
+
+    def unauthorized():
+        raise http_error(401)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        upstream.call_sync(unauthorized)
+    assert upstream.call_sync(ok) == "ok"
+    assert upstream.breaker.stats()["state"] == "closed"
+
+
+def test_cancelled_hedge_does_not_hide_upstream_error():
+    upstream = Upstream("test", hedge_ratio=1, hedge_min_delay=0.01, hedge_min_samples=1)
+    upstream.tracker("default").add(0.001)
+
+    async def scenario():
+        release = asyncio.Event()
+        attempts = []
+
+        async def attempt():
+            n = len(attempts)
+            attempts.append(n)
+            await release.wait()
+            if n == 0:
+                raise RuntimeError("upstream down")
+            raise asyncio.CancelledError()
+
+        async def release_both():
+            await asyncio.sleep(0.05)
+            release.set()
+
+        asyncio.ensure_future(release_both())
+        with pytest.raises(RuntimeError):
+            await upstream.call(attempt)
+        return attempts
+
+    assert asyncio.run(scenario()) == [0, 1]
+    assert upstream.stats()["failures"] == 1
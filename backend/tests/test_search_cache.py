@@ -0,0 +1,78 @@
+import os
+import time
+import threading
+
+# shopfiy_mcp_example checks its env at import; these tests never reach Shopify
+for var in ("SHOPIFY_CLIENT_ID", "SHOPIFY_CLIENT_SECRET", "SHOPIFY_SAVED_CATALOG"):
+    os.environ.setdefault(var, "test")
+
+import shopfiy_mcp_example as shopify
+from cache import LRUCache
+
+
+def counting_fetch(monkeypatch, delay: float = 0.0):
+    calls = []
+
+    def fetch(token, query, context, limit):
+        calls.append(query)
+        time.sleep(delay)
+        return {"offers": [{"id": f"{query}-{len(calls)}"}]}
+
+    monkeypatch.setattr(shopify, "fetch_products_by_style", fetch)
+    monkeypatch.setattr(shopify, "get_token", lambda: "token")
+    return calls
+
+
+def wait_for(condition, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+def test_repeated_search_is_served_from_cache(monkeypatch):
+    calls = counting_fetch(monkeypatch)
+    first = shopify.search_products_by_style("token", "navy overshirt", "ctx", 5)
+    second = shopify.search_products_by_style("token", "navy overshirt", "ctx", 5)
+    assert first == second
+    assert calls == ["navy overshirt"]
+    # A different limit is a different search
+    shopify.search_products_by_style("token", "navy overshirt", "ctx", 10)
+    assert len(calls) == 2
+
+
+def test_stale_entry_is_served_and_refreshed_once_in_background(monkeypatch):
+    calls = counting_fetch(monkeypatch, delay=0.05)
+    old = shopify.search_products_by_style("token", "linen shirt", "", 5)
+    monkeypatch.setattr(shopify, "SEARCH_CACHE_MAX_AGE", 0)
+
+    # Stale answers come back right away, with one refresh for the burst
+    assert shopify.search_products_by_style("token", "linen shirt", "", 5) == old
+    assert shopify.search_products_by_style("token", "linen shirt", "", 5) == old
+    wait_for(lambda: len(calls) == 2 and not shopify.search_cache_stats()["refreshing"])
+    monkeypatch.setattr(shopify, "SEARCH_CACHE_MAX_AGE", 300)
+    assert shopify.search_products_by_style("token", "linen shirt", "", 5) != old
+    assert len(calls) == 2
+
+
+def test_concurrent_misses_share_one_fetch(monkeypatch):
+    calls = counting_fetch(monkeypatch, delay=0.1)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(shopify.search_products_by_style("token", "wool coat", "", 5)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == ["wool coat"]
+    assert len(results) == 4 and all(r == results[0] for r in results)
+
+
+def test_get_with_age():
+    cache = LRUCache()
+    assert cache.get_with_age("a") is None
+    cache.set("a", 1)
+    value, age = cache.get_with_age("a")
+    assert value == 1 and 0 <= age < 1
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from metrics import ServerTiming, _current, timed
+from resilience import DeadlineExceeded, request_budget, time_left
+from singleflight import AsyncSingleFlight
+
+
+def test_shared_call_does_not_inherit_first_callers_budget():
+    flight = AsyncSingleFlight("test")
+
+    async def call():
+        await asyncio.sleep(0.05)
+        return time_left()
+
+    async def short_caller():
+        with request_budget(0.01):
+            return await flight.do("key", call, budget=5)
+
+    async def patient_caller():
+        with request_budget(5):
+            return await flight.do("key", call, budget=5)
+
+    async def scenario():
+        return await asyncio.gather(short_caller(), patient_caller(), return_exceptions=True)
+
+    short, patient = asyncio.run(scenario())
+    assert isinstance(short, DeadlineExceeded)
+    # The call outlived the first caller's budget and ran under its own
+    assert patient > 4
+
+
+def test_shared_call_does_not_record_into_callers_server_timing():
+    flight = AsyncSingleFlight("test")
+
+    async def call():
+        with timed("inside_flight"):
+            await asyncio.sleep(0)
+        return "ok"
+
+    async def scenario():
+        timing = ServerTiming()
+        _current.set(timing)
+        assert await flight.do("key", call) == "ok"
+        return timing
+
+    timing = asyncio.run(scenario())
+    assert "inside_flight" not in timing.header(0)
+
+
+def test_identical_calls_are_coalesced_and_cancelled_when_abandoned():
+    flight = AsyncSingleFlight("test")
+    started = []
+
+    async def call():
+        started.append(1)
+        await asyncio.sleep(10)
+
+    async def scenario():
+        waiters = [asyncio.ensure_future(flight.do("key", call)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        assert flight.stats()["in_flight"] == 1
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        return flight.stats()
+
+    assert asyncio.run(scenario()) == {"calls": 3, "coalesced": 2, "in_flight": 0}
+    assert started == [1]
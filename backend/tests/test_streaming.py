@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+from streaming import JSONFieldStream, sse_event
+
+ANSWER = {
+    "current_style": {"name": "Coastal, \"minimal\"", "colors": ["white", "navy"]},
+    "current_summary": ["Relaxed {fit}", "Linen, cotton"],
+    "current_score": 7,
+    "improved_style": {"name": "Smart casual", "accessories": []},
+}
+
+
+def feed_all(parser: JSONFieldStream, chunks) -> list:
+    fields = []
+    for chunk in chunks:
+        fields += parser.feed(chunk)
+    return fields
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 17, 10_000])
+def test_fields_match_json_loads_for_any_chunking(chunk_size):
+    text = "```json\n" + json.dumps(ANSWER, indent=2) + "\n```"
+    chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+    parser = JSONFieldStream()
+    assert dict(feed_all(parser, chunks)) == ANSWER
+    assert parser.done
+
+
+def test_field_is_emitted_as_soon_as_it_is_complete():
+    parser = JSONFieldStream()
+    assert parser.feed('{"current_style": {"name": "a, b"}') == []
+    assert parser.feed(', "current_sc') == [("current_style", {"name": "a, b"})]
+    assert parser.feed('ore": 5}') == [("current_score", 5)]
+
+
+def test_escaped_quotes_and_brackets_inside_strings_do_not_count():
+    parser = JSONFieldStream()
+    fields = parser.feed(r'{"a": "he said \"}\", ok", "b": "[,{"}')
+    assert fields == [("a", 'he said "}", ok'), ("b", "[,{")]
+
+
+def test_text_after_the_object_is_ignored():
+    parser = JSONFieldStream()
+    assert parser.feed('{"a": 1} trailing {"b": 2}') == [("a", 1)]
+    assert parser.feed('{"c": 3}') == []
+
+
+def test_incomplete_object_is_not_done():
+    parser = JSONFieldStream()
+    assert parser.feed('{"a": 1, "b": [1, 2') == [("a", 1)]
+    assert not parser.done
+
+
+def test_sse_event_format():
+    assert sse_event("done", {"a": 1}) == 'event: done\ndata: {"a":1}\n\n'
@@ -0,0 +1,104 @@
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from utils import (
+    ANALYSIS_SIZE, allocate_pixel_budget, analysis_thumbnail, estimate_image_tokens, group_near_duplicates,
+    preprocess_image,
+)
+
+
+def photo(outfit: tuple[int, int, int], shift: int = 0) -> Image.Image:
+    """A person-like shot: gradient backdrop with a block of clothing in the middle."""
+    x = np.linspace(0, 1, 256)[None, :, None]
+    y = np.linspace(0, 1, 256)[:, None, None]
+    backdrop = (80 + 120 * x + 40 * y) * np.ones((1, 1, 3))
+    pixels = backdrop.astype(np.int16)
+    pixels[40:220, 80:176] = outfit
+    pixels[20:60, 110:146] = (200, 160, 130)  # face
+    return Image.fromarray(np.clip(pixels + shift, 0, 255).astype(np.uint8))
+
+
+def thumbnail(img: Image.Image, jpeg_quality: int | None = None) -> np.ndarray:
+    if jpeg_quality is not None:
+        out = BytesIO()
+        img.save(out, "JPEG", quality=jpeg_quality)
+        img = Image.open(BytesIO(out.getvalue()))
+    return analysis_thumbnail(img)
+
+
+def test_analysis_thumbnail_shape():
+    assert thumbnail(photo((30, 30, 120))).shape == (ANALYSIS_SIZE, ANALYSIS_SIZE, 3)
+
+
+def test_recompressed_and_brightened_copies_are_merged_into_the_first():
+    original = photo((30, 30, 120))
+    thumbnails = [
+        thumbnail(original),
+        thumbnail(photo((160, 40, 40))),
+        thumbnail(original, jpeg_quality=40),
+        thumbnail(photo((30, 30, 120), shift=3)),
+    ]
+    assert group_near_duplicates(thumbnails) == [[0, 2, 3], [1]]
+
+
+def test_same_pose_in_a_different_outfit_is_kept_by_the_histogram():
+    thumbnails = [thumbnail(photo((30, 30, 120))), thumbnail(photo((30, 120, 30)))]
+    # Even with the dHash check disabled, the outfit colors keep them apart
+    assert group_near_duplicates(thumbnails, max_hash_distance=64) == [[0], [1]]
+    assert group_near_duplicates(thumbnails, max_hash_distance=64, max_histogram_distance=2.0) == [[0, 1]]
+
+
+def test_images_without_thumbnail_are_never_merged():
+    same = thumbnail(photo((30, 30, 120)))
+    assert group_near_duplicates([None, same, None, same]) == [[0], [1, 3], [2]]
+
+
+def jpeg(width: int, height: int) -> bytes:
+    out = BytesIO()
+    photo((30, 30, 120)).resize((width, height)).save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+
+def test_small_images_keep_their_size_and_large_ones_share_the_rest():
+    limits = allocate_pixel_budget([(500, 500), (4000, 3000), (4000, 3000)], budget=2_000_000,
+                                   min_pixels=100_000, max_dimension=1536)
+    assert limits[0] == 500 * 500
+    assert limits[1] == limits[2] == (2_000_000 - 500 * 500) // 2
+    assert sum(limits) <= 2_000_000
+
+
+def test_images_within_budget_are_only_capped_by_max_dimension():
+    limits = allocate_pixel_budget([(4000, 3000), (800, 600)], budget=10_000_000, max_dimension=1536)
+    assert limits == [1536 * 1152, 800 * 600]
+
+
+def test_large_batches_never_go_below_min_pixels():
+    limits = allocate_pixel_budget([(4000, 3000)] * 20, budget=1_000_000, min_pixels=200_000)
+    assert limits == [200_000] * 20
+
+
+def test_unreadable_images_get_no_share():
+    limits = allocate_pixel_budget([None, (4000, 3000)], budget=1_000_000, min_pixels=1)
+    assert limits == [0, 1_000_000]
+
+
+def test_preprocess_image_respects_its_pixel_share():
+    image = preprocess_image(jpeg(2000, 1500), "image/jpeg", max_pixels=300_000)
+    width, height = image.size
+    assert width * height <= 300_000
+    assert abs(width / height - 2000 / 1500) < 0.01
+    assert not image.passthrough
+    assert image.thumbnail.shape == (ANALYSIS_SIZE, ANALYSIS_SIZE, 3)
+
+
+def test_small_upload_is_passed_through():
+    data = jpeg(400, 300)
+    image = preprocess_image(data, "image/jpeg", max_pixels=300_000)
+    assert image.passthrough and image.data is data and image.size == (400, 300)
+
+
+def test_estimate_image_tokens():
+    assert estimate_image_tokens(384, 200) == 258
+    assert estimate_image_tokens(1536, 1152) == 258 * 2 * 2
@@ -1,55 +1,251 @@
+import os
+import math
+import time
+import base64
+import hashlib
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+import numpy as np
 from PIL import Image
 
-def compress_image(image_bytes: bytes, content_type: str, max_size_mb: float = 1.0, max_dimension: int = 1536) -> tuple[bytes, str]:
+# Bounded pool for image preprocessing. PIL releases the GIL while decoding,
+# resizing and encoding, so threads keep this work off the event loop in parallel.
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+image_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+
+# Side of the square thumbnail kept for local color analysis
+ANALYSIS_SIZE = 64
+
+# Vision tokens scale with pixels, so uploads are sized against a per-request pixel budget
+# shared by all images, with a floor per image and a cap on the long side
+IMAGE_PIXEL_BUDGET = int(os.getenv("IMAGE_PIXEL_BUDGET", str(6 * 1024 * 1024)))
+IMAGE_MIN_PIXELS = int(os.getenv("IMAGE_MIN_PIXELS", str(512 * 512)))
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "1536"))
+IMAGE_MAX_MB = float(os.getenv("IMAGE_MAX_MB", "1.0"))
+JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+# Formats the vision model takes as-is
+PASSTHROUGH_TYPES = ('image/jpeg', 'image/png', 'image/webp')
+
+# Near-duplicate uploads: max differing bits of the 64-bit dHash, and max L1 distance
+# (0-2) between the coarse color histograms
+DEDUP_MAX_HASH_DISTANCE = int(os.getenv("DEDUP_MAX_HASH_DISTANCE", "10"))
+DEDUP_MAX_HISTOGRAM_DISTANCE = float(os.getenv("DEDUP_MAX_HISTOGRAM_DISTANCE", "0.3"))
+
+def compress_image(image_bytes: bytes, content_type: str, max_size_mb: float = 1.0, max_dimension: int = 1536,
+                   image: Image.Image | None = None, max_pixels: int | None = None) -> tuple[bytes, str]:
     """
-    Compress image if it's too large.
+    Normalize an image for the vision model.
+
+    The original is passed through only when it already fits: at most max_dimension on the
+    long side, max_pixels in total (vision tokens scale with pixels), max_size_mb in bytes,
+    and a format the model takes. Otherwise it is downscaled to fit and re-encoded as JPEG.
+    `image` may be an already opened (not yet loaded) PIL image of image_bytes; it is then
+    decoded in place, so callers can reuse the decoded pixels.
     Returns: (compressed_bytes, mime_type)
     """
-    # Check if image is already small enough
+    # Open image (header only until pixels are needed)
+    img = image if image is not None else Image.open(BytesIO(image_bytes))
+    width, height = img.size
+    scale = min(1.0, max_dimension / max(width, height))
+    if max_pixels:
+        scale = min(scale, math.sqrt(max_pixels / (width * height)))
+    
+    # Check if image already fits
     size_mb = len(image_bytes) / (1024 * 1024)
-    if size_mb <= max_size_mb:
+    if scale >= 1.0 and size_mb <= max_size_mb and content_type in PASSTHROUGH_TYPES:
         return image_bytes, content_type
     
-    # Open image
-    img = Image.open(BytesIO(image_bytes))
+    new_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    
+    # JPEG draft mode: let the decoder downscale by 1/2, 1/4 or 1/8 while decoding
+    # when the source is far larger than the target, instead of decoding every pixel
+    if img.format == 'JPEG' and scale <= 0.5:
+        img.draft('RGB', new_size)
     
     # Resize if dimensions are too large
-    if max(img.size) > max_dimension:
-        ratio = max_dimension / max(img.size)
-        new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
-        img = img.resize(new_size, Image.Resampling.LANCZOS)
+    if scale < 1.0:
+        img = img.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
     
     # Convert to RGB if necessary (removes alpha channel for JPEG)
     if img.mode in ('RGBA', 'LA', 'P'):
         rgb_img = Image.new('RGB', img.size, (255, 255, 255))
         if img.mode == 'P':
             img = img.convert('RGBA')
-        rgb_img.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
+        rgb_img.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
         img = rgb_img
+    elif img.mode != 'RGB':
+        img = img.convert('RGB')
     
-    # Save with compression
-    output = BytesIO()
-    
-    # Determine format and quality
-    if content_type in ['image/jpeg', 'image/jpg']:
-        img.save(output, format='JPEG', quality=85, optimize=True)
-        mime_type = 'image/jpeg'
-    elif content_type == 'image/png':
-        img.save(output, format='PNG', optimize=True)
-        mime_type = 'image/png'
-    elif content_type == 'image/webp':
-        img.save(output, format='WEBP', quality=85, method=6)
-        mime_type = 'image/webp'
-    else:
-        # Default to JPEG for other formats
-        img.save(output, format='JPEG', quality=85, optimize=True)
-        mime_type = 'image/jpeg'
-    
-    compressed_bytes = output.getvalue()
+    # Photos compress far better as JPEG than PNG, and the model reads both the same;
+    # drop the quality a step when the first pass is still over the byte limit
+    for quality in (JPEG_QUALITY, JPEG_QUALITY - 15):
+        output = BytesIO()
+        img.save(output, format='JPEG', quality=quality, optimize=True)
+        compressed_bytes = output.getvalue()
+        if len(compressed_bytes) <= max_size_mb * 1024 * 1024:
+            break
     
-    # If compression didn't help much, return original
-    if len(compressed_bytes) >= len(image_bytes):
+    # If compression didn't help and the original fits the pixel limits, return original
+    if scale >= 1.0 and len(compressed_bytes) >= len(image_bytes) and content_type in PASSTHROUGH_TYPES:
         return image_bytes, content_type
     
-    return compressed_bytes, mime_type
\ No newline at end of file
+    return compressed_bytes, 'image/jpeg'
+
+
+def probe_image_size(image_bytes: bytes) -> tuple[int, int] | None:
+    """(width, height) from the image header, without decoding pixels; None if unreadable."""
+    try:
+        return Image.open(BytesIO(image_bytes)).size
+    except Exception:
+        return None
+
+
+def allocate_pixel_budget(sizes: list[tuple[int, int] | None], budget: int = IMAGE_PIXEL_BUDGET,
+                          min_pixels: int = IMAGE_MIN_PIXELS,
+                          max_dimension: int = IMAGE_MAX_DIMENSION) -> list[int]:
+    """
+    Split a request's pixel budget across its images (water-filling): images smaller than
+    an equal share keep their size, the rest get an equal share of what is left.
+    No image is cut below min_pixels, so a large batch may end up over the budget.
+    Returns the max pixel count for each image.
+    """
+    capped = []
+    for size in sizes:
+        if size is None:
+            capped.append(0)
+            continue
+        width, height = size
+        scale = min(1.0, max_dimension / max(width, height, 1))
+        capped.append(int(width * scale) * int(height * scale))
+    
+    limits = list(capped)
+    remaining = budget
+    # Smallest first: each image that fits its share frees the rest for the larger ones
+    order = sorted((i for i, p in enumerate(capped) if p), key=lambda i: capped[i])
+    for n, i in enumerate(order):
+        share = max(remaining // (len(order) - n), min_pixels)
+        limits[i] = min(capped[i], share)
+        remaining = max(remaining - limits[i], 0)
+    return limits
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """
+    Vision tokens for an image, as Gemini counts them: 258 for images up to 384px
+    on both sides, otherwise 258 per 768x768 tile.
+    """
+    if width <= 384 and height <= 384:
+        return 258
+    return 258 * math.ceil(width / 768) * math.ceil(height / 768)
+
+
+def analysis_thumbnail(img: Image.Image, size: int = ANALYSIS_SIZE) -> np.ndarray:
+    """
+    Small RGB copy of an image for local color analysis.
+    Reuses pixels already decoded by compress_image; otherwise decodes JPEGs in draft mode.
+    """
+    if img.format == 'JPEG':
+        # No-op if the image is already loaded
+        img.draft('RGB', (size * 2, size * 2))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return np.asarray(img.resize((size, size), Image.Resampling.BILINEAR, reducing_gap=2.0), dtype=np.uint8)
+
+
+class PreprocessedImage(NamedTuple):
+    data: bytes  # normalized image bytes sent to the model
+    mime_type: str
+    digest: str  # sha256 hex digest of data
+    size: tuple[int, int] | None  # (width, height) of data
+    passthrough: bool  # data is the original upload
+    thumbnail: np.ndarray | None  # (ANALYSIS_SIZE, ANALYSIS_SIZE, 3) RGB, None if undecodable
+    timings: dict[str, float]  # seconds per stage
+
+
+def preprocess_image(image_bytes: bytes, content_type: str, max_pixels: int | None = None) -> PreprocessedImage:
+    """
+    Normalize an upload for the vision model within its share of the pixel budget,
+    keeping a small thumbnail of the decoded pixels for local color analysis.
+    Meant to run on image_executor.
+    """
+    start = time.perf_counter()
+    try:
+        # Only reads the header; pixels are decoded once, shared by compression and the thumbnail
+        img = Image.open(BytesIO(image_bytes))
+    except Exception as e:
+        print(f"Could not open image for analysis: {e}")
+        img = None
+    if img is None:
+        data, mime_type = image_bytes, content_type
+    else:
+        original_size = img.size
+        data, mime_type = compress_image(image_bytes, content_type, max_size_mb=IMAGE_MAX_MB,
+                                         max_dimension=IMAGE_MAX_DIMENSION, image=img, max_pixels=max_pixels)
+    digest = hashlib.sha256(data).hexdigest()
+    compressed = time.perf_counter()
+    thumbnail = None
+    if img is not None:
+        try:
+            thumbnail = analysis_thumbnail(img)
+        except Exception as e:
+            print(f"Could not build analysis thumbnail: {e}")
+    analyzed = time.perf_counter()
+    # Draft mode may have shrunk img.size, so passthrough images report their header size
+    size = original_size if data is image_bytes and img is not None else probe_image_size(data)
+    return PreprocessedImage(data, mime_type, digest, size, data is image_bytes, thumbnail, {
+        "compress": compressed - start,
+        "thumbnail": analyzed - compressed,
+    })
+
+
+def to_data_url(data: bytes, mime_type: str) -> str:
+    """Base64 data URL for an image_url message part."""
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+
+def image_signature(thumbnail: np.ndarray) -> tuple[int, np.ndarray]:
+    """
+    Perceptual signature of an analysis thumbnail:
+    - dHash: 64 bits, one per horizontally adjacent pair of a 9x8 grayscale reduction
+    - a normalized 4x4x4 RGB histogram of the central region, where the outfit usually is,
+      so same-pose shots of different outfits stay apart
+    """
+    gray = np.asarray(Image.fromarray(thumbnail).convert('L').resize((9, 8), Image.Resampling.BOX), dtype=np.int16)
+    bits = (gray[:, 1:] > gray[:, :-1]).flatten()
+    dhash = int(np.packbits(bits).view('>u8')[0])
+    h, w, _ = thumbnail.shape
+    center = thumbnail[h // 8:h - h // 8, w // 4:w - w // 4]
+    bins = (center // 64).reshape(-1, 3).astype(np.int64)
+    histogram = np.bincount(bins[:, 0] * 16 + bins[:, 1] * 4 + bins[:, 2], minlength=64).astype(np.float32)
+    return dhash, histogram / histogram.sum()
+
+
+def group_near_duplicates(thumbnails: list[np.ndarray | None],
+                          max_hash_distance: int = DEDUP_MAX_HASH_DISTANCE,
+                          max_histogram_distance: float = DEDUP_MAX_HISTOGRAM_DISTANCE) -> list[list[int]]:
+    """
+    Group images that are near-duplicates of an earlier one.
+    Returns groups of indexes in upload order; the first index of each group is the one to keep.
+    Images without a thumbnail are never merged.
+    """
+    groups: list[list[int]] = []
+    kept: list[tuple[int, np.ndarray]] = []
+    for i, thumbnail in enumerate(thumbnails):
+        if thumbnail is None:
+            groups.append([i])
+            kept.append((-1, None))
+            continue
+        dhash, histogram = image_signature(thumbnail)
+        for group, (kept_hash, kept_histogram) in zip(groups, kept):
+            if (
+                kept_histogram is not None
+                and (dhash ^ kept_hash).bit_count() <= max_hash_distance
+                and np.abs(histogram - kept_histogram).sum() <= max_histogram_distance
+            ):
+                group.append(i)
+                break
+        else:
+            groups.append([i])
+            kept.append((dhash, histogram))
+    return groups
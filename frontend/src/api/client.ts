@@ -27,29 +27,65 @@ const USE_MOCK = false;
  */
 const API_BASE = import.meta.env.VITE_API_BASE ?? "http://127.0.0.1:8000";
 
+/**
+ * IMAGE IDS
+ * ---------
+ * The backend stores every image it normalizes and returns its id (image_ids, uploads first).
+ * Files it already has are sent as "image_ids" instead of "images", so toggling fits
+ * re-sends only ids. If the backend has dropped an image (404), everything is uploaded again.
+ */
+const storedImageIds = new WeakMap<File, string>();
+
+function buildStyleForm(files: File[]): { fd: FormData; uploaded: File[] } {
+  const fd = new FormData();
+  const uploaded: File[] = [];
+
+  // MUST be "images" / "image_ids" to match FastAPI signature:
+  // eval_style(images: List[UploadFile] = File(None), image_ids: List[str] = Form(None))
+  for (const f of files) {
+    const id = storedImageIds.get(f);
+    if (id) {
+      fd.append("image_ids", id);
+    } else {
+      fd.append("images", f);
+      uploaded.push(f);
+    }
+  }
+  return { fd, uploaded };
+}
+
+async function postStyleForm(path: string, files: File[]): Promise<{ res: Response; uploaded: File[] }> {
+  let { fd, uploaded } = buildStyleForm(files);
+  let res = await fetch(`${API_BASE}${path}`, { method: "POST", body: fd });
+
+  if (res.status === 404 && uploaded.length < files.length) {
+    for (const f of files) storedImageIds.delete(f);
+    ({ fd, uploaded } = buildStyleForm(files));
+    res = await fetch(`${API_BASE}${path}`, { method: "POST", body: fd });
+  }
+  return { res, uploaded };
+}
+
+function rememberImageIds(uploaded: File[], imageIds: string[] | undefined) {
+  uploaded.forEach((f, i) => {
+    if (imageIds?.[i]) storedImageIds.set(f, imageIds[i]);
+  });
+}
+
 /**
  * ANALYZE (CONNECTED TO BACKEND)
  * ------------------------------
  * When USE_MOCK === false:
  *  - POST /eval-style
  *  - multipart/form-data
- *  - field name: "images"
- *  - response: { answer: IdentityResult }
+ *  - field names: "images" (new files) and "image_ids" (files the backend already has)
+ *  - response: { answer: IdentityResult, image_ids }
  */
 export async function analyzeBatch(files: File[]): Promise<IdentityResult> {
   if (USE_MOCK) return mockAnalyzeBatch(files);
 
-  const fd = new FormData();
-
-  // MUST be "images" to match FastAPI signature:
-  // eval_style(images: List[UploadFile] = File(...))
-  for (const f of files) fd.append("images", f);
-
   // Call backend API
-  const res = await fetch(`${API_BASE}/eval-style`, {
-    method: "POST",
-    body: fd,
-  });
+  const { res, uploaded } = await postStyleForm("/eval-style", files);
 
   // Handle errors
   if (!res.ok) {
@@ -59,9 +95,49 @@ export async function analyzeBatch(files: File[]): Promise<IdentityResult> {
 
   // Parse response
   const data = await res.json();
+  rememberImageIds(uploaded, data.image_ids);
   return data.answer as IdentityResult;
 }
 
+/**
+ * ANALYZE, STREAMING (CONNECTED TO BACKEND)
+ * -----------------------------------------
+ * Same request as analyzeBatch, but against POST /eval-style/stream (Server-Sent Events).
+ * The backend sends each part of the Style DNA as soon as the model has finished it:
+ *  - current_style, current_summary, current_score, improved_style
+ *  - personality: { personality, emoji }
+ *  - done: { answer: IdentityResult, image_ids }   |   error: { detail }
+ * onPartial is called with everything received so far, so the UI can render progressively.
+ */
+export async function analyzeBatchStream(
+  files: File[],
+  onPartial: (partial: Partial<IdentityResult>) => void
+): Promise<IdentityResult> {
+  if (USE_MOCK) return mockAnalyzeBatch(files);
+
+  const { res, uploaded } = await postStyleForm("/eval-style/stream", files);
+
+  if (!res.ok || !res.body) {
+    const text = await res.text().catch(() => "");
+    throw new Error(`eval-style failed (${res.status}): ${text}`);
+  }
+
+  let partial: Partial<IdentityResult> = {};
+
+  for await (const { event, data } of readEvents(res.body)) {
+    if (event === "error") throw new Error(`eval-style failed: ${data.detail}`);
+    if (event === "done") {
+      rememberImageIds(uploaded, data.image_ids);
+      return data.answer as IdentityResult;
+    }
+
+    partial = event === "personality" ? { ...partial, ...data } : { ...partial, [event]: data };
+    onPartial(partial);
+  }
+
+  throw new Error("eval-style stream ended without a result");
+}
+
 /**
  * RECOMMENDATIONS MULTI (CONNECTED TO BACKEND)
  * -----------------------------------------------
@@ -72,7 +148,7 @@ export async function analyzeBatch(files: File[]): Promise<IdentityResult> {
 export async function getRecommendations(style: StyleDesc): Promise<Record<string, Recommendation[]>> {
   if (USE_MOCK) return mockRecommendMulti();
 
-  const res = await fetch(`${API_BASE}/recommendations-multi`, {
+  const res = await fetch(`${API_BASE}/recommendations-multi?compact=true`, {
     method: "POST",
     headers: {
       "Content-Type": "application/json",
@@ -83,6 +159,7 @@ export async function getRecommendations(style: StyleDesc): Promise<Record<strin
       fit: style.fit,
       textures: style.textures,
       accessories: style.accessories,
+      hexcolors: style.hexcolors,
     }),
   });
 
@@ -93,7 +170,97 @@ export async function getRecommendations(style: StyleDesc): Promise<Record<strin
 
   const data = await res.json();
   console.log(data.results)
-  return data.results as Record<string, Recommendation[]>;
+  const results: Record<string, Recommendation[]> = {};
+  for (const [category, items] of Object.entries(data.results as Record<string, Recommendation[]>)) {
+    results[category] = withReasons(items, data.reasons?.[category]);
+  }
+  return results;
+}
+
+/**
+ * RECOMMENDATIONS MULTI, STREAMING (CONNECTED TO BACKEND)
+ * --------------------------------------------------------
+ * POST /recommendations-multi/stream (Server-Sent Events)
+ *  - search_terms: { tops, bottoms, accessories } queries
+ *  - category: { category, results, reasons, failed, degraded } as each Shopify query finishes
+ *  - done: { failed, degraded, search_terms_degraded }   |   error: { detail }
+ * onPartial is called with the categories received so far.
+ */
+export async function getRecommendationsStream(
+  style: StyleDesc,
+  onPartial: (partial: Record<string, Recommendation[]>) => void
+): Promise<Record<string, Recommendation[]>> {
+  if (USE_MOCK) return mockRecommendMulti();
+
+  const res = await fetch(`${API_BASE}/recommendations-multi/stream?compact=true`, {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+    },
+    body: JSON.stringify({
+      style_name: style.name,
+      colors: style.colors,
+      fit: style.fit,
+      textures: style.textures,
+      accessories: style.accessories,
+      hexcolors: style.hexcolors,
+    }),
+  });
+
+  if (!res.ok || !res.body) {
+    const text = await res.text().catch(() => "");
+    throw new Error(`recommendations-multi failed (${res.status}): ${text}`);
+  }
+
+  let results: Record<string, Recommendation[]> = {};
+
+  for await (const { event, data } of readEvents(res.body)) {
+    if (event === "error") throw new Error(`recommendations-multi failed: ${data.detail}`);
+    if (event === "done") return results;
+
+    if (event === "category") {
+      results = { ...results, [data.category]: withReasons(data.results, data.reasons) };
+      onPartial(results);
+    }
+  }
+
+  throw new Error("recommendations-multi stream ended without a result");
+}
+
+/**
+ * Compact responses (?compact=true) send each category's reasons once, not on every item.
+ */
+function withReasons(items: Recommendation[], reasons: string[] | undefined): Recommendation[] {
+  return items.map((item) => ({ ...item, reasons: item.reasons ?? reasons ?? [] }));
+}
+
+/**
+ * Parse a Server-Sent Events body into { event, data } pairs (data is JSON-decoded).
+ */
+async function* readEvents(body: ReadableStream<Uint8Array>): AsyncGenerator<{ event: string; data: any }> {
+  const reader = body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = "";
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) return;
+    buffer += value;
+
+    // Events are separated by a blank line
+    let sep: number;
+    while ((sep = buffer.indexOf("\n\n")) !== -1) {
+      const raw = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+
+      let event = "message";
+      let data = "";
+      for (const line of raw.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+      }
+      if (data) yield { event, data: JSON.parse(data) };
+    }
+  }
 }
 
 /* ---------- MOCK IMPLEMENTATIONS (Frontend-only demo mode) ---------- */
@@ -110,8 +277,10 @@ async function mockAnalyzeBatch(_files: File[]): Promise<IdentityResult> {
       layering: "light-midweight; hoodie/jacket over tee; simple stacking",
       accessories: ["white sneakers", "cap", "silver chain"],
     },
-    current_summary:
-      "neutral base; clean silhouettes; consistent streetwear; improve: 1 statement layer, sharper color harmony, upgraded accessories",
+    current_summary: [
+      "neutral base; clean silhouettes; consistent streetwear",
+      "improve: 1 statement layer, sharper color harmony, upgraded accessories",
+    ],
     current_score: 7,
     improved_style: {
       name: "refined minimal streetwear (sharp + elevated)",
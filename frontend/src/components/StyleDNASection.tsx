@@ -192,7 +192,8 @@ function StyleCard({
   );
 }
 
-export default function StyleDNASection({ identity }: { identity?: IdentityResult | null }) {
+// identity may be partial while /eval-style/stream is still sending fields
+export default function StyleDNASection({ identity }: { identity?: Partial<IdentityResult> | null }) {
   return (
     <section
       className="vault-panel fade-up"
@@ -219,7 +220,7 @@ export default function StyleDNASection({ identity }: { identity?: IdentityResul
           </div>
           <h1 style={{ margin: 0, fontSize: 24 }}>
 
-            {identity ? identity?.emoji + "  The " + identity?.personality  : "to be determined ..."}
+            {identity?.personality ? identity?.emoji + "  The " + identity?.personality : identity ? "being minted ..." : "to be determined ..."}
           </h1>
           
         </div>
@@ -232,40 +233,46 @@ export default function StyleDNASection({ identity }: { identity?: IdentityResul
         </p>
       ) : (
         <div style={{ marginTop: 12, display: "flex", flexDirection: "column", gap: 12, minWidth: 0 }}>
-          <div className="vault-card" style={{ padding: 14, borderRadius: 16, minWidth: 0 }}>
-            <div style={{ fontSize: 12, opacity: 0.7, fontWeight: 800 }}>SUMMARY</div>
-            <div
-              style={{
-                marginTop: 8,
-                opacity: 0.9,
-                lineHeight: 1.35,
-                overflowWrap: "anywhere",
-                wordBreak: "break-word",
-                whiteSpace: "pre-wrap",
-                textAlign: "left",
-              }}
-            >
-              {identity.current_summary.map((point: string, i: number) => (
-                <div key={i} style={{ marginBottom: i < identity.current_summary.length - 1 ? 6 : 0 }}>
-                  • {point}
-                </div>
-              ))}
+          {identity.current_summary && (
+            <div className="vault-card" style={{ padding: 14, borderRadius: 16, minWidth: 0 }}>
+              <div style={{ fontSize: 12, opacity: 0.7, fontWeight: 800 }}>SUMMARY</div>
+              <div
+                style={{
+                  marginTop: 8,
+                  opacity: 0.9,
+                  lineHeight: 1.35,
+                  overflowWrap: "anywhere",
+                  wordBreak: "break-word",
+                  whiteSpace: "pre-wrap",
+                  textAlign: "left",
+                }}
+              >
+                {identity.current_summary.map((point: string, i: number, points: string[]) => (
+                  <div key={i} style={{ marginBottom: i < points.length - 1 ? 6 : 0 }}>
+                    • {point}
+                  </div>
+                ))}
+              </div>
             </div>
-          </div>
+          )}
 
-          <StyleCard
-            title="CURRENT STYLE"
-            subtitle="What your outfits currently signal most often."
-            accent="current"
-            desc={identity.current_style}
-          />
+          {identity.current_style && (
+            <StyleCard
+              title="CURRENT STYLE"
+              subtitle="What your outfits currently signal most often."
+              accent="current"
+              desc={identity.current_style}
+            />
+          )}
 
-          <StyleCard
-            title="IMPROVED STYLE"
-            subtitle="Upgraded direction: clearer silhouette, better materials, cleaner palette."
-            accent="improved"
-            desc={identity.improved_style}
-          />
+          {identity.improved_style && (
+            <StyleCard
+              title="IMPROVED STYLE"
+              subtitle="Upgraded direction: clearer silhouette, better materials, cleaner palette."
+              accent="improved"
+              desc={identity.improved_style}
+            />
+          )}
         </div>
       )}
     </section>
@@ -1,7 +1,7 @@
 // FitCheckPage.tsx
 import { useMemo, useState } from "react";
 import type { FitRun, IdentityResult, Recommendation } from "../types";
-import { analyzeBatch, getRecommendations } from "../api/client";
+import { analyzeBatchStream, getRecommendationsStream } from "../api/client";
 
 import Header from "../components/Header";
 import UploadPanel from "../components/UploadPanel";
@@ -25,6 +25,8 @@ export default function FitCheckPage() {
   const [activeId, setActiveId] = useState<string | null>(null);
 
   const [identity, setIdentity] = useState<IdentityResult | null>(null);
+  // Style DNA fields received so far while /eval-style/stream is running
+  const [partialIdentity, setPartialIdentity] = useState<Partial<IdentityResult> | null>(null);
   const [recommendations, setRecommendations] = useState<Record<string, Recommendation[]> | null>(null);
 
   const [loadingAnalyze, setLoadingAnalyze] = useState(false);
@@ -104,12 +106,17 @@ export default function FitCheckPage() {
     setLoadingAnalyze(true);
 
     try {
-      const result = await analyzeBatch(runs.filter((run) => run.selected).map((run) => run.imageFile));
-      setIdentity(result);
+      setIdentity(null);
       setRecommendations(null);
+      const result = await analyzeBatchStream(
+        runs.filter((run) => run.selected).map((run) => run.imageFile),
+        setPartialIdentity
+      );
+      setIdentity(result);
     } catch {
       setError("Analyze failed. Is the backend running?");
     } finally {
+      setPartialIdentity(null);
       setLoadingAnalyze(false);
     }
   }
@@ -120,7 +127,8 @@ export default function FitCheckPage() {
     setLoadingRecommend(true);
 
     try {
-      const recs = await getRecommendations(identity.improved_style);
+      // Each category paints as soon as its Shopify search finishes
+      const recs = await getRecommendationsStream(identity.improved_style, setRecommendations);
       setRecommendations(recs);
     } catch {
       setError("Recommendation failed. Is the backend running?");
@@ -203,7 +211,7 @@ export default function FitCheckPage() {
       />
 
       <div style={{ display: "grid", gridTemplateColumns: "1fr 1fr", gap: 14 }}>
-        <StyleDNASection identity={identity} />
+        <StyleDNASection identity={identity ?? partialIdentity} />
         <RecommendationsSection
           recommendations={recommendations ?? undefined}
           filter={sortMode}
@@ -15,7 +15,7 @@ export type StyleDesc = {
 
 export type IdentityResult = {
   current_style: StyleDesc;
-  current_summary: string;
+  current_summary: string[];
   current_score: number; // 1-10
   improved_style: StyleDesc;
   personality: string;